@@ -11,7 +11,14 @@ def main(args):
         resolution=0.02,
         occ_avoid_radius=0.2,
         save_memory=args.save_memory,
-        debug=args.debug
+        debug=args.debug,
+        frame_coverage_threshold=args.frame_coverage_threshold,
+        ram_keyframe_interval=args.ram_keyframe_interval,
+        sam2_disk_cache=args.sam2_disk_cache,
+        adaptive_resolution=args.adaptive_resolution,
+        mask_propagation_interval=args.mask_propagation_interval,
+        inference_backend=args.inference_backend,
+        model_memory_budget_gb=args.model_memory_budget_gb
     )
 
     if args.scanning_room:
@@ -82,6 +89,20 @@ if __name__ == "__main__":
     parser.add_argument('--semantic_device', type=str, default="cuda",
                         choices=["cuda", "cpu"],
                         help='Device hint for RAM model (cpu/cuda). GroundingDINO/SAM2/CLIP always use GPU if available.')
+    parser.add_argument('--frame_coverage_threshold', type=float, default=0.0,
+                        help='Skip semantic memory on frames adding less new voxel coverage than this ratio (0 keeps every frame).')
+    parser.add_argument('--ram_keyframe_interval', type=int, default=1,
+                        help='Run RAM tagging every n-th frame, other frames reuse the tags of neighbouring keyframes.')
+    parser.add_argument('--sam2_disk_cache', action='store_true', help='Keep SAM2 image embeddings on disk (fp16) across runs.')
+    parser.add_argument('--adaptive_resolution', action='store_true', 
+                        help='Run GroundingDINO downscaled first, full resolution only for frames with small or low-confidence detections.')
+    parser.add_argument('--mask_propagation_interval', type=int, default=1,
+                        help='Detect every n-th frame, the frames between get keyframe masks reprojected with poses and depth.')
+    parser.add_argument('--inference_backend', type=str, default="eager",
+                        choices=["eager", "cpu_int8"],
+                        help='CLIP / RAM inference backend, cpu_int8 runs int8 quantized models on CPU.')
+    parser.add_argument('--model_memory_budget_gb', type=float, default=None,
+                        help='Memory budget of the shared model registry in GB, least recently used models are evicted (default no limit).')
     parser.add_argument('--skip_ace', action='store_true', help='Skip ACE training during preprocessing.')
     parser.add_argument('--skip_lightglue', action='store_true', help='Skip LightGlue feature extraction.')
     parser.add_argument('--debug', action='store_true', help='For debug mode.')
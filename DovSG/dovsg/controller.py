@@ -1,11 +1,16 @@
 import numpy as np
-from dovsg.utils.utils import RECORDER_DIR, get_inlier_mask
+from dovsg.utils.utils import RECORDER_DIR, get_inlier_mask, sam2_embedding_cache_dir
+from dovsg.utils.pipeline import Stage, STOP
+from dovsg.utils.model_registry import model_registry
 from dovsg.scripts.zmq_socket import ZmqSocket
 from dovsg.scripts.realsense_recorder import RecorderImage
 from dovsg.scripts.rgb_feature_match import RGBFeatureMatch
 from dovsg.navigation.pathplanning import PathPlanning 
 from dovsg.navigation.instances_localizer import InstanceLocalizer
 from dovsg.memory.instances.instance_process import InstanceProcess
+from dovsg.memory.semantic_memory_store import SemanticMemoryStore, SemanticMemoryWriter
+from dovsg.memory.ram_tags import merge_tags
+from dovsg.memory.mask_propagation import MaskPropagator
 from dovsg.memory.scene_graph.scene_graph_processer import SceneGraphProcesser
 from dovsg.task_planning.gpt_task_planning import TaskPlanning
 from transforms3d.quaternions import mat2quat
@@ -13,6 +18,7 @@ from transforms3d.quaternions import mat2quat
 from ace.train_ace import train_ace as _train_ace
 from ace.test_ace import test_ace as _test_ace
 import threading
+import queue
 import cv2
 import subprocess
 import torch
@@ -59,6 +65,21 @@ class Controller():
             text_threshold: float=0.1,
             nms_threshold: float=0.5,
             delete_rate: float=0.5,
+            # covisibility frame skipping for semantic memory, 0 means process every frame
+            frame_coverage_threshold: float=0.0,
+            frame_min_views: int=3,
+            # RAM tags every n-th frame, the others reuse the tags of their neighbouring keyframes
+            ram_keyframe_interval: int=1,
+            # also keep SAM2 image embeddings on disk (fp16), they are always cached in memory
+            sam2_disk_cache: bool=False,
+            # coarse GroundingDINO pass first, full resolution only for frames with small or uncertain detections
+            adaptive_resolution: bool=False,
+            # detect every n-th frame, the others get the keyframe masks propagated with poses and depth
+            mask_propagation_interval: int=1,
+            # "eager" or "cpu_int8" (int8 quantized CLIP / RAM on cpu)
+            inference_backend: str="eager",
+            # memory budget of the shared model registry in GB, None for no limit
+            model_memory_budget_gb: Union[float, None]=None,
 
             save_memory: bool=True,
             debug: bool=False,  # for debug mode, use history data
@@ -86,6 +107,14 @@ class Controller():
         self.text_threshold = text_threshold
         self.nms_threshold = nms_threshold
         self.delete_rate = delete_rate
+        self.frame_coverage_threshold = frame_coverage_threshold
+        self.frame_min_views = frame_min_views
+        self.ram_keyframe_interval = ram_keyframe_interval
+        self.sam2_embedding_cache_dir = sam2_embedding_cache_dir if sam2_disk_cache else None
+        self.adaptive_resolution = adaptive_resolution
+        self.mask_propagation_interval = mask_propagation_interval
+        self.inference_backend = inference_backend
+        model_registry.set_memory_budget(model_memory_budget_gb)
         self.save_memory = save_memory
         self.debug = debug
         self.delete_object_bias = delete_object_bias
@@ -99,6 +128,16 @@ class Controller():
         self.recorder_dir = RECORDER_DIR / self.tags
 
         self.suffix = f"{self.interval}_{self.min_height}_{self.resolution}_{self.conservative}_{self.box_threshold}_{self.nms_threshold}"
+        if self.frame_coverage_threshold > 0:
+            self.suffix += f"_{self.frame_coverage_threshold}_{self.frame_min_views}"
+        if self.ram_keyframe_interval > 1:
+            self.suffix += f"_ram{self.ram_keyframe_interval}"
+        if self.adaptive_resolution:
+            self.suffix += "_adaptive"
+        if self.mask_propagation_interval > 1:
+            self.suffix += f"_prop{self.mask_propagation_interval}"
+        if self.inference_backend != "eager":
+            self.suffix += f"_{self.inference_backend}"
 
         self._memory_dir = self.recorder_dir / "memory" / self.suffix
         self.ace_network_path = self.recorder_dir / "ace/ace.pt"
@@ -146,6 +185,7 @@ class Controller():
         # semantic memory
         self.visualization_dir = self.memory_dir / "visualize"
         self.semantic_memory_dir = self.memory_dir / f"semantic_memory"
+        self.frame_selection_path = self.memory_dir / "frame_selection.json"
         self.classes_and_colors_path = self.memory_dir / "classes_and_colors.json"
 
         # instance memory
@@ -230,7 +270,8 @@ class Controller():
         mygroundingdino_sam2 = MyGroundingDINOSAM2(
             box_threshold=0.8,
             text_threshold=0.8,
-            nms_threshold=0.5
+            nms_threshold=0.5,
+            embedding_cache_dir=self.sam2_embedding_cache_dir
         )
         # case just has poses_droidslam, so we can't to use viewdataset,
         # we get data from floder
@@ -807,7 +848,8 @@ class Controller():
         self.instance_localizer = InstanceLocalizer(
             view_dataset=self.view_dataset,
             instances_objects=self.instance_objects,
-            device="cuda"
+            device="cuda",
+            backend=self.inference_backend
         )
 
     def get_view_dataset(self):
@@ -832,15 +874,73 @@ class Controller():
                 with open(self.view_dataset_path, 'wb') as f:
                     pickle.dump(self.view_dataset, f, protocol=4)
 
+    def select_semantic_frames(self):
+        # based on append log, only the latest appended frames need semantic memory
+        append_length = self.view_dataset.append_length_log[-1]
+        frame_indexes = list(range(len(self.view_dataset.names) - append_length, len(self.view_dataset.names)))
+        if self.frame_coverage_threshold <= 0:
+            return frame_indexes
+
+        keep_indexes, report = self.view_dataset.select_covisible_frames(
+            frame_indexes=frame_indexes,
+            min_new_coverage=self.frame_coverage_threshold,
+            min_views=self.frame_min_views
+        )
+        skipped = [info for info in report if not info["kept"]]
+        print(f"Covisibility frame selection: keep {len(keep_indexes)} / {len(frame_indexes)} frames, "
+              f"skip {len(skipped)} frames (coverage threshold {self.frame_coverage_threshold}).")
+        with open(self.frame_selection_path, "w") as f:
+            json.dump({
+                "coverage_threshold": self.frame_coverage_threshold,
+                "min_views": self.frame_min_views,
+                "kept": [self.view_dataset.names[cnt] for cnt in keep_indexes],
+                "skipped": [info["name"] for info in skipped],
+                "frames": report
+            }, f, indent=4)
+        return keep_indexes
+
+    def get_keyframe_positions(self, length: int, interval: int) -> List[int]:
+        '''every interval-th position and the last one'''
+        keyframes = list(range(0, length, interval))
+        if length > 0 and keyframes[-1] != length - 1:
+            keyframes.append(length - 1)
+        return keyframes
+
+    def get_frame_tags(self, semantic_memory, images: List[np.ndarray]) -> List[str]:
+        '''
+        RAM runs on every ram_keyframe_interval-th frame (and the last one), each other frame
+        uses the union of the tags of its previous and next keyframe.
+        '''
+        keyframes = self.get_keyframe_positions(len(images), self.ram_keyframe_interval)
+        keyframe_tags = {}
+        with torch.no_grad():
+            for cnt in tqdm(keyframes, desc="ram tagging"):
+                keyframe_tags[cnt] = semantic_memory.get_tags(images[cnt])
+        # new tags are written once per tagging pass
+        semantic_memory.tag_cache.save()
+        print(f"RAM tag cache: {semantic_memory.tag_cache.hits} hits, {semantic_memory.tag_cache.misses} misses")
+
+        frame_tags = []
+        for cnt in range(len(images)):
+            position = np.searchsorted(keyframes, cnt)
+            if keyframes[position] == cnt:
+                frame_tags.append(keyframe_tags[cnt])
+            else:
+                frame_tags.append(merge_tags(keyframe_tags[keyframes[position - 1]], keyframe_tags[keyframes[position]]))
+        return frame_tags
+
     def get_semantic_memory(
             self,
             device: float="cuda",
             visualize_results: bool=True,
+            queue_size: int=4
     ):
         ## in this function, classes_and_colors also been getted and save
         # this function is only memory, save when after process
-        if self.semantic_memory_dir.exists() and \
-                len(list(self.semantic_memory_dir.iterdir())) == self.view_dataset.append_length_log[-1]:
+        frame_indexes = self.select_semantic_frames()
+        names = [self.view_dataset.names[cnt] for cnt in frame_indexes]
+        semantic_memory_store = SemanticMemoryStore(self.semantic_memory_dir)
+        if semantic_memory_store.names == names:
                 print("\n\nFound cache semantic_memory, don't need process!\n\n")
                 with open(self.classes_and_colors_path, "r") as f:
                     self.classes_and_colors = json.load(f)
@@ -851,10 +951,7 @@ class Controller():
         self.semantic_memory_dir.mkdir(exist_ok=True)
         from dovsg.memory.ram_groundingdino_sam2_clip_semantic_memory import RamGroundingDinoSAM2ClipDataset
 
-        # based on append log for image retrival
-        append_length = self.view_dataset.append_length_log[-1]
-        images = self.view_dataset.images[-append_length:]
-        names = self.view_dataset.names[-append_length:]
+        images = [self.view_dataset.images[cnt] for cnt in frame_indexes]
 
         if self.classes_and_colors is None:
             self.classes_and_colors = {
@@ -868,27 +965,103 @@ class Controller():
             text_threshold=self.text_threshold,
             nms_threshold=self.nms_threshold,
             device=device,
+            backend=self.inference_backend,
+            embedding_cache_dir=self.sam2_embedding_cache_dir,
+            adaptive_resolution=self.adaptive_resolution
         )
 
-        with torch.no_grad():
-            for cnt in tqdm(range(len(images)), total=len(images), desc="semantic meomry"):
-                image = images[cnt]
-                name = names[cnt]
-                det_res, annotated_image, image_pil = semantic_memory.semantic_process(image=image)
-                
-                if visualize_results:
-                    assert self.visualization_dir is not None
-                    cv2.imwrite(str(self.visualization_dir / f"{name}.jpg"), 
-                    cv2.cvtColor(annotated_image, cv2.COLOR_RGB2BGR))
-                    image_pil.save(self.visualization_dir / f"{name}_Clean.jpg")
-                detection_save_path = self.semantic_memory_dir / f"{name}.pkl"
+        # with mask propagation only keyframes go through the detector, the frames between two keyframes
+        # get the masks of the nearer one reprojected, see MaskPropagator
+        mask_propagator = MaskPropagator(self.view_dataset)
+        mask_propagation_interval = self.mask_propagation_interval
+        if mask_propagation_interval > 1 and not mask_propagator.has_poses(frame_indexes):
+            print("Mask propagation needs the camera poses, which this cached view dataset does not hold, "
+                  "detecting every frame")
+            mask_propagation_interval = 1
+        keyframes = self.get_keyframe_positions(len(images), mask_propagation_interval)
+
+        # a previous run that died left complete shards holding a prefix of the frames, resume after them.
+        # Frames are written in order, so the stored frames run up to some frame after the last stored keyframe,
+        # processing restarts at that keyframe and only the frames not stored yet are written
+        start = len(semantic_memory_store)
+        resume = len(semantic_memory_store.shards) > 0 and semantic_memory_store.names == names[:start]
+        if resume:
+            print(f"Resume semantic memory after {start} completed frames")
+            for name in names[:start]:
+                semantic_memory.global_classes.update(semantic_memory_store.get_classes(name))
+            # position in keyframes of the last stored keyframe
+            first_keyframe = np.searchsorted(keyframes, start) - 1
+            previous_keyframe = (keyframes[first_keyframe], semantic_memory_store.load(names[keyframes[first_keyframe]]))
+            first_keyframe += 1
+        else:
+            start, first_keyframe, previous_keyframe = 0, 0, None
+
+        frame_tags = self.get_frame_tags(semantic_memory, [images[cnt] for cnt in keyframes[first_keyframe:]])
+
+        # staged pipeline: inference (this thread) -> postprocess / serialization -> visualization,
+        # so the models never wait for mask encoding, jpeg encoding or disk writes.
+        # images are already in memory (view_dataset), so there is no load stage in front of inference
+        semantic_memory_writer = SemanticMemoryWriter(self.semantic_memory_dir, resume=resume)
+        postprocess_queue = queue.Queue(maxsize=queue_size)
+        vis_queue = queue.Queue(maxsize=queue_size) if visualize_results else None
+
+        def postprocess(item):
+            name, image, det_res = item
+            semantic_memory_writer.add(name, det_res)
+            return item
+
+        def visualize(item):
+            name, image, det_res = item
+            annotated_image = semantic_memory.annotate(image, det_res)
+            cv2.imwrite(str(self.visualization_dir / f"{name}.jpg"), 
+                cv2.cvtColor(annotated_image, cv2.COLOR_RGB2BGR))
+            Image.fromarray(image).save(self.visualization_dir / f"{name}_Clean.jpg")
+
+        stages = [Stage(func=postprocess, in_queue=postprocess_queue, out_queue=vis_queue, name="postprocess")]
+        if visualize_results:
+            assert self.visualization_dir is not None
+            stages.append(Stage(func=visualize, in_queue=vis_queue, name="visualize"))
+        for stage in stages:
+            stage.start()
 
-                with open(detection_save_path, "wb") as f:
-                    pickle.dump(det_res, f)
+        # the writer also flushes the frames completed so far when anything below fails
+        with semantic_memory_writer, torch.no_grad():
+            try:
+                for cnt, tags in tqdm(zip(keyframes[first_keyframe:], frame_tags), total=len(keyframes) - first_keyframe, desc="semantic meomry"):
+                    name, image = names[cnt], images[cnt]
+                    det_res, _, _ = semantic_memory.semantic_process(image=image, visualize=False, tags=tags)
+                    if previous_keyframe is not None:
+                        previous_cnt, previous_det_res = previous_keyframe
+                        for between_cnt in range(max(previous_cnt + 1, start), cnt):
+                            if between_cnt - previous_cnt <= cnt - between_cnt:
+                                source_cnt, source_det_res = previous_cnt, previous_det_res
+                            else:
+                                source_cnt, source_det_res = cnt, det_res
+                            between_det_res = mask_propagator.propagate(
+                                source_index=frame_indexes[source_cnt], 
+                                det_res=source_det_res, 
+                                target_index=frame_indexes[between_cnt]
+                            )
+                            postprocess_queue.put((names[between_cnt], images[between_cnt], between_det_res))
+                    postprocess_queue.put((name, image, det_res))
+                    previous_keyframe = (cnt, det_res)
+                    for stage in stages:
+                        stage.check()
+            finally:
+                postprocess_queue.put(STOP)
+                for stage in stages:
+                    stage.join()
+        for stage in stages:
+            stage.check()
+        if self.adaptive_resolution:
+            print(f"Adaptive resolution: {semantic_memory.mygroundingdino_sam2.coarse_resolution_frames} frames coarse, "
+                  f"{semantic_memory.mygroundingdino_sam2.full_resolution_frames} frames full resolution")
 
         self.classes_and_colors = semantic_memory.get_classes_and_colors()
         with open(self.classes_and_colors_path, "w") as f:
             json.dump(self.classes_and_colors, f)
+        # text features of new class names are written once per run
+        semantic_memory.myclip.text_feature_cache.save()
 
         # clear gpu memory
         del semantic_memory
@@ -1022,13 +1195,14 @@ class Controller():
 
     def pick_up(self, object1: str, observations: dict, is_visualize=False):
         print(f"Runing Pick up({object1}) Task.")
-        # on each pick up or place, re-set object_handler to spend for GPU memory save
+        # object_handler is re-set on each pick up or place, its models are shared through model_registry
         from dovsg.manipulation.objecthandler import ObjectHandler
         object_handler = ObjectHandler(
             box_threshold=0.6,
             text_threshold=0.6,
             device="cuda",
-            is_visualize=is_visualize
+            is_visualize=is_visualize,
+            embedding_cache_dir=self.sam2_embedding_cache_dir
         )
 
         target_pose = object_handler.pickup(
@@ -1054,13 +1228,14 @@ class Controller():
 
     def place(self, object1: str=None, object2: str=None, observations: dict={}, is_visualize=False):
         print(f"Runing Place({object1}, {object2}) Task.")
-        # on each pick up or place, re-set object_handler to spend for GPU memory save
+        # object_handler is re-set on each pick up or place, its models are shared through model_registry
         from dovsg.manipulation.objecthandler import ObjectHandler
         object_handler = ObjectHandler(
             box_threshold=0.2,
             text_threshold=0.2,
             device="cuda",
-            is_visualize=is_visualize
+            is_visualize=is_visualize,
+            embedding_cache_dir=self.sam2_embedding_cache_dir
         )
 
         place_pose = object_handler.place(
@@ -1179,6 +1354,7 @@ class Controller():
                     self.get_pathplanning()
                     
         print("Long-term task execution success!")
+        model_registry.print_stats()
 
     def show_instances(self, instance_objects, show_background=False, scene_graph=None, clip_vis=False):
         """
@@ -1282,6 +1458,8 @@ class Controller():
             self.view_dataset.masks.append(mask)
             self.view_dataset.names.append(f"{int(self.view_dataset.names[-1]) + 1:06}")
             self.view_dataset.global_points.append(global_point)
+            if hasattr(self.view_dataset, "poses"):
+                self.view_dataset.poses.append(pose)
             
             # # self.bounds now are not support change,
             # # cause it will spend lot time
@@ -1304,43 +1482,23 @@ class Controller():
 
     
     def update_instance_objects(self, need_delete_indexes: list):
-        # _new_instances = self.del_instances_by_indexes(self.instance_objects, need_delete_indexes)
-        delete_objects = []
-        for ins_obj in self.instance_objects:
-            indexes = ins_obj["indexes"]
-            inter_indexes = np.intersect1d(indexes, need_delete_indexes)
-            inter_rate = len(inter_indexes) / len(indexes)
-
-            # get object name
-            values, counts = np.unique(ins_obj["class_name"], return_counts=True)
-            class_name = values[np.argmax(counts)]
-            # print(class_name, inter_rate)
-
-            if inter_rate > self.delete_rate:
-                delete_objects.append(ins_obj)
-            else:
-                # ins_obj["indexes"] = [idx for idx in indexes if idx not in inter_indexes]
-                # make sure the type of indexes is list
-                ins_obj["indexes"] = list(np.setdiff1d(indexes, inter_indexes))
-            
-        for ins_obj in delete_objects:
-            self.instance_objects.remove(ins_obj)
-
         # Based on the new view_dataset, update semantic memory 
         # and save it in the semantic memory folder under the current setp
         self.get_semantic_memory()
 
-        # Update instances based on the newly saved semantic memory and view_dataset
+        # Remove the deleted indexes from the instances and associate only the new observations,
+        # the objects changed by neither are skipped where the result stays the one of a full pass
         instance_process = InstanceProcess(
             downsample_voxel_size=self.resolution,
             part_level_classes=self.part_level_classes
         )
 
-        self.instance_objects, self.object_filter_indexes = instance_process.get_instances(
+        self.instance_objects, self.object_filter_indexes = instance_process.update_instances(
             memory_dir=self.memory_dir,
             view_dataset=self.view_dataset,
-            # classes=self.classes_and_colors["classes"],
             objects=self.instance_objects,
+            deleted_indexes=need_delete_indexes,
+            delete_rate=self.delete_rate,
             obj_min_detections=2,
         )
 
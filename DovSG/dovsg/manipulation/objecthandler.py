@@ -9,6 +9,7 @@ from IPython import embed
 import cv2
 from dovsg.utils.utils import anygrasp_checkpoint_path
 from dovsg.perception.models.mygroundingdinosam2 import MyGroundingDINOSAM2
+from dovsg.utils.model_registry import model_registry
 import copy
 from PIL import ImageDraw, Image
 from scipy.spatial.transform import Rotation as R
@@ -18,6 +19,11 @@ cfgs = OmegaConf.load(config_path)
 cfgs.max_gripper_width = max(0, min(0.1, cfgs.max_gripper_width))
 cfgs.checkpoint_path = anygrasp_checkpoint_path
 
+def load_anygrasp():
+    grasping_model = AnyGrasp(cfgs)
+    grasping_model.load_net()
+    return grasping_model
+
 class ObjectHandler():
     def __init__(
         self,
@@ -28,7 +34,8 @@ class ObjectHandler():
         robot_min_height = -0.32,
         robot_max_height = 0.7,
         rot_cost_rate = 0.70,
-        gripper_length=0.172
+        gripper_length=0.172,
+        embedding_cache_dir=None
     ):
         self.is_visualize = is_visualize
         self.robot_min_height = robot_min_height
@@ -36,13 +43,13 @@ class ObjectHandler():
         self.rot_cost_rate = rot_cost_rate
         self.gripper_length = gripper_length
 
-        self.grasping_model = AnyGrasp(cfgs)
-        self.grasping_model.load_net()
+        self.grasping_model = model_registry.get("anygrasp", load_anygrasp)
         # ### Initialize the GroundingDINO SAM2 model ###
         self.mygroundingdino_sam2 = MyGroundingDINOSAM2(
             box_threshold=box_threshold,
             text_threshold=text_threshold,
-            device=device
+            device=device,
+            embedding_cache_dir=embedding_cache_dir
         )
 
         self.gripper_initial_pose = np.array([
@@ -1,4 +1,5 @@
 import json
+import os
 import numpy as np
 from pathlib import Path
 from collections.abc import Iterable
@@ -12,14 +13,17 @@ from PIL import Image
 import cv2
 from typing import Union
 from collections import Counter
-import faiss
 import sys
 import time
+import hashlib
 from typing import List, Tuple
 
-from dovsg.memory.instances.instance_utils import DetectionList, MapObjectList
-from dovsg.memory.instances.instance_utils import to_tensor, to_numpy, get_bbox
+from dovsg.memory.instances.instance_utils import DetectionList, MapObjectList, SpatialHash
+from dovsg.memory.instances.instance_utils import to_tensor, to_numpy, get_bbox, voxel_overlap_ratios, voxel_dbscan
+from dovsg.memory.instances.instance_utils import get_box_arrays, boxes_intersect
 from dovsg.memory.view_dataset import ViewDataset
+from dovsg.memory.semantic_memory_store import SemanticMemoryStore, RLEMask
+from dovsg.utils.pipeline import ordered_map
 # from dovisg.utils.instance_utils import load_result
 from sklearn.cluster import DBSCAN
 from sklearn.neighbors import NearestNeighbors
@@ -29,9 +33,12 @@ class InstanceProcess:
     def __init__(
         self,
         downsample_voxel_size: float=0.01,
-        part_level_classes: list=["handle"]
+        part_level_classes: list=["handle"],
+        # threads converting upcoming frames to detection lists, 0 converts in the main loop
+        num_workers: int=4
     ):
         self.downsample_voxel_size = downsample_voxel_size
+        self.num_workers = num_workers
 
         self.mask_area_threshold = 25
         self.max_bbox_area_ratio = 0.3
@@ -44,6 +51,8 @@ class InstanceProcess:
         # self.min_samples_ratio = 0.05
         self.min_samples = 10
         self.sample_rate = 0.95
+        # same eps and min_samples, clustered on the voxel grid instead of sklearn DBSCAN
+        self.denoise_on_voxel_grid = True
 
         # self.eps = self.downsample_voxel_size * 4
         self.expend_eps = self.downsample_voxel_size * 2
@@ -54,9 +63,17 @@ class InstanceProcess:
         self.sim_threshold = 0.75
         assert self.spatial_weight + self.vis_weight + self.text_weight == 1
         assert 0 < self.sim_threshold < 1
+        # cells of the spatial hash in voxels, detections are only compared with the objects in nearby cells.
+        # Pairs without spatial overlap never pass sim_threshold, so this does not change the association.
+        self.spatial_hash_cell_size = 4
 
         # Perform post-processing periodically if told so
         self.denoise_interval = 20
+        # denoise, merge and align passes skip the objects that did not change since a previous pass
+        # where the result stays the one of a full pass, see denoise_objects and get_dirty_objects
+        self.track_changes = True
+        # write a checkpoint every n processed frames, get_instances resumes from it. 0 disables it
+        self.checkpoint_interval = 100
 
         self.merge_overlap_thresh = 0.90
         self.merge_visual_sim_thresh = 0.95
@@ -78,7 +95,14 @@ class InstanceProcess:
         # classes,
         objects: Union[MapObjectList, None]=None,
         obj_min_detections=3,
+        changed: Union[np.ndarray, None]=None,
     ):
+        '''
+        changed: flags of the given objects changed since they were built (see update_instances). The merge and
+        align passes then only process the changed objects, the ones the new frames add or merge into and their
+        neighbours. None processes all.
+        A checkpoint in memory_dir written for the same frames is resumed from, see checkpoint_interval.
+        '''
 
         # The indexes that are initially identified as objects cannot 
         # be used as background indexes to avoid affecting the occupancy map.
@@ -90,31 +114,53 @@ class InstanceProcess:
         pixel_index_masks = self.view_dataset.pixel_index_masks[-append_length:]
         names = self.view_dataset.names[-append_length:]
 
-        self.denoise_interval = max(self.denoise_interval, int(append_length / 5))
+        # frames skipped by covisibility selection have no semantic memory
+        semantic_memory_store = SemanticMemoryStore(memory_dir / "semantic_memory")
+        frame_indexes = [idx for idx in range(len(names)) if names[idx] in semantic_memory_store]
+        # denoising is scheduled on the processed frames, skipped frames do not count
+        self.denoise_interval = max(self.denoise_interval, int(len(frame_indexes) / 5))
 
         self.class_id_counts = {}
 
-        if objects is not None:
-            objects, self.class_id_counts = self.load_objects(objects, self.class_id_counts)
+        checkpoint_path = Path(memory_dir) / "instance_checkpoint.pkl"
+        checkpoint = self.load_checkpoint(checkpoint_path, names) if self.checkpoint_interval > 0 else None
+        if checkpoint is not None:
+            objects = checkpoint["objects"]
+            # the unchanged objects of an incremental update, flagged as they are not the same arrays any more
+            changed = None if checkpoint["clean"] is None else ~checkpoint["clean"]
+            print(f"==> Resume instance process from {checkpoint_path} at frame {checkpoint['cursor']} / {len(frame_indexes)}")
+        elif objects is not None:
+            # boxes of an incremental update are kept up to date by update_instances
+            objects, self.class_id_counts = self.load_objects(objects, self.class_id_counts, check_boxes=changed is None)
         else:
             objects = MapObjectList()
-
-        for idx in tqdm(range(len(names)), desc="instance process"):
-            # image_original_pil = Image.fromarray(images[idx])
-            name = names[idx]
-            # load grounded SAM 2 detections
-            gsam2_obs = None # stands for grounded SAM 2 observations
-            detections_path = memory_dir / f"semantic_memory" / f"{name}.pkl"
-            with open(detections_path, "rb") as f:
-                gsam2_obs = pickle.load(f)
-
-            fg_detection_list = self.gsam2_obs_to_detection_list(
-                gsam2_obs=gsam2_obs,
+        # indexes of the unchanged objects before association, merges and additions replace them
+        clean_indexes = None if changed is None else [obj["indexes"] for obj, flag in zip(objects, changed) if not flag]
+        start = 0 if checkpoint is None else checkpoint["cursor"]
+
+        # the hash cells must cover the overlap tolerance, and without spatial overlap no pair may pass the threshold
+        use_spatial_hash = self.spatial_hash_cell_size > 0 and self.vis_weight + self.text_weight < self.sim_threshold
+        if use_spatial_hash:
+            spatial_hash = SpatialHash(self.view_dataset, cell_size=max(
+                self.spatial_hash_cell_size, int(np.ceil(self.downsample_voxel_size / self.view_dataset.resolution))))
+
+        def convert(idx):
+            return self.convert_gsam2_obs(
+                gsam2_obs=semantic_memory_store.load(names[idx]),
                 pixel_indexes=pixel_index_mappings[idx],
                 pixel_indexes_mask=pixel_index_masks[idx],
-                # class_names=classes,
-                image_name=name,
+                image_name=names[idx],
             )
+
+        # workers convert the next frames while the current one is associated, results come in frame order
+        conversions = ordered_map(convert, frame_indexes[start:], self.num_workers)
+        for cnt, (detections, original_indexes) in tqdm(enumerate(conversions, start=start), initial=start,
+                                                         total=len(frame_indexes), desc="instance process"):
+            if self.checkpoint_interval > 0 and cnt > start and cnt % self.checkpoint_interval == 0:
+                # state before frame_indexes[cnt] is associated
+                self.save_checkpoint(checkpoint_path, names, cnt, objects, clean_indexes)
+            # class ids and colors are given here, in frame order, so they do not depend on the workers
+            fg_detection_list = self.finalize_detections(detections, original_indexes)
             
             if len(fg_detection_list) == 0:
                 continue
@@ -127,9 +173,15 @@ class InstanceProcess:
                 # Skip the similarity computation 
                 continue
             
-            spatial_sim = self.compute_spatial_similarities(fg_detection_list, objects)
-            visual_sim = self.compute_visual_similarities(fg_detection_list, objects)
-            text_sim = self.compute_text_similarities(fg_detection_list, objects)
+            pairs = None
+            if use_spatial_hash:
+                spatial_hash.update(objects)
+                pairs = spatial_hash.candidate_pairs(fg_detection_list)
+            # cascade: features first, geometry only for the pairs that can still pass sim_threshold
+            visual_sim = self.compute_visual_similarities(fg_detection_list, objects, pairs)
+            text_sim = self.compute_text_similarities(fg_detection_list, objects, pairs)
+            pairs = self.score_bound_pairs(visual_sim, text_sim, pairs)
+            spatial_sim = self.compute_spatial_similarities(fg_detection_list, objects, pairs)
             agg_sim = self.aggregate_similarities(spatial_sim, visual_sim, text_sim)
 
             # Threshold sims according to sim_threshold. Set to negative infinity if below threshold
@@ -137,18 +189,18 @@ class InstanceProcess:
 
             objects = self.merge_detections_to_objects(fg_detection_list, objects, agg_sim)
 
-            if (idx+1) % self.denoise_interval == 0:
+            if (cnt+1) % self.denoise_interval == 0:
                 objects = self.denoise_objects(objects)
 
         print("====> denoise objects")
         objects = self.denoise_objects(objects)
         print("merge objects")
-        objects = self.merge_objects(objects)
+        objects = self.merge_objects(objects, self.get_dirty_objects(objects, clean_indexes))
 
         # Make each indexes only belonging to one instance-level object
         # using twice filter to filter invalid objects
         objects = self.filter_objects(objects, obj_min_detections=obj_min_detections)
-        objects = self.indexes_align_objects(objects)
+        objects = self.indexes_align_objects(objects, self.get_dirty_objects(objects, clean_indexes))
         objects = self.filter_objects(objects, obj_min_detections=obj_min_detections)
         
 
@@ -157,6 +209,9 @@ class InstanceProcess:
         
 
         objects_original_indexes = np.unique(self.objects_original_indexes)
+        if checkpoint_path.exists():
+            # finished, a later run must not resume from it
+            os.remove(checkpoint_path)
 
         # Handle case where no objects were detected
         indexes_list = objects.get_values("indexes")
@@ -174,48 +229,195 @@ class InstanceProcess:
     
     
     
-    def indexes_align_objects(self, objects: MapObjectList):
-        index_to_object = {}
+    def save_checkpoint(self, checkpoint_path: Path, names: list, cursor: int, objects: MapObjectList,
+                        clean_indexes: Union[list, None]):
+        '''
+        Objects (columnar, see ObjectStore, with their denoise fixed points), the frame cursor and all state
+        association depends on, including the random state of the instance colors, so a resumed run gives the same result.
+        '''
+        clean = None
+        if clean_indexes is not None:
+            clean_ids = {id(indexes) for indexes in clean_indexes}
+            clean = np.array([id(obj["indexes"]) in clean_ids for obj in objects], dtype=bool)
+        checkpoint = {
+            "names": list(names),
+            "cursor": cursor,
+            "objects": objects,
+            "clean": clean,
+            "class_id_counts": dict(self.class_id_counts),
+            "objects_original_indexes": np.unique(self.objects_original_indexes),
+            "random_state": np.random.get_state(),
+        }
+        # written next to it and renamed, a crash while writing keeps the previous checkpoint
+        temp_path = checkpoint_path.with_suffix(".tmp")
+        with open(temp_path, "wb") as f:
+            pickle.dump(checkpoint, f, protocol=4)
+        os.replace(temp_path, checkpoint_path)
+
+    def load_checkpoint(self, checkpoint_path: Path, names: list) -> Union[dict, None]:
+        '''checkpoint of the same frames or None, restores the state saved next to the objects'''
+        if not checkpoint_path.exists():
+            return None
+        with open(checkpoint_path, "rb") as f:
+            checkpoint = pickle.load(f)
+        if checkpoint["names"] != list(names):
+            print(f"==> Ignore {checkpoint_path}, it was written for other frames")
+            return None
+        self.class_id_counts = checkpoint["class_id_counts"]
+        self.objects_original_indexes = checkpoint["objects_original_indexes"].tolist()
+        np.random.set_state(checkpoint["random_state"])
+        return checkpoint
+
+    def update_instances(
+        self,
+        memory_dir,
+        view_dataset: ViewDataset,
+        objects: MapObjectList,
+        deleted_indexes: Union[np.ndarray, list],
+        delete_rate: float=0.5,
+        obj_min_detections=2,
+    ):
+        '''
+        Incremental get_instances for a new step: deleted_indexes are removed from the objects (objects losing more
+        than delete_rate of their voxels are deleted), then only the frames appended last are associated.
+        With track_changes, the objects touched by neither are skipped by the denoise, merge and align passes
+        where that gives the result of full passes.
+        '''
+        self.view_dataset = view_dataset
+        objects, changed = self.remove_indexes(objects, deleted_indexes, delete_rate)
+        return self.get_instances(memory_dir, view_dataset, objects=objects,
+                                  obj_min_detections=obj_min_detections, changed=changed)
+
+    def remove_indexes(self, objects: MapObjectList, deleted_indexes: Union[np.ndarray, list], delete_rate: float):
+        '''
+        Remove deleted voxels from all objects with one lookup of the concatenated indexes.
+        Returns the remaining objects and the flags of the ones that lost voxels. Their moments are updated and their
+        boxes recomputed exactly, a shrinking object may lose the extreme voxels the box was fitted to.
+        '''
+        deleted_indexes = np.unique(np.asarray(deleted_indexes, dtype=np.int64))
+        lengths = np.array([len(obj["indexes"]) for obj in objects], dtype=np.int64)
+        if len(objects) == 0 or len(deleted_indexes) == 0:
+            return MapObjectList(list(objects)), np.zeros(len(objects), dtype=bool)
+        indexes = np.concatenate([np.asarray(obj["indexes"], dtype=np.int64) for obj in objects])
+        deleted = np.isin(indexes, deleted_indexes, assume_unique=False)
+        offsets = np.r_[0, np.cumsum(lengths)]
+        num_deleted = np.add.reduceat(deleted, offsets[:-1]) * (lengths > 0)
+
+        kept_objects, changed = [], []
+        for i, obj in enumerate(objects):
+            if lengths[i] > 0 and num_deleted[i] / lengths[i] > delete_rate:
+                continue
+            if num_deleted[i] > 0:
+                object_deleted = deleted[offsets[i]:offsets[i + 1]]
+                removed = indexes[offsets[i]:offsets[i + 1]][object_deleted]
+                obj["indexes"] = indexes[offsets[i]:offsets[i + 1]][~object_deleted]
+                if "point_moments" in obj:
+                    obj["point_moments"] = obj["point_moments"] - self.get_point_moments(removed)
+                else:
+                    obj["point_moments"] = self.get_point_moments(obj["indexes"])
+                obj["bbox"] = self.get_bounding_box(obj["indexes"])
+                obj["bbox"].color = [0,1,0]
+            kept_objects.append(obj)
+            changed.append(num_deleted[i] > 0)
+        print(f"remove indexes: {len(objects) - len(kept_objects)} objects deleted, {int(np.sum(changed))} changed")
+        return MapObjectList(kept_objects), np.array(changed, dtype=bool)
+
+    def get_dirty_objects(self, objects: MapObjectList, clean_indexes: Union[list, None]) -> Union[np.ndarray, None]:
+        '''
+        Flags of the objects whose indexes are not among clean_indexes (changed, merged, denoised or added since)
+        and of the part level objects, which may overlap any other. None without change tracking, or when passes
+        restricted to them and their neighbours could differ from full passes: the overlap tolerance reaches past
+        the voxel itself, or the unchanged objects share voxels (they came out of an align pass otherwise).
+        '''
+        if not self.track_changes or clean_indexes is None:
+            return None
+        if len(self.view_dataset.neighbor_offsets(self.downsample_voxel_size)) > 1:
+            return None
+        clean = {id(indexes) for indexes in clean_indexes}
+        flags = np.array([id(obj["indexes"]) not in clean or obj["class_name"] in self.part_level_classes
+                          for obj in objects], dtype=bool)
+        clean_objects = np.flatnonzero(~flags)
+        if len(clean_objects) > 0:
+            indexes = np.concatenate([np.asarray(objects[i]["indexes"]) for i in clean_objects])
+            if len(np.unique(indexes)) < len(indexes):
+                return None
+        return flags
+
+    def indexes_align_objects(self, objects: MapObjectList, changed: Union[np.ndarray, None]=None):
+        '''
+        changed: only the changed objects and their neighbours in a spatial hash are aligned. Voxels shared
+        by unchanged objects only must not exist (see get_dirty_objects), so every owner of a voxel that
+        can be shared is aligned.
+        '''
         # object_class_names = objects.get_most_common_class_name()
         # object_class_confidences = np.array(objects.get_most_common_class_conf())
         object_class_confidences = np.array([obj["conf"] for obj in objects])
-        for cnt, obj in enumerate(tqdm(objects, total=len(objects), desc="align index to object")):
-             # if object class is part level lebels, don't filter it for easy find parent object
-            # if object_class_names[cnt] not in self.part_level_classes: 
-            if obj["class_name"] not in self.part_level_classes:
-                for index in obj["indexes"]:
-                    if index not in index_to_object:
-                        index_to_object[index] = []
-                    index_to_object[index].append(cnt)
-        
-        # filter indexes which exist in more than two object
-        filtered_index_to_object = dict((k, v) for k, v in index_to_object.items() if len(v) > 1)
-        for index, obj_idxes in tqdm(filtered_index_to_object.items(),
-                total=len(filtered_index_to_object), desc="processing filtered indexes"):
-            confs = object_class_confidences[obj_idxes]
-            max_conf_idx = np.argmax(confs)
-            # remove index in object when confidence is not biggest
-            for cnt in obj_idxes:
-                if cnt != max_conf_idx:
-                    objects[cnt]["indexes"].remove(index)
+        # if object class is part level lebels, don't filter it for easy find parent object
+        # if object_class_names[cnt] not in self.part_level_classes:
+        aligned = [cnt for cnt, obj in enumerate(objects) if obj["class_name"] not in self.part_level_classes]
+        if changed is not None and len(aligned) > 0:
+            spatial_hash = SpatialHash(self.view_dataset, cell_size=max(self.spatial_hash_cell_size, 1))
+            spatial_hash.update(objects)
+            dirty = np.zeros(len(objects), dtype=bool)
+            for i in np.flatnonzero(changed):
+                dirty[spatial_hash.candidates(objects[i]["indexes"])] = True
+            aligned = [cnt for cnt in aligned if dirty[cnt]]
+        if len(aligned) == 0:
+            return objects
+
+        # CSR of (index, object) pairs, grouped by index with objects in ascending order
+        lengths = np.array([len(objects[cnt]["indexes"]) for cnt in aligned])
+        owners = np.repeat(np.array(aligned), lengths)
+        indexes = np.concatenate([np.asarray(objects[cnt]["indexes"]) for cnt in aligned])
+        order = np.lexsort((owners, indexes))
+        sorted_indexes, sorted_owners = indexes[order], owners[order]
+        group_start = np.flatnonzero(np.r_[True, sorted_indexes[1:] != sorted_indexes[:-1]])
+        group_id = np.cumsum(np.r_[True, sorted_indexes[1:] != sorted_indexes[:-1]]) - 1
+        group_size = np.diff(np.r_[group_start, len(sorted_indexes)])
+
+        # filter indexes which exist in more than two object, the index stays in the object whose number
+        # equals the position of the most confident owner in the group
+        confs = object_class_confidences[sorted_owners]
+        by_conf = np.lexsort((np.arange(len(confs)), -confs, group_id))
+        max_conf_idx = by_conf[np.r_[True, group_id[by_conf][1:] != group_id[by_conf][:-1]]] - group_start
+        keep = (group_size[group_id] == 1) | (sorted_owners == max_conf_idx[group_id])
+        print(f"align index to object: {len(group_start)} indexes, {int(np.sum(group_size > 1))} in more than one object")
+
+        removed = np.zeros(len(indexes), dtype=bool)
+        removed[order[~keep]] = True
+        offsets = np.r_[0, np.cumsum(lengths)]
+        for k, cnt in enumerate(aligned):
+            object_removed = removed[offsets[k]:offsets[k + 1]]
+            if object_removed.any():
+                objects[cnt]["indexes"] = np.asarray(objects[cnt]["indexes"])[~object_removed]
+                # shrunk, the box is recomputed
+                objects[cnt]["point_moments"] = self.get_point_moments(objects[cnt]["indexes"])
+                objects[cnt]["bbox"] = self.get_bounding_box(objects[cnt]["indexes"])
+                objects[cnt]["bbox"].color = [0,1,0]
 
         return objects
 
-
     def change_objects(self, objects: MapObjectList):
         for obj in objects:
             # It will change later, and the amount of calculation is very small
             obj['clip_ft'] = to_numpy(obj['clip_ft'])
             obj['text_ft'] = to_numpy(obj['text_ft'])
-            del obj["bbox"]
         return objects
     
-    def load_objects(self, objects: MapObjectList, class_id_counts: dict):
+    def load_objects(self, objects: MapObjectList, class_id_counts: dict, check_boxes: bool=True):
         for obj in objects:
             # It will change later, and the amount of calculation is very small
             obj['clip_ft'] = to_tensor(obj['clip_ft'])
             obj['text_ft'] = to_tensor(obj['text_ft'])
-            obj["bbox"] = self.get_bounding_box(obj["indexes"])
+            # persisted boxes are kept unless the indexes changed since they were computed,
+            # without check_boxes they are trusted (kept up to date by remove_indexes)
+            stale = "bbox" not in obj or "point_moments" not in obj
+            if not stale and check_boxes:
+                stale = not np.array_equal(obj["point_moments"], self.get_point_moments(obj["indexes"]))
+            if stale:
+                obj["point_moments"] = self.get_point_moments(obj["indexes"])
+                obj["bbox"] = self.get_bounding_box(obj["indexes"])
+                obj["bbox"].color = [0,1,0]
             label_count = int(obj["class_id"].split("_")[1])
             if obj["class_name"] not in class_id_counts.keys():
                 class_id_counts[obj["class_name"]] = int(obj["class_id"].split("_")[1])
@@ -238,64 +440,70 @@ class InstanceProcess:
         print("After filtering:", len(objects))
         return objects
 
-    def merge_objects(self, objects: MapObjectList):
+    def merge_objects(self, objects: MapObjectList, changed: Union[np.ndarray, None]=None):
+        '''changed: only pairs with at least one changed object are considered, two unchanged objects do not overlap'''
         if self.merge_overlap_thresh > 0:
             start_time = time.time()
             # Merge one object into another if the former is contained in the latter
-            overlap_matrix = self.compute_overlap_matrix(objects)
+            x, y, overlap_ratio = self.compute_overlap_pairs(objects, changed)
             print("Before merging:", len(objects))
-            objects = self.merge_overlap_objects(objects, overlap_matrix)
+            objects = self.merge_overlap_objects(objects, x, y, overlap_ratio)
             print("After merging:", len(objects))
             print(f"merge time spend {time.time() - start_time}")
         
         return objects
 
 
-    def compute_overlap_matrix(self, objects: MapObjectList):
+    def compute_aabb_overlap(self, objects: MapObjectList, block_size: int=512,
+                             rows: Union[np.ndarray, None]=None) -> np.ndarray:
         '''
-        compute pairwise overlapping between objects in terms of point nearest neighbor. 
-        Suppose we have a list of n point cloud, each of which is a o3d.geometry.PointCloud object. 
-        Now we want to construct a matrix of size n x n, where the (i, j) entry is the ratio of points in point cloud i 
-        that are within a distance threshold of any point in point cloud j. 
+        Pairs (i, j), i != j, whose axis aligned bounds have a non zero IoU (compute_3d_iou of every pair),
+        computed in row blocks so thousands of objects do not need a dense n x n x 3 array.
+        With rows, only the pairs involving these objects, in row major order.
         '''
         n = len(objects)
-        overlap_matrix = np.zeros((n, n))
-        
-        # Convert the point clouds into numpy arrays and then into FAISS indices for efficient search
-        point_arrays = [self.view_dataset.index_to_point(obj['indexes']) for obj in objects]
-        indices = [faiss.IndexFlatL2(arr.shape[1]) for arr in point_arrays]
-        
-        # Add the points from the numpy arrays to the corresponding FAISS indices
-        # FAISS requires float32, but index_to_point returns float64
-        for index, arr in zip(indices, point_arrays):
-            index.add(arr.astype(np.float32))
-
-        # Compute the pairwise overlaps
-        for i in range(n):
-            for j in range(n):
-                if i != j:  # Skip diagonal elements
-                    box_i = objects[i]['bbox']
-                    box_j = objects[j]['bbox']
-                    
-                    # Skip if the boxes do not overlap at all (saves computation)
-                    iou = self.compute_3d_iou(box_i, box_j)
-                    if iou == 0:
-                        continue
-                    
-                    # # Use range_search to find points within the threshold
-                    # _, I = indices[j].range_search(point_arrays[i], threshold ** 2)
-                    # FAISS requires float32, but index_to_point returns float64
-                    D, I = indices[j].search(point_arrays[i].astype(np.float32), 1)
-
-                    # # If any points are found within the threshold, increase overlap count
-                    # overlap += sum([len(i) for i in I])
-
-                    overlap = (D < self.downsample_voxel_size ** 2).sum() # D is the squared distance
-
-                    # Calculate the ratio of points within the threshold
-                    overlap_matrix[i, j] = overlap / len(point_arrays[i])
-
-        return overlap_matrix
+        if n == 0:
+            return np.zeros((0, 2), dtype=np.int64)
+        rows = np.arange(n) if rows is None else np.asarray(rows, dtype=np.int64)
+        bbox_min = np.stack([np.asarray(obj['bbox'].get_min_bound()) for obj in objects])
+        bbox_max = np.stack([np.asarray(obj['bbox'].get_max_bound()) for obj in objects])
+        volume = np.prod(bbox_max - bbox_min, axis=1)
+
+        pairs = [np.zeros((0, 2), dtype=np.int64)]
+        for start in range(0, len(rows), block_size):
+            block = rows[start:start + block_size]
+            overlap_size = np.maximum(
+                np.minimum(bbox_max[block, None], bbox_max[None]) - np.maximum(bbox_min[block, None], bbox_min[None]), 0.0)
+            overlap_volume = np.prod(overlap_size, axis=2)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                iou = overlap_volume / (volume[block, None] + volume[None] - overlap_volume)
+            candidate = iou != 0
+            candidate[np.arange(len(block)), block] = False
+            block_pairs = np.argwhere(candidate)
+            block_pairs[:, 0] = block[block_pairs[:, 0]]
+            pairs.append(block_pairs)
+        pairs = np.concatenate(pairs)
+        if len(rows) < n:
+            # the overlap is symmetric, add (j, i) for the other objects
+            pairs = np.unique(np.concatenate([pairs, pairs[:, ::-1]]), axis=0)
+        return pairs
+
+    def compute_overlap_pairs(self, objects: MapObjectList, changed: Union[np.ndarray, None]=None):
+        '''
+        compute pairwise overlapping between objects in terms of voxel neighbors.
+        Returns the non zero entries (x, y, ratio) of the n x n overlap matrix in row major order, where
+        ratio is the ratio of voxels of object x that are within downsample_voxel_size of a voxel of object y.
+        Only pairs whose bounding boxes overlap are evaluated, and with changed flags only pairs involving a changed object.
+        '''
+        pairs = self.compute_aabb_overlap(objects, rows=None if changed is None else np.flatnonzero(changed))
+        # voxels within the tolerance of each other lie in the oriented boxes padded by it
+        pairs = pairs[self.compute_box_intersections(objects.get_values('bbox'), objects.get_values('bbox'),
+                                                     pairs=pairs, padding=self.downsample_voxel_size)]
+        indexes = objects.get_values('indexes')
+        # compute_voxel_overlap(a, b, (i, j)) is the ratio of b[j] covered by a[i]
+        overlap_ratio = self.compute_voxel_overlap(indexes, indexes, pairs[:, ::-1])
+        nonzero = overlap_ratio > 0
+        return pairs[nonzero, 0], pairs[nonzero, 1], overlap_ratio[nonzero]
 
     def merge_detections_to_objects(
         self,
@@ -318,28 +526,37 @@ class InstanceProcess:
                 
         return objects
 
-    def merge_overlap_objects(self, objects: MapObjectList, overlap_matrix: np.ndarray):
-        x, y = overlap_matrix.nonzero()
-        overlap_ratio = overlap_matrix[x, y]
+    def merge_overlap_objects(self, objects: MapObjectList, x: np.ndarray, y: np.ndarray, overlap_ratio: np.ndarray):
+        if len(x) == 0:
+            return MapObjectList(list(objects))
 
         sort = np.argsort(overlap_ratio)[::-1]
         x = x[sort]
         y = y[sort]
         overlap_ratio = overlap_ratio[sort]
 
+        # similarities of all candidate pairs in one pass, pairs touching an already merged object are recomputed
+        clip_fts = objects.get_feature_matrix('clip_ft')
+        text_fts = objects.get_feature_matrix('text_ft')
+        visual_sims = (clip_fts[x] * clip_fts[y]).sum(dim=-1)
+        text_sims = (text_fts[x] * text_fts[y]).sum(dim=-1)
+        merged_into = np.zeros(len(objects), dtype=bool)
+
         kept_objects = np.ones(len(objects), dtype=bool)
-        for i, j, ratio in zip(x, y, overlap_ratio):
-            visual_sim = F.cosine_similarity(
-                to_tensor(objects[i]['clip_ft']),
-                to_tensor(objects[j]['clip_ft']),
-                dim=0
-            )
-            text_sim = F.cosine_similarity(
-                to_tensor(objects[i]['text_ft']),
-                to_tensor(objects[j]['text_ft']),
-                dim=0
-            )
-            print(objects[i]["class_name"], objects[j]["class_name"], ratio, visual_sim, text_sim)
+        for k, (i, j, ratio) in enumerate(zip(x, y, overlap_ratio)):
+            if merged_into[i] or merged_into[j]:
+                visual_sim = F.cosine_similarity(
+                    to_tensor(objects[i]['clip_ft']).float(),
+                    to_tensor(objects[j]['clip_ft']).float(),
+                    dim=0
+                )
+                text_sim = F.cosine_similarity(
+                    to_tensor(objects[i]['text_ft']).float(),
+                    to_tensor(objects[j]['text_ft']).float(),
+                    dim=0
+                )
+            else:
+                visual_sim, text_sim = visual_sims[k], text_sims[k]
 
             # Use stricter methods to judge
             if ratio * self.spatial_weight + visual_sim * self.vis_weight + text_sim * self.text_weight > self.sim_threshold + 0.05:
@@ -350,6 +567,7 @@ class InstanceProcess:
                         # Then merge object i into object j
                         objects[j] = self.merge_obj_to_obj(objects[j], objects[i], run_dbscan=True)
                         kept_objects[i] = False
+                        merged_into[j] = True
             else:
                 break
     
@@ -360,16 +578,31 @@ class InstanceProcess:
 
 
     def denoise_objects(self, objects: MapObjectList):
+        '''
+        Denoising is deterministic, so an object whose indexes a previous pass left unchanged comes out the same
+        again. Such fixed points are recorded in 'denoised_digest' and, with track_changes, skipped.
+        '''
         for i in tqdm(range(len(objects)), total=len(objects), desc="denoise objects"):
             og_object_indexes = objects[i]['indexes']
+            digest = self.get_indexes_digest(og_object_indexes)
+            if self.track_changes and objects[i].get('denoised_digest') == digest:
+                continue
             objects[i]['indexes'] = self.process_indexes(objects[i]['indexes'], run_dbscan=True)
             if len(objects[i]['indexes']) < 4:
                 objects[i]['indexes'] = og_object_indexes
+                objects[i]['denoised_digest'] = digest
                 continue
+            if len(objects[i]['indexes']) == len(og_object_indexes):
+                # nothing removed, a fixed point of denoising
+                objects[i]['denoised_digest'] = self.get_indexes_digest(objects[i]['indexes'])
+            objects[i]['point_moments'] = self.get_point_moments(objects[i]['indexes'])
             objects[i]['bbox'] = self.get_bounding_box(objects[i]['indexes'])
             objects[i]['bbox'].color = [0,1,0]
         return objects
 
+    def get_indexes_digest(self, indexes) -> bytes:
+        return hashlib.blake2b(np.ascontiguousarray(indexes, dtype=np.int64).tobytes(), digest_size=16).digest()
+
 
     def compute_3d_iou(self, bbox1, bbox2, padding=0, use_iou=True):
         # Get the coordinates of the first bounding box
@@ -439,196 +672,143 @@ class InstanceProcess:
 
         return iou
 
-    def expand_3d_box(self, bbox: torch.Tensor) -> torch.Tensor:
-        '''
-        Expand the side of 3D boxes such that each side has at least expend_eps length.
-        Assumes the bbox cornder order in open3d convention. 
-        
-        bbox: (N, 8, D)
-        
-        returns: (N, 8, D)
-        '''
-        center = bbox.mean(dim=1)  # shape: (N, D)
-
-        va = bbox[:, 1, :] - bbox[:, 0, :]  # shape: (N, D)
-        vb = bbox[:, 2, :] - bbox[:, 0, :]  # shape: (N, D)
-        vc = bbox[:, 3, :] - bbox[:, 0, :]  # shape: (N, D)
-        
-        a = torch.linalg.vector_norm(va, ord=2, dim=1, keepdim=True)  # shape: (N, 1)
-        b = torch.linalg.vector_norm(vb, ord=2, dim=1, keepdim=True)  # shape: (N, 1)
-        c = torch.linalg.vector_norm(vc, ord=2, dim=1, keepdim=True)  # shape: (N, 1)
-        
-        va = torch.where(a < self.expend_eps, va / a * self.expend_eps, va)  # shape: (N, D)
-        vb = torch.where(b < self.expend_eps, vb / b * self.expend_eps, vb)  # shape: (N, D)
-        vc = torch.where(c < self.expend_eps, vc / c * self.expend_eps, vc)  # shape: (N, D)
-        
-        new_bbox = torch.stack([
-            center - va/2.0 - vb/2.0 - vc/2.0,
-            center + va/2.0 - vb/2.0 - vc/2.0,
-            center - va/2.0 + vb/2.0 - vc/2.0,
-            center - va/2.0 - vb/2.0 + vc/2.0,
-            center + va/2.0 + vb/2.0 + vc/2.0,
-            center - va/2.0 + vb/2.0 + vc/2.0,
-            center + va/2.0 - vb/2.0 + vc/2.0,
-            center + va/2.0 + vb/2.0 - vc/2.0,
-        ], dim=1) # shape: (N, 8, D)
-        
-        new_bbox = new_bbox.to(bbox.device)
-        new_bbox = new_bbox.type(bbox.dtype)
-        
-        return new_bbox
-
-    def compute_3d_iou_accuracte_batch(self, bbox1, bbox2):
+    def compute_box_intersections(self, bboxes_a: list, bboxes_b: list, pairs: Union[np.ndarray, None]=None,
+                                  padding: float=0.0, block_size: int=256) -> np.ndarray:
         '''
-        Compute IoU between two sets of oriented (or axis-aligned) 3D bounding boxes.
-        
-        bbox1: (M, 8, D), e.g. (M, 8, 3)
-        bbox2: (N, 8, D), e.g. (N, 8, 3)
-        
-        returns: (M, N)
+        Whether the oriented boxes intersect, (len(bboxes_a), len(bboxes_b)) or one value per (i, j) in pairs.
+        Box sides are expanded to at least expend_eps and every side is moved out by padding.
         '''
-        # Must expend the box beforehand, otherwise it may results overestimated results
-        bbox1 = self.expand_3d_box(bbox1)
-        bbox2 = self.expand_3d_box(bbox2)
-        import pytorch3d.ops as ops
-        bbox1 = bbox1[:, [0, 2, 5, 3, 1, 7, 4, 6]]
-        bbox2 = bbox2[:, [0, 2, 5, 3, 1, 7, 4, 6]]
-        inter_vol, iou = ops.box3d_overlap(bbox1.float(), bbox2.float())
-        return iou
+        boxes = []
+        for bboxes in [bboxes_a, bboxes_b]:
+            centers, rotations, extents = get_box_arrays(bboxes)
+            boxes.append((centers, rotations, np.maximum(extents, self.expend_eps) / 2 + padding))
+        (center_a, rotation_a, half_a), (center_b, rotation_b, half_b) = boxes
+        if pairs is not None:
+            return boxes_intersect(center_a[pairs[:, 0]], rotation_a[pairs[:, 0]], half_a[pairs[:, 0]],
+                                   center_b[pairs[:, 1]], rotation_b[pairs[:, 1]], half_b[pairs[:, 1]])
+        intersect = np.zeros((len(bboxes_a), len(bboxes_b)), dtype=bool)
+        for start in range(0, len(bboxes_a), block_size):
+            rows = slice(start, start + block_size)
+            intersect[rows] = boxes_intersect(center_a[rows, None], rotation_a[rows, None], half_a[rows, None],
+                                              center_b[None], rotation_b[None], half_b[None])
+        return intersect
 
     def compute_overlap_matrix_2set(self, objects_map: MapObjectList, objects_new: DetectionList,
-                                    bbox_map: torch.Tensor, bbox_new: torch.Tensor) -> np.ndarray:
+                                    candidate_pairs: Union[np.ndarray, None]=None) -> np.ndarray:
         '''
         compute pairwise overlapping between two set of objects in terms of point nearest neighbor. 
         objects_map is the existing objects in the map, objects_new is the new objects to be added to the map
         Suppose len(objects_map) = m, len(objects_new) = n
         Then we want to construct a matrix of size m x n, where the (i, j) entry is the ratio of points 
         in point cloud i that are within a distance threshold of any point in point cloud j.
+        With candidate_pairs (P, 2), only these entries are computed.
         '''
         m = len(objects_map)
         n = len(objects_new)
         overlap_matrix = np.zeros((m, n))
-        
-        # Convert the point clouds into numpy arrays and then into FAISS indices for efficient search
-        # points_map = [np.asarray(obj['pcd'].points, dtype=np.float32) for obj in objects_map] # m arrays
-        points_map = [self.view_dataset.index_to_point(obj['indexes']) for obj in objects_map]
-        indices_map = [faiss.IndexFlatL2(arr.shape[1]) for arr in points_map] # m indices
-        
-        # Add the points from the numpy arrays to the corresponding FAISS indices
-        # FAISS requires float32, but index_to_point returns float64
-        for index, arr in zip(indices_map, points_map):
-            index.add(arr.astype(np.float32))
-            
-        # points_new = [np.asarray(obj['pcd'].points, dtype=np.float32) for obj in objects_new] # n arrays
-        points_new = [self.view_dataset.index_to_point(obj['indexes']) for obj in objects_new]
-            
-        # bbox_map = objects_map.get_stacked_values_torch('bbox')
-        # bbox_new = objects_new.get_stacked_values_torch('bbox')
-        try:
-            iou = self.compute_3d_iou_accuracte_batch(bbox_map, bbox_new) # (m, n)
-        except ValueError:
-            print("Met `Plane vertices are not coplanar` error, use axis aligned bounding box instead")
-            bbox_map = []
-            bbox_new = []
-            # for pcd in objects_map.get_values('pcd'):
-            #     bbox_map.append(np.asarray(
-            #         pcd.get_axis_aligned_bounding_box().get_box_points()))
-                
-            # for pcd in objects_new.get_values('pcd'):
-            #     bbox_new.append(np.asarray(
-            #         pcd.get_axis_aligned_bounding_box().get_box_points()))
-
-            for indexes in objects_map.get_values('indexes'):
-                pcd = self.view_dataset.index_to_pcd(indexes=indexes)
-                bbox_map.append(np.asarray(
-                    pcd.get_axis_aligned_bounding_box().get_box_points()))
-                
-            for indexes in objects_new.get_values('indexes'):
-                pcd = self.view_dataset.index_to_pcd(indexes=indexes)
-                bbox_new.append(np.asarray(
-                    pcd.get_axis_aligned_bounding_box().get_box_points()))
-                
-            bbox_map = torch.from_numpy(np.stack(bbox_map))
-            bbox_new = torch.from_numpy(np.stack(bbox_new))
-            
-            iou = self.compute_iou_batch(bbox_map, bbox_new) # (m, n)
-                
-
-        # Compute the pairwise overlaps
-        for i in range(m):
-            for j in range(n):
-                if iou[i, j] < 1e-6:
-                    continue
-                
-                # FAISS requires float32, but index_to_point returns float64
-                D, I = indices_map[i].search(points_new[j].astype(np.float32), 1) # search new object j in map object i
-
-                overlap = (D < self.downsample_voxel_size ** 2).sum() # D is the squared distance
+        if m == 0 or n == 0 or (candidate_pairs is not None and len(candidate_pairs) == 0):
+            return overlap_matrix
 
-                # Calculate the ratio of points within the threshold
-                overlap_matrix[i, j] = overlap / len(points_new[j])
+        # Compute the pairwise overlaps on the voxel indexes, only for pairs whose boxes intersect
+        if candidate_pairs is None:
+            pairs = np.argwhere(self.compute_box_intersections(objects_map.get_values('bbox'), objects_new.get_values('bbox')))
+        else:
+            pairs = candidate_pairs[self.compute_box_intersections(
+                objects_map.get_values('bbox'), objects_new.get_values('bbox'), pairs=candidate_pairs)]
+        overlap_matrix[pairs[:, 0], pairs[:, 1]] = self.compute_voxel_overlap(
+            objects_map.get_values('indexes'), objects_new.get_values('indexes'), pairs)
 
         return overlap_matrix
 
+    def compute_voxel_overlap(self, indexes_a: list, indexes_b: list, pairs: np.ndarray) -> np.ndarray:
+        '''
+        For every pair (i, j), the ratio of voxels of indexes_b[j] strictly closer than downsample_voxel_size
+        to a voxel of indexes_a[i]. The distance is taken between voxel points, so the tolerance
+        is a fixed neighborhood of voxel offsets (only the voxel itself when it equals the resolution).
+        '''
+        # only the objects on the table side that take part in a pair are dilated
+        neighbors_a = [np.zeros(0, dtype=np.int64)] * len(indexes_a)
+        for i in np.unique(pairs[:, 0]):
+            neighbors_a[i] = self.view_dataset.index_neighbors(indexes_a[i], self.downsample_voxel_size)
+        return voxel_overlap_ratios(neighbors_a, indexes_b, pairs)
+
 
-    def compute_spatial_similarities(self, detection_list: DetectionList, objects: MapObjectList) -> torch.Tensor:
+    def compute_spatial_similarities(self, detection_list: DetectionList, objects: MapObjectList,
+                                     pairs: Union[np.ndarray, None]=None) -> torch.Tensor:
         '''
         Compute the spatial similarities between the detections and the objects
         
         Args:
             detection_list: a list of M detections
             objects: a list of N objects in the map
+            pairs: optional (P, 2) candidate (object, detection) pairs, the other entries are 0
         Returns:
             A MxN tensor of spatial similarities
         '''
-        det_bboxes = detection_list.get_stacked_values_torch('bbox')
-        obj_bboxes = objects.get_stacked_values_torch('bbox')
-
-        spatial_sim = self.compute_overlap_matrix_2set(objects, detection_list, obj_bboxes, det_bboxes)
+        spatial_sim = self.compute_overlap_matrix_2set(objects, detection_list, pairs)
         spatial_sim = torch.from_numpy(spatial_sim).T
 
         return spatial_sim
 
-    def compute_visual_similarities(self, detection_list: DetectionList, objects: MapObjectList) -> torch.Tensor:
+    def compute_visual_similarities(self, detection_list: DetectionList, objects: MapObjectList,
+                                    pairs: Union[np.ndarray, None]=None) -> torch.Tensor:
         '''
         Compute the visual similarities between the detections and the objects
         
         Args:
             detection_list: a list of M detections
             objects: a list of N objects in the map
+            pairs: optional (P, 2) candidate (object, detection) pairs, the other entries are 0
         Returns:
             A MxN tensor of visual similarities
         '''
-        det_fts = detection_list.get_stacked_values_torch('clip_ft') # (M, D)
-        obj_fts = objects.get_stacked_values_torch('clip_ft') # (N, D)
+        det_fts = F.normalize(detection_list.get_stacked_values_torch('clip_ft').float(), dim=-1) # (M, D)
+        obj_fts = objects.get_feature_matrix('clip_ft') # (N, D), normalized rows kept by the map
 
-        det_fts = det_fts.unsqueeze(-1) # (M, D, 1)
-        obj_fts = obj_fts.T.unsqueeze(0) # (1, D, N)
-        
-        visual_sim = F.cosine_similarity(det_fts, obj_fts, dim=1) # (M, N)
+        if pairs is None:
+            visual_sim = det_fts @ obj_fts.T # (M, N)
+        else:
+            visual_sim = torch.zeros((len(detection_list), len(objects)))
+            visual_sim[pairs[:, 1], pairs[:, 0]] = (det_fts[pairs[:, 1]] * obj_fts[pairs[:, 0]]).sum(dim=-1)
         
         return visual_sim
 
-    def compute_text_similarities(self, detection_list: DetectionList, objects: MapObjectList) -> torch.Tensor:
+    def compute_text_similarities(self, detection_list: DetectionList, objects: MapObjectList,
+                                  pairs: Union[np.ndarray, None]=None) -> torch.Tensor:
         '''
         Compute the text similarities between the detections and the objects
         
         Args:
             detection_list: a list of M detections
             objects: a list of N objects in the map
+            pairs: optional (P, 2) candidate (object, detection) pairs, the other entries are 0
         Returns:
             A MxN tensor of text similarities
         '''
-        det_fts = detection_list.get_stacked_values_torch('text_ft') # (M, D)
-        obj_fts = objects.get_stacked_values_torch('text_ft') # (N, D)
+        det_fts = F.normalize(detection_list.get_stacked_values_torch('text_ft').float(), dim=-1) # (M, D)
+        obj_fts = objects.get_feature_matrix('text_ft') # (N, D), normalized rows kept by the map
 
-        det_fts = det_fts.unsqueeze(-1) # (M, D, 1)
-        obj_fts = obj_fts.T.unsqueeze(0) # (1, D, N)
-        
-        text_sim = F.cosine_similarity(det_fts, obj_fts, dim=1) # (M, N)
+        if pairs is None:
+            text_sim = det_fts @ obj_fts.T # (M, N)
+        else:
+            text_sim = torch.zeros((len(detection_list), len(objects)))
+            text_sim[pairs[:, 1], pairs[:, 0]] = (det_fts[pairs[:, 1]] * obj_fts[pairs[:, 0]]).sum(dim=-1)
         
         return text_sim
 
+    def score_bound_pairs(self, visual_sim: torch.Tensor, text_sim: torch.Tensor,
+                          pairs: Union[np.ndarray, None]=None) -> np.ndarray:
+        '''
+        (object, detection) pairs, out of pairs or all, whose aggregated similarity can still reach sim_threshold.
+        The bound is aggregate_similarities with a spatial similarity of 1 (its maximum), evaluated with the
+        same float operations, so every dropped pair would also have been below the threshold.
+        '''
+        spatial_bound = torch.ones(visual_sim.shape, dtype=torch.float64)
+        bound = to_numpy(self.aggregate_similarities(spatial_bound, visual_sim, text_sim)).T  # (N, M)
+        if pairs is None:
+            return np.argwhere(bound >= self.sim_threshold)
+        return pairs[bound[pairs[:, 0], pairs[:, 1]] >= self.sim_threshold]
+
     def aggregate_similarities(self, spatial_sim: torch.Tensor, visual_sim: torch.Tensor, text_sim: torch.Tensor) -> torch.Tensor:
         '''
         Aggregate spatial and visual similarities into a single similarity score
@@ -759,9 +939,24 @@ class InstanceProcess:
         contained_idx = contained.nonzero() # (num_contained, 2)
 
         mask_sub = mask.copy() # (N, H, W)
+        if len(contained_idx[0]) == 0:
+            return mask_sub
+
+        # A subtraction only changes pixels of the contained mask, so it is done on the crop of that mask's
+        # pixel extent (not its box, a mask may leave its box). Masks only shrink here, the extents stay valid,
+        # and pairs keep their order as one mask may be subtracted after it was reduced itself.
+        extents = {}
+        for j in np.unique(contained_idx[1]):
+            rows = np.flatnonzero(mask[j].any(axis=1))
+            if len(rows) > 0:
+                cols = np.flatnonzero(mask[j, rows[0]:rows[-1] + 1].any(axis=0))
+                extents[j] = (slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1))
+
         # mask_sub[contained_idx[0]] = mask_sub[contained_idx[0]] & (~mask_sub[contained_idx[1]])
-        for i in range(len(contained_idx[0])):
-            mask_sub[contained_idx[0][i]] = mask_sub[contained_idx[0][i]] & (~mask_sub[contained_idx[1][i]])
+        for i, j in zip(*contained_idx):
+            if j in extents:
+                crop = extents[j]
+                mask_sub[i][crop] &= ~mask_sub[j][crop]
 
         return mask_sub
 
@@ -787,19 +982,22 @@ class InstanceProcess:
         if len(indexes) < self.min_samples:
             return indexes
 
-        points = self.view_dataset.index_to_point(indexes)
-        
-        # pcd = self.view_dataset.index_to_pcd(indexes)
-        # o3d.visualization.draw_geometries([pcd])
+        if self.denoise_on_voxel_grid:
+            labels = voxel_dbscan(self.view_dataset.index_to_voxel(np.asarray(indexes)), self.min_samples, self.sample_rate)
+        else:
+            points = self.view_dataset.index_to_point(indexes)
 
-        neighbors = NearestNeighbors(n_neighbors=self.min_samples)
-        neighbors_fit = neighbors.fit(points)
-        distances, indices = neighbors_fit.kneighbors(points)
-        distances = np.sort(distances[:, -1], axis=0)
-        eps = distances[int(len(distances) * self.sample_rate)]
+            # pcd = self.view_dataset.index_to_pcd(indexes)
+            # o3d.visualization.draw_geometries([pcd])
 
-        db = DBSCAN(eps=eps, min_samples=self.min_samples).fit(points)
-        labels = db.labels_
+            neighbors = NearestNeighbors(n_neighbors=self.min_samples)
+            neighbors_fit = neighbors.fit(points)
+            distances, indices = neighbors_fit.kneighbors(points)
+            distances = np.sort(distances[:, -1], axis=0)
+            eps = distances[int(len(distances) * self.sample_rate)]
+
+            db = DBSCAN(eps=eps, min_samples=self.min_samples).fit(points)
+            labels = db.labels_
 
         # Count all labels in the cluster
         counter = Counter(labels)
@@ -834,7 +1032,7 @@ class InstanceProcess:
         indexes = np.unique(indexes)
         if self.dbscan_remove_noise and run_dbscan:
             indexes = self.indexes_denoise_dbscan(indexes)
-        return list(indexes)
+        return np.asarray(indexes)
 
     def merge_obj_to_obj(self, obj1, obj2, run_dbscan=True):
         '''
@@ -847,13 +1045,18 @@ class InstanceProcess:
         '''
         n_obj1_det = obj1['num_detections']
         n_obj2_det = obj2['num_detections']
+        added_indexes = np.setdiff1d(obj2['indexes'], obj1['indexes'])
+        # the box below is not the one of denoise_objects, even when no voxel is added
+        obj1.pop('denoised_digest', None)
 
         for k in obj1.keys():
             if k in ['caption']:
                 # Here we need to merge two dictionaries and adjust the key of the second one
                 for k2, v2 in obj2['caption'].items():
                     obj1['caption'][k2 + n_obj1_det] = v2
-            elif k not in ['bbox', 'clip_ft', "text_ft", 'conf', 'class_name', 'class_id']:
+            elif k == 'indexes':
+                obj1[k] = np.concatenate([obj1[k], obj2[k]])
+            elif k not in ['bbox', 'point_moments', 'clip_ft', "text_ft", 'conf', 'class_name', 'class_id']:
                 if isinstance(obj1[k], list) or isinstance(obj1[k], int):
                     obj1[k] += obj2[k]
                 elif k == "inst_color":
@@ -869,7 +1072,14 @@ class InstanceProcess:
             obj1["class_id"] = obj2["class_id"]
 
         obj1['indexes'] = self.process_indexes(obj1['indexes'], run_dbscan=run_dbscan)
-        obj1['bbox'] = self.get_bounding_box(obj1['indexes'])
+        if self.dbscan_remove_noise and run_dbscan or 'point_moments' not in obj1:
+            # denoised, voxels may have been removed
+            obj1['point_moments'] = self.get_point_moments(obj1['indexes'])
+            obj1['bbox'] = self.get_bounding_box(obj1['indexes'])
+        else:
+            # a plain union only adds the voxels obj1 did not have
+            obj1['point_moments'] = obj1['point_moments'] + self.get_point_moments(added_indexes)
+            obj1['bbox'] = self.get_moments_bounding_box(obj1['indexes'], obj1['point_moments'])
         obj1['bbox'].color = [0,1,0]
         
         # merge clip ft
@@ -889,10 +1099,39 @@ class InstanceProcess:
 
 
     def get_bounding_box(self, indexes):
-        pcd = self.view_dataset.index_to_pcd(indexes=indexes)
+        # colors do not change the box, skip the per voxel color lookup of index_to_pcd
+        pcd = o3d.geometry.PointCloud()
+        pcd.points = o3d.utility.Vector3dVector(self.view_dataset.index_to_point(np.asarray(indexes)))
         bbox = get_bbox(pcd)
         return bbox
 
+    def get_point_moments(self, indexes) -> np.ndarray:
+        '''
+        count, sum (3) and sum of outer products (3 x 3) of the voxel coordinates, 13 values.
+        Integer voxel coordinates keep the sums exact, so moments of disjoint sets add up.
+        '''
+        voxels = self.view_dataset.index_to_voxel(np.asarray(indexes, dtype=np.int64)).astype(np.float64)
+        return np.concatenate([[len(voxels)], voxels.sum(axis=0), (voxels.T @ voxels).ravel()])
+
+    def get_moments_bounding_box(self, indexes, point_moments: np.ndarray):
+        '''
+        Oriented box with the principal axes of the moments, only the extents need the points:
+        one projection instead of the hull and PCA of get_oriented_bounding_box.
+        '''
+        count = point_moments[0]
+        if count < 4:
+            return self.get_bounding_box(indexes)
+        mean = point_moments[1:4] / count
+        covariance = point_moments[4:].reshape(3, 3) / count - np.outer(mean, mean)
+        _, axes = np.linalg.eigh(covariance)
+        if np.linalg.det(axes) < 0:
+            axes[:, 0] = -axes[:, 0]
+        points = self.view_dataset.index_to_point(np.asarray(indexes))
+        origin = mean * self.view_dataset.resolution + self.view_dataset.bounds.lower_bound
+        projections = (points - origin) @ axes
+        lower, upper = projections.min(axis=0), projections.max(axis=0)
+        return o3d.geometry.OrientedBoundingBox(origin + axes @ ((lower + upper) / 2), axes, upper - lower)
+
     def gsam2_obs_to_detection_list(
         self,
         gsam2_obs: dict, 
@@ -905,14 +1144,29 @@ class InstanceProcess:
         Return a DetectionList object from the gobs
         All object are still in the camera frame. 
         '''
+        detections, original_indexes = self.convert_gsam2_obs(gsam2_obs, pixel_indexes, pixel_indexes_mask, image_name)
+        return self.finalize_detections(detections, original_indexes)
+
+    def convert_gsam2_obs(
+        self,
+        gsam2_obs: dict, 
+        pixel_indexes: np.ndarray,
+        pixel_indexes_mask: np.ndarray,
+        image_name: str= None,
+    ):
+        '''
+        The per frame part of gsam2_obs_to_detection_list, only reads shared state so it can run in a worker.
+        Returns the detections without class_id / inst_color and the voxel indexes of every mask.
+        '''
         HW = pixel_indexes.shape[:2]
-        fg_detection_list = DetectionList()
+        detections = []
+        original_indexes = []
 
         gsam2_obs = self.resize_gsam2_obs(gsam2_obs, HW)
         gsam2_obs = self.filter_gsam2_obs(gsam2_obs, HW)
 
         if len(gsam2_obs['xyxy']) == 0:
-            return fg_detection_list
+            return detections, original_indexes
         
         # Compute the containing relationship among all detections and subtract fg from bg objects
         xyxy = gsam2_obs['xyxy']
@@ -933,7 +1187,7 @@ class InstanceProcess:
             global_object_indexes = self.create_object(
                 pixel_indexes, det_mask, pixel_indexes_mask
             )
-            self.objects_original_indexes.extend(global_object_indexes.tolist())
+            original_indexes.append(global_object_indexes)
             # It at least contains 5 points
             if len(global_object_indexes) < max(self.min_points_threshold, 5): 
                 continue
@@ -947,8 +1201,7 @@ class InstanceProcess:
 
             if pcd_bbox.volume() < 1e-6:
                 continue
-            
-            class_id = self.get_object_id(class_name=class_name)
+
             # Treat the detection in the same way as a 3D object
             # Store information that is enough to recover the detection
             detected_object = {
@@ -957,29 +1210,40 @@ class InstanceProcess:
 
                 # not list
                 'class_name' : class_name,                         # most conf class name for this object
-                'class_id': class_id,                      # for scene graph
                 'conf': gsam2_obs['confidence'][mask_idx],         # for scene graph
 
                 # 'class_id' : [global_class_id],                         # global class id for this detection
                 'num_detections' : 1,                            # number of detections in this object
-                'mask': [det_mask],
+                # cropped run-length encoding, the full mask is only decoded on demand
+                'mask': [RLEMask(det_mask)],
                 'xyxy': [gsam2_obs['xyxy'][mask_idx]],
                 
                 # 'n_points': [len(global_object_pcd.points)],
                 # 'n_points': len(global_object_indexes),
                 # 'pixel_area': [det_mask.sum()],
                 # 'contain_number': [None],                          # This will be computed later
-                "inst_color": np.random.rand(3),                 # A random color used for this segment instance
                 # 'is_background': False,
                 
                 # These are for the entire 3D object
                 # 'pcd': global_object_pcd,
                 'indexes': global_object_indexes,
+                'point_moments': self.get_point_moments(global_object_indexes),
                 'bbox': pcd_bbox,
                 'clip_ft': to_tensor(gsam2_obs['image_feats'][mask_idx]),
                 'text_ft': to_tensor(gsam2_obs['text_feats'][mask_idx]),
             }
             
-            fg_detection_list.append(detected_object)
+            detections.append(detected_object)
         
+        return detections, original_indexes
+
+    def finalize_detections(self, detections: list, original_indexes: list) -> DetectionList:
+        '''class ids and instance colors of converted detections, called in frame order'''
+        for indexes in original_indexes:
+            self.objects_original_indexes.extend(indexes.tolist())
+        fg_detection_list = DetectionList()
+        for detected_object in detections:
+            detected_object['class_id'] = self.get_object_id(class_name=detected_object['class_name'])  # for scene graph
+            detected_object['inst_color'] = np.random.rand(3)  # A random color used for this segment instance
+            fg_detection_list.append(detected_object)
         return fg_detection_list
\ No newline at end of file
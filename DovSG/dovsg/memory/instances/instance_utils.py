@@ -6,6 +6,10 @@ import copy
 import matplotlib
 import torch.nn.functional as F
 import pickle
+from typing import Union
+from scipy.sparse import coo_matrix
+from scipy.spatial import cKDTree
+from scipy.sparse.csgraph import connected_components
 
 def to_numpy(tensor):
     if isinstance(tensor, np.ndarray):
@@ -121,6 +125,222 @@ class LineMesh(object):
             vis.remove_geometry(cylinder, reset_bounding_box=False)
 
 
+def voxel_overlap_ratios(neighbors_a: list, neighbors_b: list, pairs: np.ndarray, max_queries: int=1 << 20) -> np.ndarray:
+    '''
+    For every pair (i, j) in pairs (P x 2), the ratio of voxels of set j that share a voxel with set i.
+    neighbors_a[i] and neighbors_b[j] are voxel indexes (n,) or their neighborhoods (n, K) from
+    ViewDataset.index_neighbors, -1 entries are ignored; dilating one side is enough for a distance tolerance.
+    All pairs are answered with one sorted (voxel index, set) key table instead of per-set search structures.
+    '''
+    ratios = np.zeros(len(pairs), dtype=np.float64)
+    if len(pairs) == 0:
+        return ratios
+    num_a = len(neighbors_a)
+    flat_a = [np.asarray(neighbors, dtype=np.int64).ravel() for neighbors in neighbors_a]
+    table = np.concatenate(flat_a) * num_a + np.repeat(np.arange(num_a, dtype=np.int64), [len(f) for f in flat_a])
+    table = np.unique(table[np.concatenate(flat_a) >= 0])
+    if len(table) == 0:
+        return ratios
+
+    # queries of all pairs, one row per voxel of set j repeated for every i it is paired with,
+    # answered in chunks of about max_queries rows
+    neighbors_b = [None if neighbors is None else np.asarray(neighbors, dtype=np.int64) for neighbors in neighbors_b]
+    # plain indexes are neighborhoods of size 1, (n,) -> (n, 1) also for empty sets
+    neighbors_b = [neighbors[:, None] if neighbors is not None and neighbors.ndim == 1 else neighbors
+                   for neighbors in neighbors_b]
+    lengths_b = np.array([len(neighbors_b[j]) for j in pairs[:, 1]], dtype=np.int64)
+    chunk_ids = np.cumsum(lengths_b * neighbors_b[pairs[0, 1]].shape[1]) // max_queries
+    for chunk_id in np.unique(chunk_ids):
+        chunk = np.flatnonzero(chunk_ids == chunk_id)
+        if lengths_b[chunk].sum() == 0:
+            continue
+        queries = np.concatenate([neighbors_b[j] for j in pairs[chunk, 1]])
+        keys = queries * num_a + np.repeat(pairs[chunk, 0].astype(np.int64), lengths_b[chunk])[:, None]
+        # sorted needles keep the table lookups cache friendly
+        order = np.argsort(keys, axis=None)
+        pos = np.empty(keys.size, dtype=np.int64)
+        pos[order] = np.searchsorted(table, keys.ravel()[order])
+        found = (table[np.minimum(pos, len(table) - 1)] == keys.ravel()).reshape(keys.shape)
+        found &= queries >= 0
+        covered = found.any(axis=1)
+
+        pair_ids = np.repeat(np.arange(len(chunk)), lengths_b[chunk])
+        counts = np.bincount(pair_ids, weights=covered, minlength=len(chunk))
+        ratios[chunk] = counts / np.maximum(lengths_b[chunk], 1)
+    return ratios
+
+
+def voxel_dbscan(voxels: np.ndarray, min_samples: int, sample_rate: float, max_radius: int=3) -> np.ndarray:
+    '''
+    DBSCAN labels of integer voxel coordinates (N >= min_samples, 3), with eps chosen like
+    InstanceProcess.indexes_denoise_dbscan: the sample_rate quantile of the distance to the min_samples-th
+    nearest voxel (the voxel itself included). Voxel distances are sqrt(integer), so up to max_radius voxels
+    the eps neighborhood is a fixed set of voxel offsets looked up in the sorted voxel keys (26-neighborhood
+    for eps = sqrt(3) voxels), and core voxels are joined by sparse connected components.
+    Clusters are numbered and border voxels assigned in the order sklearn visits them.
+    '''
+    num = len(voxels)
+    voxels = np.asarray(voxels, dtype=np.int64)
+    tree = cKDTree(voxels)
+    distances, _ = tree.query(voxels, k=min_samples)
+    kth_squared = np.rint(distances[:, -1] ** 2)
+    eps_squared = np.sort(kth_squared)[int(num * sample_rate)]
+
+    if eps_squared <= max_radius ** 2:
+        grid = np.arange(-max_radius, max_radius + 1)
+        offsets = np.stack(np.meshgrid(grid, grid, grid, indexing="ij"), axis=-1).reshape(-1, 3)
+        squared_norms = (offsets ** 2).sum(axis=1)
+        offsets = offsets[(squared_norms <= eps_squared) & (squared_norms > 0)]
+
+        # local keys with a max_radius margin, so shifted voxels never wrap around
+        shifted = voxels - voxels.min(axis=0) + max_radius
+        dims = shifted.max(axis=0) + max_radius + 1
+        keys = (shifted[:, 0] * dims[1] + shifted[:, 1]) * dims[2] + shifted[:, 2]
+        sort = np.argsort(keys)
+        sorted_keys = keys[sort]
+        rows, targets = [], []
+        for offset_key in (offsets[:, 0] * dims[1] + offsets[:, 1]) * dims[2] + offsets[:, 2]:
+            query = keys + offset_key
+            pos = np.minimum(np.searchsorted(sorted_keys, query), num - 1)
+            found = np.flatnonzero(sorted_keys[pos] == query)
+            rows.append(found)
+            targets.append(sort[pos[found]])
+        rows, targets = np.concatenate(rows), np.concatenate(targets)
+    else:
+        # sparse voxels, eps spans too many offsets
+        pairs = tree.query_pairs(np.sqrt(eps_squared) + 1e-6, output_type="ndarray")
+        rows = np.concatenate([pairs[:, 0], pairs[:, 1]])
+        targets = np.concatenate([pairs[:, 1], pairs[:, 0]])
+
+    # neighbor counts include the voxel itself
+    core = np.bincount(rows, minlength=num) + 1 >= min_samples
+    labels = np.full(num, -1, dtype=np.int64)
+    core_ids = np.flatnonzero(core)
+    if len(core_ids) == 0:
+        return labels
+    edge = core[rows] & core[targets]
+    graph = coo_matrix((np.ones(edge.sum(), dtype=np.int8), (rows[edge], targets[edge])), shape=(num, num))
+    _, components = connected_components(graph, directed=False)
+
+    # clusters are numbered by their first core voxel, border voxels join the lowest numbered core neighbor
+    first_core = np.full(components.max() + 1, num, dtype=np.int64)
+    np.minimum.at(first_core, components[core_ids], core_ids)
+    cluster_components = np.flatnonzero(first_core < num)
+    component_labels = np.full(components.max() + 1, -1, dtype=np.int64)
+    component_labels[cluster_components[np.argsort(first_core[cluster_components])]] = np.arange(len(cluster_components))
+    labels[core_ids] = component_labels[components[core_ids]]
+
+    border_edge = ~core[rows] & core[targets]
+    border_labels = np.full(num, num, dtype=np.int64)
+    np.minimum.at(border_labels, rows[border_edge], labels[targets[border_edge]])
+    border = border_labels < num
+    labels[border] = border_labels[border]
+    return labels
+
+
+def get_box_arrays(bboxes: list):
+    '''centers (N, 3), rotations (N, 3, 3) and extents (N, 3) of Open3D oriented or axis aligned boxes'''
+    centers = np.zeros((len(bboxes), 3))
+    rotations = np.tile(np.eye(3), (len(bboxes), 1, 1))
+    extents = np.zeros((len(bboxes), 3))
+    for i, bbox in enumerate(bboxes):
+        if isinstance(bbox, o3d.geometry.OrientedBoundingBox):
+            centers[i], rotations[i], extents[i] = bbox.center, bbox.R, bbox.extent
+        else:
+            centers[i], extents[i] = bbox.get_center(), bbox.get_extent()
+    return centers, rotations, extents
+
+
+def boxes_intersect(center_a: np.ndarray, rotation_a: np.ndarray, half_a: np.ndarray,
+                    center_b: np.ndarray, rotation_b: np.ndarray, half_b: np.ndarray) -> np.ndarray:
+    '''
+    Separating axis test of oriented boxes (center (..., 3), rotation (..., 3, 3) with the box axes as columns,
+    half extents (..., 3)), the leading dimensions broadcast. True when no face normal or edge cross product
+    separates the boxes, touching boxes count as intersecting.
+    '''
+    # box b and the center offset in the frame of box a
+    rotation = np.einsum("...ki,...kj->...ij", rotation_a, rotation_b)
+    offset = np.einsum("...ki,...k->...i", rotation_a, center_b - center_a)
+    # the epsilon keeps near parallel edges from producing a degenerate cross product axis
+    abs_rotation = np.abs(rotation) + 1e-9
+    half_a = np.broadcast_to(half_a, offset.shape)
+    half_b = np.broadcast_to(half_b, offset.shape)
+
+    # face normals of a and of b
+    separated = np.any(np.abs(offset) > half_a + np.einsum("...ij,...j->...i", abs_rotation, half_b), axis=-1)
+    separated |= np.any(np.abs(np.einsum("...i,...ij->...j", offset, rotation)) >
+                        np.einsum("...i,...ij->...j", half_a, abs_rotation) + half_b, axis=-1)
+    # cross products of edge i of a and edge j of b
+    for i in range(3):
+        i1, i2 = (i + 1) % 3, (i + 2) % 3
+        for j in range(3):
+            j1, j2 = (j + 1) % 3, (j + 2) % 3
+            radius_a = half_a[..., i1] * abs_rotation[..., i2, j] + half_a[..., i2] * abs_rotation[..., i1, j]
+            radius_b = half_b[..., j1] * abs_rotation[..., i, j2] + half_b[..., j2] * abs_rotation[..., i, j1]
+            distance = np.abs(offset[..., i2] * rotation[..., i1, j] - offset[..., i1] * rotation[..., i2, j])
+            separated |= distance > radius_a + radius_b
+    return ~separated
+
+
+class SpatialHash:
+    '''
+    Coarse grid over the voxel grid (cells of cell_size voxels) mapping cells to the objects occupying them.
+    update() only re-hashes objects whose 'indexes' are not the array they were hashed from (added, merged,
+    denoised or removed objects), the sorted (cell, object) table is rebuilt from the per object cells after changes.
+    Voxels closer than cell_size voxels lie in the same or adjacent cells, so candidate_pairs() keeps every
+    detection / object pair that can overlap within that distance.
+    '''
+    def __init__(self, view_dataset, cell_size: int=4):
+        self.view_dataset = view_dataset
+        self.cell_size = cell_size
+        # one cell of margin on each side, dilated cells never wrap around
+        self.dims = (np.asarray(view_dataset.voxel_num, dtype=np.int64) + 1) // cell_size + 3
+        grid = np.arange(-1, 2)
+        offsets = np.stack(np.meshgrid(grid, grid, grid, indexing="ij"), axis=-1).reshape(-1, 3)
+        self.offset_keys = (offsets[:, 0] * self.dims[1] + offsets[:, 1]) * self.dims[2] + offsets[:, 2]
+        self.sources = []
+        self.object_cells = []
+        self.table_keys = np.zeros(0, dtype=np.int64)
+        self.table_objects = np.zeros(0, dtype=np.int64)
+
+    def get_cells(self, indexes) -> np.ndarray:
+        cells = self.view_dataset.index_to_voxel(np.asarray(indexes, dtype=np.int64)).astype(np.int64) // self.cell_size + 1
+        return np.unique((cells[:, 0] * self.dims[1] + cells[:, 1]) * self.dims[2] + cells[:, 2])
+
+    def update(self, objects: list):
+        num = len(objects)
+        changed = len(self.sources) != num
+        self.sources = self.sources[:num] + [None] * (num - len(self.sources))
+        self.object_cells = self.object_cells[:num] + [None] * (num - len(self.object_cells))
+        for i in range(num):
+            if objects[i]["indexes"] is not self.sources[i]:
+                self.sources[i] = objects[i]["indexes"]
+                self.object_cells[i] = self.get_cells(objects[i]["indexes"])
+                changed = True
+        if changed:
+            keys = np.concatenate(self.object_cells) if num > 0 else np.zeros(0, dtype=np.int64)
+            object_ids = np.repeat(np.arange(num), [len(cells) for cells in self.object_cells])
+            order = np.argsort(keys, kind="stable")
+            self.table_keys = keys[order]
+            self.table_objects = object_ids[order]
+
+    def candidates(self, indexes) -> np.ndarray:
+        '''sorted ids of the objects in the cells of indexes or their neighbours'''
+        queries = np.unique(self.get_cells(indexes)[:, None] + self.offset_keys[None, :])
+        left = np.searchsorted(self.table_keys, queries, side="left")
+        right = np.searchsorted(self.table_keys, queries, side="right")
+        lengths = right - left
+        positions = np.repeat(left - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        return np.unique(self.table_objects[positions])
+
+    def candidate_pairs(self, detection_list: Iterable[dict]) -> np.ndarray:
+        '''(P, 2) (object, detection) pairs that can overlap, sorted by object'''
+        pairs = [np.stack([objects, np.full(len(objects), j)], axis=1)
+                 for j, objects in enumerate(self.candidates(det["indexes"]) for det in detection_list)]
+        pairs = np.concatenate(pairs).astype(np.int64) if len(pairs) > 0 else np.zeros((0, 2), dtype=np.int64)
+        return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+
 class DetectionList(list):
     def get_values(self, key, idx:int=None):
         if idx is None:
@@ -232,6 +452,48 @@ class DetectionList(list):
 
 
 class MapObjectList(DetectionList):
+    def __reduce__(self):
+        # pickled as columnar arrays, see ObjectStore
+        from dovsg.memory.instances.object_store import ObjectStore
+        return (ObjectStore.to_objects, (ObjectStore.from_objects(self),))
+
+    def __copy__(self):
+        # the same dicts, without going through ObjectStore
+        return MapObjectList(list(self))
+
+    def __deepcopy__(self, memo):
+        return MapObjectList(copy.deepcopy(list(self), memo))
+
+    def get_feature_matrix(self, key: str) -> torch.Tensor:
+        '''
+        L2 normalized (N, D) float matrix of key ('clip_ft' / 'text_ft'), kept between calls.
+        Row i is only rewritten when self[i][key] is no longer the feature it was built from:
+        added, removed and merged objects (merge_obj_to_obj assigns new tensors), features are never changed in place.
+        '''
+        if not hasattr(self, "feature_cache"):
+            self.feature_cache = {}
+        matrix, sources = self.feature_cache.get(key, (None, []))
+        num = len(self)
+        if num == 0:
+            return torch.zeros((0, 0), dtype=torch.float32)
+        if matrix is None or matrix.shape[0] < num:
+            # grow by doubling, appends do not copy the whole matrix every frame
+            dim = to_tensor(self[0][key]).shape[-1]
+            grown = torch.zeros((max(num, 2 * (0 if matrix is None else matrix.shape[0])), dim), dtype=torch.float32)
+            if matrix is not None:
+                grown[:len(sources)] = matrix[:len(sources)]
+            matrix = grown
+        sources = sources[:num]
+        stale = [i for i in range(num) if i >= len(sources) or self[i][key] is not sources[i]]
+        if len(stale) > 0:
+            features = torch.stack([to_tensor(self[i][key]).float() for i in stale])
+            matrix[stale] = F.normalize(features, dim=-1)
+            sources = sources + [None] * (num - len(sources))
+            for i in stale:
+                sources[i] = self[i][key]
+        self.feature_cache[key] = (matrix, sources)
+        return matrix[:num]
+
     def compute_similarities(self, new_clip_ft, device="cuda"):
         '''
         The input feature should be of shape (D, ), a one-row vector
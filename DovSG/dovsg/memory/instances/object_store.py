@@ -0,0 +1,155 @@
+""" columnar serialization of instance objects """
+import numpy as np
+import open3d as o3d
+import torch
+from typing import Iterable
+from dovsg.memory.instances.instance_utils import MapObjectList, to_numpy
+from dovsg.memory.semantic_memory_store import RLEMask
+
+
+class ObjectStore:
+    '''
+    Instance objects as arrays instead of a list of dicts, the pickled form of MapObjectList:
+    CSR voxel indexes (index_offsets, indexes), one row per object in the feature matrices and
+    scalar columns, and an observation table with one row per merged detection (obs_offsets).
+    Masks of the observation table are cropped run-length encodings (RLEMask).
+    Boxes are stored as center / rotation / extent and rebuilt as Open3D boxes, keys outside
+    these columns are kept per object in extras.
+    '''
+    observation_keys = ["mask_idx", "image_name", "xyxy", "mask"]
+    columnar_keys = ["indexes", "point_moments", "bbox", "clip_ft", "text_ft", "class_name", "class_id", "conf",
+                     "num_detections", "inst_color"] + observation_keys
+
+    def __init__(self):
+        self.index_offsets = np.zeros(1, dtype=np.int64)
+        self.indexes = np.zeros(0, dtype=np.int64)
+        self.clip_fts = np.zeros((0, 0), dtype=np.float32)
+        self.text_fts = np.zeros((0, 0), dtype=np.float32)
+        self.tensor_features = False
+        self.class_names = np.zeros(0, dtype=str)
+        self.class_ids = np.zeros(0, dtype=str)
+        self.confs = np.zeros(0, dtype=np.float32)
+        self.num_detections = np.zeros(0, dtype=np.int64)
+        self.inst_colors = np.zeros((0, 3), dtype=np.float64)
+        self.extras = []
+        # objects without moments or box have has_point_moments / bbox_type 0
+        self.has_point_moments = np.zeros(0, dtype=bool)
+        self.point_moments = np.zeros((0, 13), dtype=np.float64)
+        self.bbox_types = np.zeros(0, dtype=np.int8)  # 0 none, 1 oriented, 2 axis aligned
+        self.bbox_centers = np.zeros((0, 3), dtype=np.float64)
+        self.bbox_rotations = np.zeros((0, 3, 3), dtype=np.float64)
+        self.bbox_extents = np.zeros((0, 3), dtype=np.float64)
+        self.bbox_colors = np.zeros((0, 3), dtype=np.float64)
+
+        self.obs_offsets = np.zeros(1, dtype=np.int64)
+        self.obs_mask_idx = np.zeros(0, dtype=np.int64)
+        self.obs_image_names = np.zeros(0, dtype=str)
+        self.obs_xyxy = np.zeros((0, 4), dtype=np.float32)
+        self.obs_mask_shapes = np.zeros((0, 2), dtype=np.int64)
+        self.obs_mask_boxes = np.zeros((0, 4), dtype=np.int32)
+        self.obs_rle_offsets = np.zeros(1, dtype=np.int64)
+        self.obs_rle_runs = np.zeros(0, dtype=np.uint32)
+
+    def __len__(self):
+        return len(self.index_offsets) - 1
+
+    @classmethod
+    def from_objects(cls, objects: Iterable[dict]) -> "ObjectStore":
+        objects = list(objects)
+        store = cls()
+        if len(objects) == 0:
+            return store
+
+        indexes = [np.asarray(obj["indexes"]).ravel() for obj in objects]
+        store.index_offsets = np.concatenate([[0], np.cumsum([len(i) for i in indexes])]).astype(np.int64)
+        store.indexes = np.concatenate(indexes)
+        store.tensor_features = isinstance(objects[0]["clip_ft"], torch.Tensor)
+        store.clip_fts = np.stack([to_numpy(obj["clip_ft"]) for obj in objects])
+        store.text_fts = np.stack([to_numpy(obj["text_ft"]) for obj in objects])
+        store.class_names = np.array([obj["class_name"] for obj in objects])
+        store.class_ids = np.array([obj["class_id"] for obj in objects])
+        store.confs = np.array([obj["conf"] for obj in objects])
+        store.num_detections = np.array([obj["num_detections"] for obj in objects], dtype=np.int64)
+        store.inst_colors = np.stack([np.asarray(obj["inst_color"]) for obj in objects])
+        store.extras = [{k: v for k, v in obj.items() if k not in cls.columnar_keys} for obj in objects]
+        store.has_point_moments = np.array(["point_moments" in obj for obj in objects])
+        store.point_moments = np.stack([obj["point_moments"] if "point_moments" in obj else np.zeros(13)
+                                        for obj in objects]).astype(np.float64)
+        boxes = [box_to_arrays(obj.get("bbox")) for obj in objects]
+        store.bbox_types = np.array([box[0] for box in boxes], dtype=np.int8)
+        store.bbox_centers, store.bbox_rotations, store.bbox_extents, store.bbox_colors = \
+            [np.stack([box[k] for box in boxes]) for k in range(1, 5)]
+
+        num_obs = [len(obj["image_name"]) for obj in objects]
+        for obj, n in zip(objects, num_obs):
+            assert all(len(obj[k]) == n for k in cls.observation_keys), "observation lists differ in length"
+        store.obs_offsets = np.concatenate([[0], np.cumsum(num_obs)]).astype(np.int64)
+        store.obs_mask_idx = np.array([i for obj in objects for i in obj["mask_idx"]], dtype=np.int64)
+        store.obs_image_names = np.array([name for obj in objects for name in obj["image_name"]])
+        store.obs_xyxy = np.array([xyxy for obj in objects for xyxy in obj["xyxy"]], dtype=np.float32).reshape(-1, 4)
+        # full masks of older objects are encoded here
+        masks = [mask if isinstance(mask, RLEMask) else RLEMask(mask) for obj in objects for mask in obj["mask"]]
+        store.obs_mask_shapes = np.array([mask.shape for mask in masks], dtype=np.int64).reshape(-1, 2)
+        store.obs_mask_boxes = np.array([mask.box for mask in masks], dtype=np.int32).reshape(-1, 4)
+        store.obs_rle_offsets = np.concatenate([[0], np.cumsum([len(mask.runs) for mask in masks])]).astype(np.int64)
+        store.obs_rle_runs = np.concatenate([mask.runs for mask in masks]).astype(np.uint32) \
+            if len(masks) > 0 else np.zeros(0, dtype=np.uint32)
+        return store
+
+    def get_indexes(self, i: int) -> np.ndarray:
+        return self.indexes[self.index_offsets[i]:self.index_offsets[i + 1]]
+
+    def get_mask(self, obs: int) -> RLEMask:
+        height, width = self.obs_mask_shapes[obs]
+        runs = self.obs_rle_runs[self.obs_rle_offsets[obs]:self.obs_rle_offsets[obs + 1]].copy()
+        return RLEMask.from_runs(self.obs_mask_boxes[obs].copy(), runs, height, width)
+
+    def __getitem__(self, i: int) -> dict:
+        '''object i as the dict used by InstanceProcess and the scene graph'''
+        obs = range(self.obs_offsets[i], self.obs_offsets[i + 1])
+        clip_ft, text_ft = self.clip_fts[i].copy(), self.text_fts[i].copy()
+        if self.tensor_features:
+            clip_ft, text_ft = torch.from_numpy(clip_ft), torch.from_numpy(text_ft)
+        obj = {
+            "mask_idx": [int(self.obs_mask_idx[k]) for k in obs],
+            "image_name": [str(self.obs_image_names[k]) for k in obs],
+            "class_name": str(self.class_names[i]),
+            "class_id": str(self.class_ids[i]),
+            "conf": self.confs[i],
+            "num_detections": int(self.num_detections[i]),
+            "mask": [self.get_mask(k) for k in obs],
+            "xyxy": [self.obs_xyxy[k].copy() for k in obs],
+            "inst_color": self.inst_colors[i].copy(),
+            "indexes": self.get_indexes(i).copy(),
+            "clip_ft": clip_ft,
+            "text_ft": text_ft,
+        }
+        if self.has_point_moments[i]:
+            obj["point_moments"] = self.point_moments[i].copy()
+        if self.bbox_types[i] > 0:
+            obj["bbox"] = arrays_to_box(self.bbox_types[i], self.bbox_centers[i], self.bbox_rotations[i],
+                                        self.bbox_extents[i], self.bbox_colors[i])
+        obj.update(self.extras[i])
+        return obj
+
+    def to_objects(self) -> MapObjectList:
+        return MapObjectList([self[i] for i in range(len(self))])
+
+
+def box_to_arrays(bbox):
+    '''(type, center, rotation, extent, color) of an Open3D box, type 0 for None, axis aligned boxes give (type, min, I, max, color)'''
+    if isinstance(bbox, o3d.geometry.OrientedBoundingBox):
+        return 1, np.asarray(bbox.center), np.asarray(bbox.R), np.asarray(bbox.extent), np.asarray(bbox.color)
+    if isinstance(bbox, o3d.geometry.AxisAlignedBoundingBox):
+        return 2, np.asarray(bbox.min_bound), np.eye(3), np.asarray(bbox.max_bound), np.asarray(bbox.color)
+    return 0, np.zeros(3), np.eye(3), np.zeros(3), np.zeros(3)
+
+
+def arrays_to_box(bbox_type: int, center: np.ndarray, rotation: np.ndarray, extent: np.ndarray, color: np.ndarray):
+    if bbox_type == 1:
+        bbox = o3d.geometry.OrientedBoundingBox(center, rotation, extent)
+    else:
+        # min and max bound, see box_to_arrays
+        bbox = o3d.geometry.AxisAlignedBoundingBox(center, extent)
+    bbox.color = color
+    return bbox
@@ -5,7 +5,7 @@ import pandas as pd
 import open3d as o3d
 import torch
 import torch.nn.functional as F
-from dovsg.perception.models.myclip import MyClip
+from dovsg.perception.models.myclip import get_clip
 from typing import Union
 from dovsg.memory.view_dataset import ViewDataset
 from dovsg.memory.instances.instance_utils import get_bbox, MapObjectList, LineMesh
@@ -102,7 +102,7 @@ def vis_instances(
         voxel_size: float=0.01
     ):
     if clip_vis:
-        myclip = MyClip(device=device)
+        myclip = get_clip(device=device)
     cmap = matplotlib.colormaps.get_cmap("turbo")
     
     background_pcd_ = None
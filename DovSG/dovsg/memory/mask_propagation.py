@@ -0,0 +1,80 @@
+import numpy as np
+from typing import List
+from dovsg.memory.view_dataset import ViewDataset
+
+
+class MaskPropagator:
+    '''
+    Pose-guided mask propagation: detections of a keyframe are carried to a nearby frame without running
+    the detector. Every valid pixel of the target frame is reprojected into the keyframe with the view dataset
+    poses; it takes the keyframe masks at that pixel when the keyframe sees the same surface there
+    (depth difference below depth_tolerance), so occluded and newly visible regions stay unlabeled.
+    Only masks and boxes are recomputed: a propagated detection reuses the keyframe confidence, class and
+    CLIP image_feats / text_feats, the crop of the target frame is never encoded.
+    '''
+    def __init__(
+        self,
+        view_dataset: ViewDataset,
+        depth_tolerance: float=0.05,
+        min_mask_pixels: int=100
+    ):
+        self.view_dataset = view_dataset
+        self.depth_tolerance = depth_tolerance
+        self.min_mask_pixels = min_mask_pixels
+
+    def has_poses(self, frame_indexes: List[int]) -> bool:
+        '''view datasets cached before poses were stored have none, propagation is not possible then'''
+        poses = getattr(self.view_dataset, "poses", [])
+        return len(frame_indexes) == 0 or len(poses) > max(frame_indexes)
+
+    def world_to_camera(self, index: int, points: np.ndarray) -> np.ndarray:
+        # poses are camera to world
+        pose = self.view_dataset.poses[index]
+        return (points - pose[:3, 3]) @ pose[:3, :3]
+
+    def propagate(self, source_index: int, det_res: dict, target_index: int) -> dict:
+        '''det_res of view dataset frame source_index -> det_res (same format) of frame target_index'''
+        num_detections = len(det_res["xyxy"])
+        if num_detections == 0:
+            return dict(det_res)
+
+        intrinsic = self.view_dataset.intrinsic_matrix
+        source_valid = self.view_dataset.masks[source_index]
+        height, width = source_valid.shape
+
+        ys, xs = np.nonzero(self.view_dataset.masks[target_index])
+        points = self.view_dataset.global_points[target_index][ys, xs]
+        camera_points = self.world_to_camera(source_index, points)
+        depth = camera_points[:, 2]
+        in_front = depth > 1e-6
+        safe_depth = np.where(in_front, depth, 1)
+        u = np.round(intrinsic[0, 0] * camera_points[:, 0] / safe_depth + intrinsic[0, 2]).astype(np.int64)
+        v = np.round(intrinsic[1, 1] * camera_points[:, 1] / safe_depth + intrinsic[1, 2]).astype(np.int64)
+        inside = in_front & (u >= 0) & (u < width) & (v >= 0) & (v < height)
+        ys, xs, u, v, depth = ys[inside], xs[inside], u[inside], v[inside], depth[inside]
+
+        # occlusion check against what the keyframe observed at the reprojected pixel
+        source_depth = self.world_to_camera(source_index, self.view_dataset.global_points[source_index][v, u])[:, 2]
+        visible = source_valid[v, u] & (np.abs(source_depth - depth) < self.depth_tolerance)
+        ys, xs, u, v = ys[visible], xs[visible], u[visible], v[visible]
+
+        masks = np.zeros((num_detections, height, width), dtype=bool)
+        masks[:, ys, xs] = det_res["mask"][:, v, u]
+
+        keep = masks.reshape(num_detections, -1).sum(axis=1) >= self.min_mask_pixels
+        masks = masks[keep]
+        xyxy = np.zeros((len(masks), 4), dtype=np.float32)
+        for i, mask in enumerate(masks):
+            rows = np.flatnonzero(mask.any(axis=1))
+            cols = np.flatnonzero(mask.any(axis=0))
+            xyxy[i] = [cols[0], rows[0], cols[-1], rows[-1]]
+
+        return {
+            "xyxy": xyxy,
+            "confidence": np.asarray(det_res["confidence"])[keep],
+            "class_id": np.asarray(det_res["class_id"])[keep],
+            "mask": masks,
+            "classes": det_res["classes"],
+            "image_feats": np.asarray(det_res["image_feats"])[keep],
+            "text_feats": np.asarray(det_res["text_feats"])[keep]
+        }
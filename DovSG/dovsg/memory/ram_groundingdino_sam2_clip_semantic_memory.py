@@ -8,11 +8,14 @@ from torchvision import transforms
 from ram.models import ram
 from ram import inference_ram
 from dovsg.perception.models.mygroundingdinosam2 import MyGroundingDINOSAM2
-from dovsg.perception.models.myclip import MyClip
-from dovsg.utils.utils import ram_checkpoint_path, bert_base_uncased_path
+from dovsg.perception.models.myclip import get_clip
+from dovsg.perception.models.cpu_backend import check_backend, quantize_int8
+from dovsg.utils.model_registry import model_registry
+from dovsg.utils.utils import ram_checkpoint_path, bert_base_uncased_path, get_image_hash
+from dovsg.memory.ram_tags import RamTagCache
 import warnings
 warnings.filterwarnings('ignore')
-from typing import Set, List
+from typing import Set, List, Union
 
 
 class RamGroundingDinoSAM2ClipDataset():
@@ -23,33 +26,26 @@ class RamGroundingDinoSAM2ClipDataset():
         text_threshold: float=0.25,
         nms_threshold: float=0.5,
         device: str="cuda",
-        accumu_classes: bool=False
+        accumu_classes: bool=False,
+        backend: str="eager",
+        embedding_cache_dir: Union[str, Path, None]=None,
+        adaptive_resolution: bool=False
     ):
+        check_backend(backend)
         self.device = device
+        self.backend = backend
         self.box_threshold = box_threshold
         self.text_threshold = text_threshold
         self.nms_threshold = nms_threshold
         self.accumu_classes = accumu_classes
+        self.adaptive_resolution = adaptive_resolution
 
         ### Initialize the RAM (tagging) model ###
         # RAM is memory-heavy, prefer CPU if device="cpu" or if CUDA OOMs
-        self.ram_device = "cpu" if device == "cpu" else "cuda"
-        tagging_model = ram(
-            pretrained=ram_checkpoint_path,
-            image_size=384, vit="swin_l",
-            text_encoder_type=bert_base_uncased_path
-        )
-        try:
-            self.tagging_model = tagging_model.eval().to(self.ram_device)
-            print(f"✓ RAM model loaded on {self.ram_device}")
-        except RuntimeError as exc:
-            if "out of memory" in str(exc).lower():
-                print("⚠ RAM model OOM on CUDA; falling back to CPU.")
-                torch.cuda.empty_cache()
-                self.ram_device = "cpu"
-                self.tagging_model = tagging_model.eval().to("cpu")
-            else:
-                raise
+        self.ram_device = "cpu" if device == "cpu" or backend == "cpu_int8" else "cuda"
+        # loaded on the first frame missing in the tag cache, see get_tags
+        self.tagging_model = None
+        self.tag_cache = RamTagCache()
 
         # ### Initialize the GroundingDINO SAM2 model ###
         # Always use GPU for detection (fast with C++ CUDA extensions)
@@ -57,14 +53,15 @@ class RamGroundingDinoSAM2ClipDataset():
         self.mygroundingdino_sam2 = MyGroundingDINOSAM2(
             box_threshold=self.box_threshold,
             text_threshold=self.text_threshold,
-            device=self.detection_device
+            device=self.detection_device,
+            embedding_cache_dir=embedding_cache_dir
         )
         print(f"✓ GroundingDINO + SAM2 loaded on {self.detection_device}")
 
-        # CLIP can stay on GPU (moderate memory, fast inference)
-        self.clip_device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.myclip = MyClip(device=self.clip_device)
-        print(f"✓ CLIP model loaded on {self.clip_device}")
+        # CLIP can stay on GPU (moderate memory, fast inference), the cpu_int8 backend runs it on cpu
+        self.clip_device = "cuda" if torch.cuda.is_available() and backend == "eager" else "cpu"
+        self.myclip = get_clip(device=self.clip_device, backend=backend)
+        print(f"✓ CLIP model loaded on {self.clip_device} ({backend})")
         
         # initialize Tag2Text
         self.tagging_transform = transforms.Compose([
@@ -95,6 +92,35 @@ class RamGroundingDinoSAM2ClipDataset():
         # self.add_classes += self.bg_classes
 
 
+    def get_tagging_model(self):
+        if self.tagging_model is None:
+            self.tagging_model = model_registry.get(f"ram:{self.ram_device}:{self.backend}", self.load_tagging_model)
+            # the model may have fallen back to cpu when it was loaded
+            self.ram_device = next(self.tagging_model.parameters()).device.type
+        return self.tagging_model
+
+    def load_tagging_model(self):
+        tagging_model = ram(
+            pretrained=ram_checkpoint_path,
+            image_size=384, vit="swin_l",
+            text_encoder_type=bert_base_uncased_path
+        )
+        if self.backend == "cpu_int8":
+            # tag generation returns strings and can't be traced, so RAM stays eager but int8 quantized
+            print("✓ RAM model loaded on cpu (int8)")
+            return quantize_int8(tagging_model)
+        try:
+            tagging_model = tagging_model.eval().to(self.ram_device)
+            print(f"✓ RAM model loaded on {self.ram_device}")
+        except RuntimeError as exc:
+            if "out of memory" in str(exc).lower():
+                print("⚠ RAM model OOM on CUDA; falling back to CPU.")
+                torch.cuda.empty_cache()
+                tagging_model = tagging_model.eval().to("cpu")
+            else:
+                raise
+        return tagging_model
+
     def get_classes_colors(self, classes):
         class_colors = {}
         # Generate a random color for each class
@@ -108,11 +134,24 @@ class RamGroundingDinoSAM2ClipDataset():
         class_colors[-1] = (0, 0, 0)
         return class_colors
 
-    def semantic_process(self, image: np.ndarray):
+    def get_tags(self, image: np.ndarray) -> str:
+        '''RAM tags of the image as "tag | tag | ...", cached on disk by image content'''
+        key = f"{self.backend}:{get_image_hash(image)}"
+        tags = self.tag_cache.get(key)
+        if tags is None:
+            tagging_model = self.get_tagging_model()
+            raw_image = Image.fromarray(image).resize((384, 384))
+            raw_image = self.tagging_transform(raw_image).unsqueeze(0).to(self.ram_device)
+            tags = inference_ram(raw_image , tagging_model)[0]
+            self.tag_cache.update(key, tags)
+        return tags
+
+    def semantic_process(self, image: np.ndarray, visualize: bool=True, tags: Union[str, None]=None):
+        '''tags: precomputed RAM tags (e.g. reused from neighbouring frames), tagged here if None'''
         image_pil = Image.fromarray(image)
-        raw_image = image_pil.resize((384, 384))
-        raw_image = self.tagging_transform(raw_image).unsqueeze(0).to(self.ram_device)
-        text_prompt = inference_ram(raw_image , self.tagging_model)[0].replace(' | ', '.')
+        if tags is None:
+            tags = self.get_tags(image)
+        text_prompt = tags.replace(' | ', '.')
         classes = self.process_tag_classes(text_prompt=text_prompt)
         self.global_classes.update(classes)
         
@@ -123,7 +162,8 @@ class RamGroundingDinoSAM2ClipDataset():
         # ### Segment Anything Model 2###
         detections = self.mygroundingdino_sam2.run(
             image=image,
-            classes=classes
+            classes=classes,
+            adaptive_resolution=self.adaptive_resolution
         )
 
         # detections.class_id maybe None
@@ -139,9 +179,6 @@ class RamGroundingDinoSAM2ClipDataset():
         else:
             image_feats, text_feats = [], []
 
-        ### Visualize results ###
-        annotated_image, labels = self.mygroundingdino_sam2.vis_result(image, detections, classes)
-
         # Convert the detections to a dict. The elements are in np.array
         det_res = {
             "xyxy": detections.xyxy,
@@ -153,8 +190,23 @@ class RamGroundingDinoSAM2ClipDataset():
             "text_feats": text_feats
         }
 
+        ### Visualize results ###
+        # with visualize=False the caller annotates later, see annotate
+        annotated_image = self.annotate(image, det_res) if visualize else None
+
         return det_res, annotated_image, image_pil
 
+    def annotate(self, image: np.ndarray, det_res: dict):
+        '''Annotate the image with a det_res dict, no model is used so it can run off the inference thread'''
+        detections = sv.Detections(
+            xyxy=det_res["xyxy"],
+            mask=det_res["mask"],
+            confidence=det_res["confidence"],
+            class_id=det_res["class_id"]
+        )
+        annotated_image, labels = self.mygroundingdino_sam2.vis_result(image, detections, det_res["classes"])
+        return annotated_image
+
     def get_classes_and_colors(self):
         class_colors = self.get_classes_colors(self.global_classes)
         return {
@@ -0,0 +1,59 @@
+import json
+import os
+import atexit
+from pathlib import Path
+from typing import Union
+from dovsg.utils.utils import ram_tag_cache_path
+
+
+def merge_tags(*tags_list: str) -> str:
+    '''Union of RAM tag strings, keeping the order of first appearance'''
+    tags = []
+    for frame_tags in tags_list:
+        for tag in frame_tags.split(" | "):
+            if tag != "" and tag not in tags:
+                tags.append(tag)
+    return " | ".join(tags)
+
+
+class RamTagCache:
+    '''
+    RAM tags keyed by backend and image content hash, persisted to cache_path.
+    New tags are written in batches: once save_interval of them are pending, when save() is called
+    (get_frame_tags does after tagging) and at interpreter exit.
+    '''
+    def __init__(self, cache_path: Union[str, Path, None]=ram_tag_cache_path, save_interval: int=64):
+        self.cache_path = Path(cache_path) if cache_path is not None else None
+        self.save_interval = save_interval
+        self.tags = {}
+        self.pending = 0
+        self.hits = 0
+        self.misses = 0
+        if self.cache_path is not None and self.cache_path.exists():
+            with open(self.cache_path, "r") as f:
+                self.tags = json.load(f)
+        atexit.register(self.save)
+
+    def get(self, key: str) -> Union[str, None]:
+        if key in self.tags:
+            self.hits += 1
+            return self.tags[key]
+        self.misses += 1
+        return None
+
+    def update(self, key: str, tags: str):
+        self.tags[key] = tags
+        self.pending += 1
+        if self.pending >= self.save_interval:
+            self.save()
+
+    def save(self):
+        if self.cache_path is None or self.pending == 0:
+            return
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file first so an interrupted save never corrupts the cache
+        tmp_path = self.cache_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.tags, f)
+        os.replace(tmp_path, self.cache_path)
+        self.pending = 0
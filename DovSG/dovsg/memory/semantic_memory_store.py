@@ -0,0 +1,258 @@
+import json
+import os
+import shutil
+import pickle
+import numpy as np
+from pathlib import Path
+from typing import Union, List, Tuple
+
+
+"""
+Columnar semantic memory container. The frames of a step are written in chunks, every chunk is a shard directory
+semantic_memory/shard_{k:05} holding:
+    index.json          frame name -> detection row range, classes and image size
+    xyxy.npy            (N, 4) float32
+    confidence.npy      (N,) float32
+    class_id.npy        (N,) int64
+    mask_box.npy        (N, 4) int32, x_min, y_min, x_max, y_max (exclusive) of the mask crop
+    rle_offsets.npy     (N + 1,) int64, row ranges in rle_runs
+    rle_runs.npy        (R,) uint32, alternating False / True run lengths of the row-major mask crop
+    image_feats.npy     (N, D) float16
+    text_feats.npy      (N, D) float16
+All arrays are memory mapped when reading. A shard is written into shard_{k:05}.tmp and renamed into place
+once complete, so a crash leaves only complete shards behind.
+"""
+
+SEMANTIC_MEMORY_VERSION = 1
+COLUMNS = ["xyxy", "confidence", "class_id", "mask_box", "rle_offsets", "rle_runs", "image_feats", "text_feats"]
+
+
+def encode_mask(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''Crop a binary mask to its content and run-length encode the crop'''
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if len(rows) == 0:
+        return np.zeros(4, dtype=np.int32), np.zeros(0, dtype=np.uint32)
+    y_min, y_max = rows[0], rows[-1] + 1
+    x_min, x_max = cols[0], cols[-1] + 1
+    crop = mask[y_min:y_max, x_min:x_max].ravel()
+    change = np.flatnonzero(crop[1:] != crop[:-1]) + 1
+    runs = np.diff(np.concatenate([[0], change, [crop.size]]))
+    # runs always start with a False run, which is empty when the crop starts with True
+    if crop[0]:
+        runs = np.concatenate([[0], runs])
+    box = np.array([x_min, y_min, x_max, y_max], dtype=np.int32)
+    return box, runs.astype(np.uint32)
+
+
+def decode_mask(box: np.ndarray, runs: np.ndarray, height: int, width: int) -> np.ndarray:
+    mask = np.zeros((height, width), dtype=bool)
+    x_min, y_min, x_max, y_max = [int(v) for v in box]
+    if len(runs) == 0:
+        return mask
+    values = np.arange(len(runs)) % 2 == 1
+    crop = np.repeat(values, runs.astype(np.int64))
+    mask[y_min:y_max, x_min:x_max] = crop.reshape(y_max - y_min, x_max - x_min)
+    return mask
+
+
+class RLEMask:
+    '''Cropped run-length encoded binary mask, decode() or np.asarray gives the full (height, width) mask'''
+    def __init__(self, mask: np.ndarray):
+        self.height, self.width = mask.shape
+        self.box, self.runs = encode_mask(np.asarray(mask, dtype=bool))
+
+    @classmethod
+    def from_runs(cls, box: np.ndarray, runs: np.ndarray, height: int, width: int) -> "RLEMask":
+        rle_mask = cls.__new__(cls)
+        rle_mask.height, rle_mask.width = int(height), int(width)
+        rle_mask.box, rle_mask.runs = box, runs
+        return rle_mask
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return (self.height, self.width)
+
+    def area(self) -> int:
+        return int(self.runs[1::2].sum())
+
+    def decode(self) -> np.ndarray:
+        return decode_mask(self.box, self.runs, self.height, self.width)
+
+    def __array__(self, dtype=None, copy=None):
+        mask = self.decode()
+        return mask if dtype is None else mask.astype(dtype)
+
+
+class SemanticMemoryWriter:
+    '''
+    Writes frames in shards of chunk_size frames, a full shard is flushed as soon as its last frame is added
+    and close() flushes the partial one. Used as a context manager the partial shard is also flushed when
+    processing fails. With resume=True the complete shards already in semantic_memory_dir are kept and new
+    frames go to the following shards, otherwise they are removed.
+    '''
+    def __init__(self, semantic_memory_dir: Union[str, Path], chunk_size: int=16, resume: bool=False):
+        self.semantic_memory_dir = Path(semantic_memory_dir)
+        self.semantic_memory_dir.mkdir(parents=True, exist_ok=True)
+        self.chunk_size = chunk_size
+        # leftovers of a shard that was being written when a previous run died
+        for path in self.semantic_memory_dir.glob("shard_*.tmp"):
+            shutil.rmtree(path)
+        shards = sorted(self.semantic_memory_dir.glob("shard_*"))
+        if not resume:
+            for path in shards:
+                shutil.rmtree(path)
+            shards = []
+        self.shard_count = len(shards)
+        self.reset()
+
+    def reset(self):
+        self.frames = {}
+        self.columns = {k: [] for k in COLUMNS if k != "rle_offsets"}
+        self.run_lengths = []
+        self.length = 0
+        self.feature_dim = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def add(self, name: str, det_res: dict):
+        n = len(det_res["xyxy"])
+        masks = det_res["mask"]
+        if n > 0:
+            height, width = masks.shape[1:]
+        else:
+            height, width = 0, 0
+        frame = {
+            "start": self.length,
+            "end": self.length + n,
+            "classes": list(det_res["classes"]),
+            "height": int(height),
+            "width": int(width)
+        }
+        # everything is converted before the frame is added, a failing frame leaves the writer unchanged
+        rows = {}
+        if n > 0:
+            rows["xyxy"] = np.asarray(det_res["xyxy"], dtype=np.float32).reshape(n, 4)
+            rows["confidence"] = np.asarray(det_res["confidence"], dtype=np.float32).reshape(n)
+            rows["class_id"] = np.asarray(det_res["class_id"], dtype=np.int64).reshape(n)
+            rows["image_feats"] = np.asarray(det_res["image_feats"], dtype=np.float16).reshape(n, -1)
+            rows["text_feats"] = np.asarray(det_res["text_feats"], dtype=np.float16).reshape(n, -1)
+            encoded = [encode_mask(mask) for mask in masks]
+            rows["mask_box"] = np.stack([box for box, _ in encoded])
+            rows["rle_runs"] = np.concatenate([runs for _, runs in encoded])
+            run_lengths = [len(runs) for _, runs in encoded]
+
+        self.frames[name] = frame
+        self.length += n
+        if n > 0:
+            for k, values in rows.items():
+                self.columns[k].append(values)
+            self.run_lengths += run_lengths
+            self.feature_dim = rows["image_feats"].shape[1]
+        if len(self.frames) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.frames) == 0:
+            return
+        shard_dir = self.semantic_memory_dir / f"shard_{self.shard_count:05}"
+        tmp_dir = shard_dir.with_name(shard_dir.name + ".tmp")
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+        tmp_dir.mkdir(parents=True)
+        feature_dim = self.feature_dim if self.feature_dim is not None else 0
+        empty = {
+            "xyxy": np.zeros((0, 4), dtype=np.float32),
+            "confidence": np.zeros(0, dtype=np.float32),
+            "class_id": np.zeros(0, dtype=np.int64),
+            "mask_box": np.zeros((0, 4), dtype=np.int32),
+            "rle_runs": np.zeros(0, dtype=np.uint32),
+            "image_feats": np.zeros((0, feature_dim), dtype=np.float16),
+            "text_feats": np.zeros((0, feature_dim), dtype=np.float16),
+        }
+        for k, values in self.columns.items():
+            array = np.concatenate(values, axis=0) if len(values) > 0 else empty[k]
+            np.save(tmp_dir / f"{k}.npy", array)
+        rle_offsets = np.concatenate([[0], np.cumsum(self.run_lengths, dtype=np.int64)]).astype(np.int64)
+        np.save(tmp_dir / "rle_offsets.npy", rle_offsets)
+        with open(tmp_dir / "index.json", "w") as f:
+            json.dump({
+                "version": SEMANTIC_MEMORY_VERSION,
+                "length": self.length,
+                "feature_dim": feature_dim,
+                "frames": self.frames
+            }, f)
+        os.replace(tmp_dir, shard_dir)
+        self.shard_count += 1
+        self.reset()
+
+    def close(self):
+        self.flush()
+
+
+class SemanticMemoryStore:
+    '''
+    Reader of a semantic memory container. load(name) gives the same dict as semantic_process produced
+    (xyxy, confidence, class_id, full-resolution mask, classes, image_feats, text_feats).
+    Falls back to the per-frame {name}.pkl files of older memories.
+    '''
+    def __init__(self, semantic_memory_dir: Union[str, Path]):
+        self.semantic_memory_dir = Path(semantic_memory_dir)
+        self.shards = []
+        self.frames = {}
+        shard_dirs = sorted(p for p in self.semantic_memory_dir.glob("shard_*") if p.suffix != ".tmp") \
+            if self.semantic_memory_dir.exists() else []
+        for shard_dir in shard_dirs:
+            with open(shard_dir / "index.json", "r") as f:
+                index = json.load(f)
+            columns = {k: np.load(shard_dir / f"{k}.npy", mmap_mode="r") for k in COLUMNS}
+            for name, frame in index["frames"].items():
+                self.frames[name] = (len(self.shards), frame)
+            self.shards.append(columns)
+        if len(self.shards) > 0:
+            self.names = list(self.frames.keys())
+        elif self.semantic_memory_dir.exists():
+            self.names = sorted(p.stem for p in self.semantic_memory_dir.glob("*.pkl"))
+        else:
+            self.names = []
+        self._names = set(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name: str):
+        return name in self._names
+
+    def get_classes(self, name: str) -> List[str]:
+        if len(self.shards) == 0:
+            return self.load(name)["classes"]
+        return list(self.frames[name][1]["classes"])
+
+    def load(self, name: str) -> dict:
+        if len(self.shards) == 0:
+            with open(self.semantic_memory_dir / f"{name}.pkl", "rb") as f:
+                return pickle.load(f)
+
+        shard, frame = self.frames[name]
+        columns = self.shards[shard]
+        start, end = frame["start"], frame["end"]
+        rle_offsets = columns["rle_offsets"]
+        masks = np.zeros((end - start, frame["height"], frame["width"]), dtype=bool)
+        for i, row in enumerate(range(start, end)):
+            runs = columns["rle_runs"][rle_offsets[row]:rle_offsets[row + 1]]
+            masks[i] = decode_mask(columns["mask_box"][row], runs, frame["height"], frame["width"])
+
+        return {
+            "xyxy": np.array(columns["xyxy"][start:end]),
+            "confidence": np.array(columns["confidence"][start:end]),
+            "class_id": np.array(columns["class_id"][start:end]),
+            "mask": masks,
+            "classes": list(frame["classes"]),
+            "image_feats": np.asarray(columns["image_feats"][start:end], dtype=np.float32),
+            "text_feats": np.asarray(columns["text_feats"][start:end], dtype=np.float32)
+        }
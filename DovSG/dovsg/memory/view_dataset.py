@@ -7,6 +7,7 @@ import open3d as o3d
 from dataclasses import dataclass
 from dovsg.utils.utils import get_inlier_mask
 import cv2
+from typing import List
 
 
 @dataclass(frozen=True)
@@ -71,6 +72,7 @@ class ViewDataset():
         self.masks = []
         self.names = []
         self.global_points = []
+        self.poses = []
         
         self.bounds = None  # once been setup, can't be change
 
@@ -156,6 +158,7 @@ class ViewDataset():
             self.masks.append(mask)
             self.names.append(f"{cnt:06}")
             self.global_points.append(gpoint)
+            self.poses.append(pose)
 
 
         xmin, ymin, zmin = min_bounds
@@ -241,6 +244,70 @@ class ViewDataset():
             coordinate_frame = o3d.geometry.TriangleMesh.create_coordinate_frame(size=0.3, origin=[0, 0, 0])
             o3d.visualization.draw_geometries([pcd, coordinate_frame])
 
+    def select_covisible_frames(
+        self,
+        frame_indexes: List[int],
+        min_new_coverage: float=0.1,
+        min_views: int=3,
+        max_rotation_deg: float=30,
+        max_translation: float=0.5
+    ):
+        """
+        Greedy frame selection by voxel covisibility, in frame order.
+        A voxel counts as covered once min_views selected frames have seen it. A frame is kept
+        when at least min_new_coverage of its voxels are not covered yet, or when the camera
+        moved more than max_rotation_deg / max_translation since the last kept frame.
+        Returns the kept frame indexes and a per-frame report.
+        """
+        # cached view datasets from before poses were stored can't use the pose criterion
+        poses = getattr(self, "poses", [])
+        use_pose = len(poses) == len(self.names)
+
+        covered_indexes = np.array([], dtype=np.int64)
+        covered_counts = np.array([], dtype=np.int64)
+        last_kept_pose = None
+        keep_indexes = []
+        report = []
+        for cnt in frame_indexes:
+            voxel_indexes = np.unique(
+                self.pixel_index_mappings[cnt][self.pixel_index_masks[cnt]]
+            ).astype(np.int64)
+
+            # how many selected frames have already seen each voxel of this frame
+            view_counts = np.zeros(len(voxel_indexes), dtype=np.int64)
+            if len(covered_indexes) > 0 and len(voxel_indexes) > 0:
+                pos = np.searchsorted(covered_indexes, voxel_indexes)
+                pos = np.minimum(pos, len(covered_indexes) - 1)
+                found = covered_indexes[pos] == voxel_indexes
+                view_counts[found] = covered_counts[pos[found]]
+            new_coverage = float((view_counts < min_views).mean()) if len(voxel_indexes) > 0 else 0.0
+
+            moved = False
+            if use_pose and last_kept_pose is not None:
+                relative_pose = np.linalg.inv(last_kept_pose) @ poses[cnt]
+                cos_angle = np.clip((np.trace(relative_pose[:3, :3]) - 1) / 2, -1, 1)
+                moved = np.degrees(np.arccos(cos_angle)) > max_rotation_deg or \
+                    np.linalg.norm(relative_pose[:3, 3]) > max_translation
+
+            is_kept = len(voxel_indexes) > 0 and (new_coverage >= min_new_coverage or moved)
+            if is_kept:
+                keep_indexes.append(cnt)
+                if use_pose:
+                    last_kept_pose = poses[cnt]
+                all_indexes = np.concatenate([covered_indexes, voxel_indexes])
+                all_counts = np.concatenate([covered_counts, np.ones(len(voxel_indexes), dtype=np.int64)])
+                covered_indexes, inverse_indices = np.unique(all_indexes, return_inverse=True)
+                covered_counts = np.bincount(inverse_indices, weights=all_counts).astype(np.int64)
+
+            report.append({
+                "name": self.names[cnt],
+                "new_coverage": round(new_coverage, 4),
+                "moved": bool(moved),
+                "kept": bool(is_kept)
+            })
+
+        return keep_indexes, report
+
     def point_to_voxel(self, points):
         if type(points) == list:
             points = np.array(points)
@@ -283,6 +350,30 @@ class ViewDataset():
         voxels[..., 0] = indexes // self.voxel_num[1]
         return voxels
 
+    def neighbor_offsets(self, radius: float) -> np.ndarray:
+        # integer voxel offsets strictly closer than radius to the center voxel, (K, 3), (0, 0, 0) first.
+        # Offsets exactly radius away are excluded, as the squared distance < radius ** 2 test of FAISS did
+        r = int(np.ceil(radius / self.resolution))
+        grid = np.stack(np.meshgrid(*[np.arange(-r, r + 1)] * 3, indexing="ij"), axis=-1).reshape(-1, 3)
+        grid = grid[np.sum(grid ** 2, axis=1) < (radius / self.resolution) ** 2 - 1e-9]
+        grid = grid[np.argsort(np.abs(grid).sum(axis=1), kind="stable")]
+        if len(grid) == 0:
+            grid = np.zeros((1, 3), dtype=np.int64)
+        return grid
+
+    def index_neighbors(self, indexes, radius: float) -> np.ndarray:
+        # The indexes is in numpy array with shape (N,)
+        # The neighbors is in numpy array with shape (N, K), -1 for voxels outside the bounds
+        indexes = np.asarray(indexes)
+        offsets = self.neighbor_offsets(radius)
+        if len(offsets) == 1:
+            return indexes.reshape(-1, 1)
+        voxels = self.index_to_voxel(indexes).astype(np.int64)[:, None, :] + offsets[None, :, :]
+        inside = np.all((voxels >= 0) & (voxels < self.voxel_num), axis=-1)
+        neighbors = self.voxel_to_index(voxels)
+        neighbors[~inside] = -1
+        return neighbors
+
     def point_to_index(self, points):
         # The points is in numpy array with shape (..., 3)
         # The indexes is in numpy array with shape (...,)
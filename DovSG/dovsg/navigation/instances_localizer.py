@@ -1,6 +1,6 @@
 import numpy as np
 import torch
-from dovsg.perception.models.myclip import MyClip
+from dovsg.perception.models.myclip import get_clip
 from dovsg.memory.view_dataset import ViewDataset
 from dovsg.memory.instances.instance_utils import MapObjectList
 from typing import List, Dict
@@ -10,7 +10,8 @@ class InstanceLocalizer:
         self,
         view_dataset: ViewDataset,
         instances_objects: MapObjectList,
-        device="cuda"
+        device="cuda",
+        backend="eager"
     ):
         print("Initializing Instance Localizer.")
         self.view_dataset = view_dataset
@@ -18,7 +19,7 @@ class InstanceLocalizer:
         self.device = device
 
         ### Initialize the CLIP model ###
-        self.myclip = MyClip(device=self.device)
+        self.myclip = get_clip(device=self.device, backend=backend)
 
     def calculate_clip_and_st_embeddings_for_queries(self, queries):
         with torch.no_grad():
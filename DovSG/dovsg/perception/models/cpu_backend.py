@@ -0,0 +1,78 @@
+""" cpu inference backend: dynamic int8 quantization and TorchScript export of the CLIP towers """
+import torch
+import torch.nn as nn
+from pathlib import Path
+from typing import Union, Tuple
+from dovsg.utils.utils import clip_export_dir
+
+# "eager": original fp32 models, "cpu_int8": int8 dynamic quantized models on cpu
+INFERENCE_BACKENDS = ["eager", "cpu_int8"]
+
+
+def check_backend(backend: str):
+    assert backend in INFERENCE_BACKENDS, f"unknown inference backend {backend}, choose from {INFERENCE_BACKENDS}"
+
+
+def quantize_int8(model: nn.Module) -> nn.Module:
+    '''Dynamic int8 quantization of all Linear layers, weights int8 and activations quantized on the fly'''
+    model = model.cpu().eval()
+    quantized_model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    # open_clip reads the activation dtype from mlp.c_fc.weight, which is a method on quantized Linear,
+    # int8_original_dtype is the attribute it checks first for int8 layers
+    for module in quantized_model.modules():
+        if isinstance(module, torch.ao.nn.quantized.dynamic.Linear):
+            module.int8_original_dtype = torch.float32
+    return quantized_model
+
+
+class ClipImageTower(nn.Module):
+    def __init__(self, clip_model: nn.Module):
+        super().__init__()
+        self.clip_model = clip_model
+
+    def forward(self, image: torch.Tensor):
+        image_feat = self.clip_model.encode_image(image)
+        return image_feat / image_feat.norm(dim=-1, keepdim=True)
+
+
+class ClipTextTower(nn.Module):
+    def __init__(self, clip_model: nn.Module):
+        super().__init__()
+        self.clip_model = clip_model
+
+    def forward(self, text: torch.Tensor):
+        text_feat = self.clip_model.encode_text(text)
+        return text_feat / text_feat.norm(dim=-1, keepdim=True)
+
+
+def export_clip_towers(
+    clip_model: nn.Module,
+    model_name: str,
+    export_dir: Union[str, Path]=clip_export_dir
+) -> Tuple[torch.jit.ScriptModule, torch.jit.ScriptModule]:
+    '''
+    Quantize the CLIP model and trace its image and text towers to TorchScript.
+    The traced graphs are saved in export_dir and loaded from there on later runs.
+    '''
+    export_dir = Path(export_dir)
+    image_tower_path = export_dir / f"{model_name}_image_int8.pt"
+    text_tower_path = export_dir / f"{model_name}_text_int8.pt"
+    if image_tower_path.exists() and text_tower_path.exists():
+        print(f"==> Loading exported int8 CLIP towers from {export_dir}")
+        return torch.jit.load(str(image_tower_path)), torch.jit.load(str(text_tower_path))
+
+    print(f"==> Exporting int8 CLIP towers to {export_dir}")
+    quantized_model = quantize_int8(clip_model)
+    image_size = quantized_model.visual.image_size
+    if isinstance(image_size, int):
+        image_size = (image_size, image_size)
+    example_image = torch.zeros((1, 3, *image_size), dtype=torch.float32)
+    example_text = torch.zeros((1, quantized_model.context_length), dtype=torch.long)
+    with torch.no_grad():
+        image_tower = torch.jit.trace(ClipImageTower(quantized_model).eval(), example_image, check_trace=False)
+        text_tower = torch.jit.trace(ClipTextTower(quantized_model).eval(), example_text, check_trace=False)
+
+    export_dir.mkdir(parents=True, exist_ok=True)
+    torch.jit.save(image_tower, str(image_tower_path))
+    torch.jit.save(text_tower, str(text_tower_path))
+    return image_tower, text_tower
@@ -24,39 +24,138 @@
 #         image_feat /= image_feat.norm(dim=-1, keepdim=True)
 
 
-""" my clip just be init once each runing time """
+""" my clip just be init once each runing time, see get_clip """
 from PIL import Image
 import open_clip
-from dovsg.utils.utils import clip_checkpoint_path
+import numpy as np
+import torch
+import pickle
+import os
+import atexit
+from pathlib import Path
+from typing import List, Union
+from dovsg.utils.utils import clip_checkpoint_path, clip_model_name, clip_text_cache_path
+from dovsg.perception.models.cpu_backend import check_backend, export_clip_towers
+from dovsg.utils.model_registry import model_registry
+
+
+class ClipTextFeatureCache:
+    """
+    Content-keyed cache of normalized CLIP text features: (model name, normalized text) -> fp16 feature.
+    Kept in memory and persisted to cache_path, so repeated queries and re-runs skip the text tower.
+    New features are written in batches: once save_interval of them are pending, when save() is called
+    (get_semantic_memory does at its end) and at interpreter exit.
+    """
+    def __init__(self, model_name: str, cache_path: Union[str, Path, None]=clip_text_cache_path, save_interval: int=64):
+        self.model_name = model_name
+        self.cache_path = Path(cache_path) if cache_path is not None else None
+        self.save_interval = save_interval
+        self.features = {}
+        self.pending = 0
+        self.hits = 0
+        self.misses = 0
+        self.load()
+        atexit.register(self.save)
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        # the open_clip tokenizer lower-cases and collapses whitespace itself,
+        # so texts that only differ in these give the same embedding
+        return " ".join(text.strip().lower().split())
+
+    def key(self, text: str):
+        return (self.model_name, self.normalize_text(text))
+
+    def load(self):
+        if self.cache_path is not None and self.cache_path.exists():
+            with open(self.cache_path, "rb") as f:
+                self.features = pickle.load(f)
+            print(f"==> Loaded {len(self.features)} cached CLIP text features from {self.cache_path}")
+
+    def save(self):
+        if self.cache_path is None or self.pending == 0:
+            return
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file first so an interrupted save never corrupts the cache
+        tmp_path = self.cache_path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self.features, f, protocol=4)
+        os.replace(tmp_path, self.cache_path)
+        self.pending = 0
+
+    def get_missing(self, texts: List[str]) -> List[str]:
+        missing = []
+        for text in texts:
+            key = self.key(text)
+            if key in self.features:
+                self.hits += 1
+            else:
+                self.misses += 1
+                if self.normalize_text(text) not in missing:
+                    missing.append(self.normalize_text(text))
+        return missing
+
+    def update(self, texts: List[str], text_feats: np.ndarray):
+        for text, text_feat in zip(texts, text_feats):
+            self.features[self.key(text)] = text_feat.astype(np.float16)
+        self.pending += len(texts)
+        if self.pending >= self.save_interval:
+            self.save()
+
+    def get(self, texts: List[str]) -> np.ndarray:
+        return np.stack([self.features[self.key(text)] for text in texts], axis=0)
+
+
+def get_clip(device="cuda", backend="eager"):
+    '''CLIP is loaded once per inference backend and device and shared through the model registry'''
+    # non-eager backends always run on cpu, whatever device is asked for
+    device = device if backend == "eager" else "cpu"
+    return model_registry.get(f"clip:{backend}:{device}", lambda: MyClip(device=device, backend=backend))
+
 
 class MyClip:
-    _instance = None
-
-    def __new__(cls, *args, **kwargs):
-        if cls._instance is None:
-            cls._instance = super(MyClip, cls).__new__(cls)
-        return cls._instance
-
-    def __init__(self, device="cuda"):
-        if not hasattr(self, 'initialized'):
-            self.device = device
-            print("==> Initializing CLIP model...")
-            clip_model, _, self.clip_preprocess = open_clip.create_model_and_transforms(
-                model_name="ViT-H-14", pretrained=clip_checkpoint_path
-            )
+    def __init__(self, device="cuda", backend="eager"):
+        check_backend(backend)
+        self.backend = backend
+        self.device = device if backend == "eager" else "cpu"
+        print(f"==> Initializing CLIP model ({backend})...")
+        clip_model, _, self.clip_preprocess = open_clip.create_model_and_transforms(
+            model_name=clip_model_name, pretrained=clip_checkpoint_path
+        )
+        if backend == "eager":
             self.clip_model = clip_model.to(self.device)
-            self.clip_tokenizer = open_clip.get_tokenizer("ViT-H-14")
-            print("==> Done initializing CLIP model.")
-            self.initialized = True
+        else:
+            # only the exported towers are kept
+            self.clip_model = None
+            self.image_tower, self.text_tower = export_clip_towers(clip_model, clip_model_name)
+            del clip_model
+        self.clip_tokenizer = open_clip.get_tokenizer(clip_model_name)
+        # int8 features differ slightly from fp32 ones, so they are cached under their own key
+        cache_model_name = clip_model_name if backend == "eager" else f"{clip_model_name}-{backend}"
+        self.text_feature_cache = ClipTextFeatureCache(model_name=cache_model_name)
+        print("==> Done initializing CLIP model.")
 
     def get_text_feature(self, text_queries: list):
-        tokenized_text = self.clip_tokenizer(text_queries).to(self.device)
-        text_feat = self.clip_model.encode_text(tokenized_text)
-        text_feat /= text_feat.norm(dim=-1, keepdim=True)
-        return text_feat
+        # only texts never seen before go through the text tower
+        missing_texts = self.text_feature_cache.get_missing(text_queries)
+        if len(missing_texts) > 0:
+            with torch.no_grad():
+                tokenized_text = self.clip_tokenizer(missing_texts).to(self.device)
+                if self.backend == "eager":
+                    text_feat = self.clip_model.encode_text(tokenized_text)
+                    text_feat /= text_feat.norm(dim=-1, keepdim=True)
+                else:
+                    text_feat = self.text_tower(tokenized_text)
+            self.text_feature_cache.update(missing_texts, text_feat.float().cpu().numpy())
+        text_feat = self.text_feature_cache.get(text_queries)
+        return torch.from_numpy(text_feat).float().to(self.device)
 
     def get_image_feature(self, image: Image):
         preprocessed_image = self.clip_preprocess(image).unsqueeze(0).to(self.device)
-        image_feat = self.clip_model.encode_image(preprocessed_image)
-        image_feat /= image_feat.norm(dim=-1, keepdim=True)
-        return image_feat
\ No newline at end of file
+        if self.backend == "eager":
+            image_feat = self.clip_model.encode_image(preprocessed_image)
+            image_feat /= image_feat.norm(dim=-1, keepdim=True)
+        else:
+            with torch.no_grad():
+                image_feat = self.image_tower(preprocessed_image)
+        return image_feat
@@ -1,49 +1,200 @@
 # groundingdino model
 from groundingdino.util.inference import Model as GDModel
+from groundingdino.util.inference import predict as gd_predict
+import groundingdino.datasets.transforms as T
 from sam2.build_sam import build_sam2
 from sam2.sam2_image_predictor import SAM2ImagePredictor
 from dovsg.utils.utils import grounding_dino_config_path, grounding_dino_checkpoint_path
-from dovsg.utils.utils import sam2_model_cfg_path, sam2_checkpoint_path
+from dovsg.utils.utils import sam2_model_cfg_path, sam2_checkpoint_path, get_image_hash
+from dovsg.utils.model_registry import model_registry
 import cv2
 import torchvision
 import torch
 import numpy as np
 import supervision as sv
 from supervision.draw.color import Color, ColorPalette
-from typing import Union
+from typing import Union, Tuple
+from pathlib import Path
+from collections import OrderedDict
 import dataclasses
+from PIL import Image
+
+class Sam2EmbeddingCache:
+    '''
+    SAM2 image embeddings (predictor._features) keyed by image content hash.
+    LRU in memory, optionally stored as fp16 in cache_dir so they survive re-runs.
+    '''
+    def __init__(self, max_items: int=16):
+        self.max_items = max_items
+        self.features = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get_path(self, cache_dir: Path, key: str) -> Path:
+        return cache_dir / f"{Path(sam2_checkpoint_path).stem}_{key}.pt"
+
+    def get(self, key: str, cache_dir: Union[Path, None]=None, device="cuda"):
+        if key in self.features:
+            self.features.move_to_end(key)
+            self.hits += 1
+            return self.features[key]
+        if cache_dir is not None and self.get_path(cache_dir, key).exists():
+            features = torch.load(self.get_path(cache_dir, key), map_location=device)
+            features = {
+                "image_embed": features["image_embed"].float(),
+                "high_res_feats": [feat.float() for feat in features["high_res_feats"]]
+            }
+            self.disk_hits += 1
+            self.put(key, features)
+            return features
+        self.misses += 1
+        return None
+
+    def put(self, key: str, features: dict, cache_dir: Union[Path, None]=None):
+        self.features[key] = features
+        self.features.move_to_end(key)
+        while len(self.features) > self.max_items:
+            self.features.popitem(last=False)
+        if cache_dir is not None:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            torch.save({
+                "image_embed": features["image_embed"].half().cpu(),
+                "high_res_feats": [feat.half().cpu() for feat in features["high_res_feats"]]
+            }, self.get_path(cache_dir, key))
+
 
 class MyGroundingDINOSAM2():
+    # embedding caches are shared like the SAM2 predictors, one per device
+    embedding_caches = {}
+
     def __init__(
         self,
         box_threshold=0.3,
         text_threshold=0.3,
         nms_threshold=0.5,
-        device="cuda"
+        device="cuda",
+        embedding_cache_dir: Union[str, Path, None]=None,
+        # adaptive resolution: coarse GroundingDINO pass, full resolution only for small or uncertain detections
+        coarse_short_side: int=400,
+        min_box_size: int=24,
+        low_confidence_margin: float=0.05
     ): 
         self.box_threshold = box_threshold
         self.text_threshold = text_threshold
         self.nms_threshold = nms_threshold
         self.device = device
+        self.coarse_short_side = coarse_short_side
+        self.min_box_size = min_box_size
+        self.low_confidence_margin = low_confidence_margin
+        self.coarse_resolution_frames = 0
+        self.full_resolution_frames = 0
+        # None keeps SAM2 embeddings in memory only
+        self.embedding_cache_dir = Path(embedding_cache_dir) if embedding_cache_dir is not None else None
+        if self.device not in MyGroundingDINOSAM2.embedding_caches:
+            MyGroundingDINOSAM2.embedding_caches[self.device] = Sam2EmbeddingCache()
+        self.embedding_cache = MyGroundingDINOSAM2.embedding_caches[self.device]
 
+        # models are shared between all instances (thresholds are per instance)
         ### Initialize the Grounding DINO model ###
-        self.grounding_dino_model = GDModel(
-            model_config_path=grounding_dino_config_path, 
-            model_checkpoint_path=grounding_dino_checkpoint_path, 
-            device=self.device
+        self.grounding_dino_model = model_registry.get(
+            f"groundingdino:{self.device}",
+            lambda: GDModel(
+                model_config_path=grounding_dino_config_path, 
+                model_checkpoint_path=grounding_dino_checkpoint_path, 
+                device=self.device
+            )
         )
 
         ### Initialize the SAM2 model ###
-        sam2_model = build_sam2(sam2_model_cfg_path, sam2_checkpoint_path, device=self.device)
-        self.sam2_predictor = SAM2ImagePredictor(sam2_model)
+        self.sam2_predictor = model_registry.get(
+            f"sam2:{self.device}",
+            lambda: SAM2ImagePredictor(build_sam2(sam2_model_cfg_path, sam2_checkpoint_path, device=self.device))
+        )
+
+    def predict_with_classes(
+        self, 
+        image: np.ndarray, 
+        classes: list, 
+        box_threshold: float, 
+        short_side: int=800, 
+        max_size: int=1333
+    ) -> Tuple[sv.Detections, Tuple[int, int]]:
+        '''
+        GDModel.predict_with_classes for an RGB image at a chosen input resolution (800 / 1333 is the default).
+        Also returns the (height, width) the model actually saw, max_size may shrink it below short_side.
+        '''
+        transform = T.Compose([
+            T.RandomResize([short_side], max_size=max_size),
+            T.ToTensor(),
+            T.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+        ])
+        image_transformed, _ = transform(Image.fromarray(image), None)
+        boxes, logits, phrases = gd_predict(
+            model=self.grounding_dino_model.model,
+            image=image_transformed.to(self.device),
+            caption=". ".join(classes),
+            box_threshold=box_threshold,
+            text_threshold=self.text_threshold,
+            device=self.device
+        )
+        source_h, source_w = image.shape[:2]
+        # boxes are normalized, so they map back to the source image whatever the input resolution
+        detections = GDModel.post_process_result(source_h=source_h, source_w=source_w, boxes=boxes, logits=logits)
+        detections.class_id = GDModel.phrases2classes(phrases=phrases, classes=classes)
+        return detections, tuple(image_transformed.shape[-2:])
 
-    def run(self, image, classes: list) -> sv.Detections:
-        detections = self.grounding_dino_model.predict_with_classes(
-            image=cv2.cvtColor(image, cv2.COLOR_RGB2BGR), # This function expects a BGR image...
+    def predict_adaptive_resolution(self, image: np.ndarray, classes: list) -> sv.Detections:
+        '''
+        Coarse pass at coarse_short_side with a slightly lowered threshold. The frame is re-run at full
+        resolution when a box is smaller than min_box_size pixels at coarse scale, or its confidence is
+        within low_confidence_margin of box_threshold (objects near the threshold may flip at full resolution),
+        and when the coarse pass finds nothing at all.
+        '''
+        detections, (input_h, input_w) = self.predict_with_classes(
+            image=image,
             classes=classes,
-            box_threshold=self.box_threshold,
-            text_threshold=self.text_threshold
+            box_threshold=max(self.box_threshold - self.low_confidence_margin, 0.01),
+            short_side=self.coarse_short_side,
+            max_size=int(1333 * self.coarse_short_side / 800)
         )
+        # a coarse pass that finds nothing may have missed objects too small at its scale
+        full_resolution = len(detections.xyxy) == 0
+        if not full_resolution:
+            # box sizes at the resolution the model saw, not the requested short side (wide frames hit max_size)
+            source_h, source_w = image.shape[:2]
+            box_sizes = np.minimum(
+                (detections.xyxy[:, 2] - detections.xyxy[:, 0]) * input_w / source_w, 
+                (detections.xyxy[:, 3] - detections.xyxy[:, 1]) * input_h / source_h
+            )
+            small = box_sizes < self.min_box_size
+            uncertain = np.abs(detections.confidence - self.box_threshold) < self.low_confidence_margin
+            full_resolution = bool(np.any(small | uncertain))
+        if full_resolution:
+            self.full_resolution_frames += 1
+            return self.grounding_dino_model.predict_with_classes(
+                image=cv2.cvtColor(image, cv2.COLOR_RGB2BGR),
+                classes=classes,
+                box_threshold=self.box_threshold,
+                text_threshold=self.text_threshold
+            )
+        keep = detections.confidence >= self.box_threshold
+        detections.xyxy = detections.xyxy[keep]
+        detections.confidence = detections.confidence[keep]
+        detections.class_id = detections.class_id[keep]
+        self.coarse_resolution_frames += 1
+        return detections
+
+    def run(self, image, classes: list, adaptive_resolution: bool=False) -> sv.Detections:
+        if adaptive_resolution:
+            detections = self.predict_adaptive_resolution(image=image, classes=classes)
+        else:
+            detections = self.grounding_dino_model.predict_with_classes(
+                image=cv2.cvtColor(image, cv2.COLOR_RGB2BGR), # This function expects a BGR image...
+                classes=classes,
+                box_threshold=self.box_threshold,
+                text_threshold=self.text_threshold
+            )
 
         if len(detections.class_id) > 0:
             ### Non-maximum suppression ###
@@ -75,13 +226,27 @@ class MyGroundingDINOSAM2():
             
         return detections
 
+    def set_sam2_image(self, image: np.ndarray):
+        '''set_image of the SAM2 predictor, the image encoder only runs for frames not in the embedding cache'''
+        key = get_image_hash(image)
+        features = self.embedding_cache.get(key, cache_dir=self.embedding_cache_dir, device=self.device)
+        if features is None:
+            self.sam2_predictor.set_image(image)
+            self.embedding_cache.put(key, self.sam2_predictor._features, cache_dir=self.embedding_cache_dir)
+        else:
+            self.sam2_predictor.reset_predictor()
+            self.sam2_predictor._features = features
+            self.sam2_predictor._orig_hw = [image.shape[:2]]
+            self.sam2_predictor._is_image_set = True
+            self.sam2_predictor._is_batch = False
+
     # Prompting SAM with detected boxes
     def get_sam2_segmentation_from_xyxy(
             self, 
             image: np.ndarray, 
             xyxy: np.ndarray
     ) -> np.ndarray:
-        self.sam2_predictor.set_image(image)
+        self.set_sam2_image(image)
         result_masks = []
         for box in xyxy:
             masks, scores, logits = self.sam2_predictor.predict(
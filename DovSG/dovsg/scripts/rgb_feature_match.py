@@ -5,6 +5,7 @@ from PIL import Image
 from pathlib import Path
 from tqdm import tqdm
 from dovsg.memory.view_dataset import ViewDataset
+from dovsg.utils.model_registry import model_registry
 from lightglue import LightGlue, SuperPoint, DISK
 from lightglue.utils import load_image, rbd, numpy_image_to_torch
 from pathlib import Path
@@ -15,8 +16,14 @@ class RGBFeatureMatch:
     def __init__(self, max_num_keypoints=1024):
         self.max_num_keypoints = max_num_keypoints
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")  # 'mps', 'cpu'
-        self.extractor = SuperPoint(max_num_keypoints=self.max_num_keypoints).eval().to(self.device)
-        self.matcher = LightGlue(features="superpoint").eval().to(self.device)
+        self.extractor = model_registry.get(
+            f"superpoint:{self.max_num_keypoints}:{self.device}",
+            lambda: SuperPoint(max_num_keypoints=self.max_num_keypoints).eval().to(self.device)
+        )
+        self.matcher = model_registry.get(
+            f"lightglue:superpoint:{self.device}",
+            lambda: LightGlue(features="superpoint").eval().to(self.device)
+        )
 
     def extract_feature(self, image):
         with torch.no_grad():
@@ -0,0 +1,125 @@
+""" process-wide registry of heavy models, loaded lazily, shared between consumers and evicted by LRU """
+import gc
+import threading
+import torch
+import torch.nn as nn
+from collections import OrderedDict
+from typing import Callable, Union
+
+
+def estimate_model_bytes(model, max_depth: int=3) -> int:
+    '''Bytes of all parameters and buffers reachable from model (nn.Module or object holding modules)'''
+    seen_modules = set()
+    seen_tensors = set()
+    total = 0
+
+    def visit(obj, depth):
+        nonlocal total
+        if isinstance(obj, nn.Module):
+            if id(obj) in seen_modules:
+                return
+            seen_modules.add(id(obj))
+            for tensor in list(obj.parameters()) + list(obj.buffers()):
+                if id(tensor) not in seen_tensors:
+                    seen_tensors.add(id(tensor))
+                    total += tensor.numel() * tensor.element_size()
+            # packed weights of quantized layers are not parameters
+            for module in obj.modules():
+                if isinstance(module, torch.ao.nn.quantized.dynamic.Linear) and id(module) not in seen_modules:
+                    seen_modules.add(id(module))
+                    weight = module.weight()
+                    total += weight.numel() * weight.element_size()
+        elif depth < max_depth and hasattr(obj, "__dict__"):
+            for value in vars(obj).values():
+                visit(value, depth + 1)
+
+    visit(model, 0)
+    return total
+
+
+class ModelRegistry:
+    '''
+    get(key, factory) returns the model stored under key, calling factory only on the first request.
+    With a memory budget, least recently used models are dropped from the registry when a new one
+    does not fit. Memory is only freed once no consumer holds the model anymore.
+    '''
+    def __init__(self, memory_budget_gb: Union[float, None]=None):
+        self.memory_budget_gb = memory_budget_gb
+        self.models = OrderedDict()
+        self.model_bytes = {}
+        self.loads = {}
+        self.hits = {}
+        self.evictions = {}
+        self.lock = threading.RLock()
+
+    def set_memory_budget(self, memory_budget_gb: Union[float, None]):
+        with self.lock:
+            self.memory_budget_gb = memory_budget_gb
+            self.evict_to_budget()
+
+    def get(self, key: str, factory: Callable):
+        with self.lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                self.hits[key] = self.hits.get(key, 0) + 1
+                return self.models[key]
+
+            model = factory()
+            self.models[key] = model
+            self.model_bytes[key] = estimate_model_bytes(model)
+            self.loads[key] = self.loads.get(key, 0) + 1
+            print(f"==> Model registry loaded {key} ({self.model_bytes[key] / 1024 ** 3:.2f} GB)")
+            self.evict_to_budget(keep=key)
+            return model
+
+    def total_bytes(self) -> int:
+        return sum(self.model_bytes.values())
+
+    def evict_to_budget(self, keep: Union[str, None]=None):
+        if self.memory_budget_gb is None:
+            return
+        budget = self.memory_budget_gb * 1024 ** 3
+        for key in list(self.models.keys()):
+            if self.total_bytes() <= budget:
+                break
+            if key != keep:
+                self.evict(key)
+
+    def evict(self, key: str):
+        with self.lock:
+            if key not in self.models:
+                return
+            del self.models[key]
+            del self.model_bytes[key]
+            self.evictions[key] = self.evictions.get(key, 0) + 1
+            print(f"==> Model registry evicted {key}")
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def clear(self):
+        for key in list(self.models.keys()):
+            self.evict(key)
+
+    def stats(self) -> dict:
+        keys = list(dict.fromkeys(list(self.loads.keys()) + list(self.models.keys())))
+        return {
+            key: {
+                "loads": self.loads.get(key, 0),
+                "hits": self.hits.get(key, 0),
+                "evictions": self.evictions.get(key, 0),
+                "resident": key in self.models,
+                "gb": self.model_bytes.get(key, 0) / 1024 ** 3
+            } for key in keys
+        }
+
+    def print_stats(self):
+        print(f"Model registry: {len(self.models)} resident, {self.total_bytes() / 1024 ** 3:.2f} GB"
+              + (f" / {self.memory_budget_gb} GB budget" if self.memory_budget_gb is not None else ""))
+        for key, stat in self.stats().items():
+            print(f"    {key}: loads {stat['loads']}, hits {stat['hits']}, evictions {stat['evictions']}"
+                  f"{', resident' if stat['resident'] else ''} ({stat['gb']:.2f} GB)")
+
+
+# shared by the whole process
+model_registry = ModelRegistry()
@@ -0,0 +1,86 @@
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Union
+
+
+# marks the end of a stream between stages
+STOP = object()
+
+
+class Stage(threading.Thread):
+    '''
+    Background stage of a producer/consumer pipeline.
+    Apply func to every item of in_queue and put the result into out_queue (if any) until STOP.
+    After an exception the stage keeps draining in_queue so upstream stages never block,
+    the error is raised in the caller by check() / join_and_check().
+    '''
+    def __init__(
+        self,
+        func: Callable,
+        in_queue: queue.Queue,
+        out_queue: Union[queue.Queue, None]=None,
+        name: Union[str, None]=None
+    ):
+        super().__init__(name=name, daemon=True)
+        self.func = func
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.error = None
+
+    def run(self):
+        try:
+            while True:
+                item = self.in_queue.get()
+                if item is STOP:
+                    break
+                if self.error is not None:
+                    continue
+                try:
+                    result = self.func(item)
+                except BaseException as e:
+                    self.error = e
+                    continue
+                if self.out_queue is not None:
+                    self.out_queue.put(result)
+        except BaseException as e:
+            self.error = e
+        finally:
+            if self.out_queue is not None:
+                self.out_queue.put(STOP)
+
+    def check(self):
+        if self.error is not None:
+            raise RuntimeError(f"pipeline stage {self.name} failed") from self.error
+
+    def join_and_check(self):
+        self.join()
+        self.check()
+
+
+def ordered_map(func: Callable, items: Iterable, num_workers: int, max_pending: Union[int, None]=None):
+    '''
+    Yield func(item) for every item in input order, computed by a pool of num_workers threads.
+    At most max_pending results (default 2 * num_workers) are in flight ahead of the consumer,
+    num_workers 0 runs func in the calling thread.
+    '''
+    if num_workers <= 0:
+        for item in items:
+            yield func(item)
+        return
+    max_pending = max_pending or 2 * num_workers
+    items = iter(items)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        try:
+            for item in items:
+                pending.append(executor.submit(func, item))
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # consumer stopped early or func failed: drop what has not started yet
+            for future in pending:
+                future.cancel()
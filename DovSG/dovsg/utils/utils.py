@@ -1,6 +1,7 @@
 import numpy as np
 import shutil
 import os
+import hashlib
 from scipy.spatial.transform import Rotation as R
 from pathlib import Path
 import open3d as o3d
@@ -47,6 +48,7 @@ RECORDER_DIR = Path("data_example")
 # sam2
 sam2_checkpoint_path = "checkpoints/segment-anything-2/sam2_hiera_large.pt"
 sam2_model_cfg_path = "../sam2_configs/sam2_hiera_l.yaml"
+sam2_embedding_cache_dir = "checkpoints/cache/sam2_embeddings"
 
 # groundingdino
 grounding_dino_config_path = "checkpoints/GroundingDINO/GroundingDINO_SwinT_OGC.py"
@@ -54,10 +56,13 @@ grounding_dino_checkpoint_path = "checkpoints/GroundingDINO/groundingdino_swint_
 
 # ram
 ram_checkpoint_path = "checkpoints/recognize_anything/ram_swin_large_14m.pth"
+ram_tag_cache_path = "checkpoints/cache/ram_tags.json"
 
 # clip
 clip_model_name = "ViT-H-14"
 clip_checkpoint_path = "checkpoints/CLIP-ViT-H-14-laion2B-s32B-b79K/open_clip_pytorch_model.bin"
+clip_text_cache_path = "checkpoints/cache/clip_text_features.pkl"
+clip_export_dir = "checkpoints/cache/clip_int8"
 
 # anygrasp
 anygrasp_checkpoint_path = "checkpoints/anygrasp/checkpoint_detection.tar"
@@ -75,6 +80,13 @@ bert_base_uncased_path = "checkpoints/bert-base-uncased"
 # SEE_SCENE_ID = "10175"
 # SEE_SCENE_ID = "10174"
 
+def get_image_hash(image: np.ndarray) -> str:
+    '''Content hash of an image array, shape and dtype included'''
+    image = np.ascontiguousarray(image)
+    digest = hashlib.sha1(image.tobytes())
+    digest.update(f"{image.shape}{image.dtype}".encode())
+    return digest.hexdigest()
+
 def clean_dir(dir_list: list):
     for dirname in dir_list:
         if os.path.exists(dirname):
@@ -0,0 +1,92 @@
+"""
+Detection recall of adaptive-resolution GroundingDINO against the full-resolution baseline on a reference recording.
+A baseline box is recalled when the adaptive pass has a box of the same class with IoU >= iou_threshold.
+"""
+import argparse
+import json
+import time
+import cv2
+import numpy as np
+import torch
+import torchvision
+from pathlib import Path
+from PIL import Image
+from dovsg.memory.ram_groundingdino_sam2_clip_semantic_memory import RamGroundingDinoSAM2ClipDataset
+
+
+def match_detections(baseline, adaptive, iou_threshold: float):
+    if len(baseline.xyxy) == 0:
+        return 0
+    if len(adaptive.xyxy) == 0:
+        return 0
+    ious = torchvision.ops.box_iou(torch.from_numpy(baseline.xyxy), torch.from_numpy(adaptive.xyxy)).numpy()
+    same_class = np.asarray(baseline.class_id)[:, None] == np.asarray(adaptive.class_id)[None, :]
+    return int(np.sum(np.any((ious >= iou_threshold) & same_class, axis=1)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="adaptive resolution detection recall.")
+    parser.add_argument("--image_dir", type=str, default="data_example/room1/rgb", help="reference recording rgb floder.")
+    parser.add_argument("--num_images", type=int, default=50)
+    parser.add_argument("--box_threshold", type=float, default=0.1)
+    parser.add_argument("--text_threshold", type=float, default=0.1)
+    parser.add_argument("--iou_threshold", type=float, default=0.5)
+    parser.add_argument("--output", type=str, default=None, help="save the report as json.")
+    args = parser.parse_args()
+
+    image_paths = sorted(Path(args.image_dir).iterdir(), key=lambda x: int(x.stem))
+    step = max(1, len(image_paths) // args.num_images)
+    image_paths = image_paths[::step][:args.num_images]
+
+    semantic_memory = RamGroundingDinoSAM2ClipDataset(
+        box_threshold=args.box_threshold,
+        text_threshold=args.text_threshold
+    )
+    detector = semantic_memory.mygroundingdino_sam2
+
+    num_baseline, num_recalled = 0, 0
+    baseline_time, adaptive_time = 0, 0
+    frames = []
+    with torch.no_grad():
+        for image_path in image_paths:
+            image = np.asarray(Image.open(image_path).convert("RGB"), dtype=np.uint8)
+            classes = semantic_memory.process_tag_classes(text_prompt=semantic_memory.get_tags(image).replace(" | ", "."))
+
+            start = time.time()
+            baseline = detector.grounding_dino_model.predict_with_classes(
+                image=cv2.cvtColor(image, cv2.COLOR_RGB2BGR),
+                classes=classes,
+                box_threshold=args.box_threshold,
+                text_threshold=args.text_threshold
+            )
+            baseline_time += time.time() - start
+
+            full_resolution_frames = detector.full_resolution_frames
+            start = time.time()
+            adaptive = detector.predict_adaptive_resolution(image=image, classes=classes)
+            adaptive_time += time.time() - start
+
+            recalled = match_detections(baseline, adaptive, args.iou_threshold)
+            num_baseline += len(baseline.xyxy)
+            num_recalled += recalled
+            frames.append({
+                "name": image_path.name,
+                "baseline": len(baseline.xyxy),
+                "adaptive": len(adaptive.xyxy),
+                "recalled": recalled,
+                "full_resolution": detector.full_resolution_frames > full_resolution_frames
+            })
+
+    report = {
+        "num_images": len(frames),
+        "recall": num_recalled / max(1, num_baseline),
+        "coarse_frames": detector.coarse_resolution_frames,
+        "full_resolution_frames": detector.full_resolution_frames,
+        "baseline_time": baseline_time,
+        "adaptive_time": adaptive_time,
+        "frames": frames
+    }
+    print(json.dumps({k: v for k, v in report.items() if k != "frames"}, indent=4))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
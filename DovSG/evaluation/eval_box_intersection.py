@@ -0,0 +1,99 @@
+"""
+Accuracy of the NumPy separating axis box test used to gate spatial similarity, on random oriented boxes.
+Reference decisions: an exact linear program feasibility test of the box intersection, and, only when
+pytorch3d is installed, box3d_overlap IoU >= 1e-6 on the same expanded boxes (the gate used before).
+"""
+import argparse
+import json
+import time
+import numpy as np
+import open3d as o3d
+import torch
+from scipy.optimize import linprog
+from scipy.spatial.transform import Rotation
+from dovsg.memory.instances.instance_process import InstanceProcess
+
+
+def random_boxes(num: int, rng: np.random.Generator, scene_size: float):
+    centers = rng.uniform(0, scene_size, size=(num, 3))
+    extents = rng.uniform(0.005, 0.5, size=(num, 3))
+    # thin boxes (planar objects) are what needed the expansion before pytorch3d
+    thin = rng.random(num) < 0.2
+    extents[thin, rng.integers(0, 3, size=thin.sum())] = 0.0
+    rotations = Rotation.random(num, random_state=rng.integers(1 << 31)).as_matrix()
+    return [o3d.geometry.OrientedBoundingBox(c, r, e) for c, r, e in zip(centers, rotations, extents)]
+
+
+def expanded_corners(bboxes, expend_eps: float) -> torch.Tensor:
+    corners = []
+    for bbox in bboxes:
+        bbox = o3d.geometry.OrientedBoundingBox(bbox.center, bbox.R, np.maximum(bbox.extent, expend_eps))
+        corners.append(np.asarray(bbox.get_box_points()))
+    # vertex order expected by box3d_overlap
+    return torch.from_numpy(np.stack(corners))[:, [0, 2, 5, 3, 1, 7, 4, 6]].float()
+
+
+def pytorch3d_intersections(bboxes_a, bboxes_b, expend_eps: float):
+    import pytorch3d.ops as ops
+    _, iou = ops.box3d_overlap(expanded_corners(bboxes_a, expend_eps), expanded_corners(bboxes_b, expend_eps))
+    return iou.numpy()
+
+
+def lp_intersects(bbox_a, bbox_b, expend_eps: float) -> bool:
+    '''exact: is there a point x with |R^T (x - c)| <= extent / 2 for both boxes'''
+    a_ub, b_ub = [], []
+    for bbox in [bbox_a, bbox_b]:
+        rotation, center = np.asarray(bbox.R), np.asarray(bbox.center)
+        half = np.maximum(bbox.extent, expend_eps) / 2
+        a_ub += [rotation.T, -rotation.T]
+        b_ub += [half + rotation.T @ center, half - rotation.T @ center]
+    result = linprog(np.zeros(3), A_ub=np.concatenate(a_ub), b_ub=np.concatenate(b_ub), bounds=[(None, None)] * 3)
+    return result.status == 0
+
+
+def confusion(decisions: np.ndarray, reference: np.ndarray) -> dict:
+    return {
+        "agreement": float(np.mean(decisions == reference)),
+        "both": int(np.sum(decisions & reference)),
+        "sat_only": int(np.sum(decisions & ~reference)),
+        "reference_only": int(np.sum(~decisions & reference)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="separating axis box test against an exact linear program (and pytorch3d if installed).")
+    parser.add_argument("--num_boxes", type=int, default=400)
+    parser.add_argument("--scene_size", type=float, default=2.0)
+    parser.add_argument("--num_lp_pairs", type=int, default=5000, help="pairs checked with the exact linear program.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default=None, help="save the report as json.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    instance_process = InstanceProcess()
+    bboxes_a = random_boxes(args.num_boxes, rng, args.scene_size)
+    bboxes_b = random_boxes(args.num_boxes, rng, args.scene_size)
+
+    start = time.time()
+    sat = instance_process.compute_box_intersections(bboxes_a, bboxes_b)
+    report = {"num_pairs": int(sat.size), "sat_intersecting": int(sat.sum()), "sat_time": time.time() - start}
+
+    lp_pairs = rng.integers(0, args.num_boxes, size=(args.num_lp_pairs, 2))
+    lp = np.array([lp_intersects(bboxes_a[i], bboxes_b[j], instance_process.expend_eps) for i, j in lp_pairs])
+    report["exact"] = confusion(sat[lp_pairs[:, 0], lp_pairs[:, 1]], lp)
+
+    try:
+        start = time.time()
+        iou = pytorch3d_intersections(bboxes_a, bboxes_b, instance_process.expend_eps)
+        report["pytorch3d_time"] = time.time() - start
+        report["pytorch3d"] = confusion(sat, iou >= 1e-6)
+        # the gate only differs where pytorch3d reports (almost) no overlap
+        report["pytorch3d"]["max_iou_sat_only"] = float(iou[sat & (iou < 1e-6)].max(initial=0))
+        report["pytorch3d"]["max_iou_reference_only"] = float(iou[~sat & (iou >= 1e-6)].max(initial=0))
+    except ImportError:
+        print("pytorch3d is not installed, only the exact reference is reported")
+
+    print(json.dumps(report, indent=4))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
@@ -0,0 +1,103 @@
+"""
+Accuracy check of the cpu_int8 inference backend against the eager models on a fixed image set:
+CLIP image / text feature cosine similarity and RAM tag agreement.
+"""
+import argparse
+import json
+import numpy as np
+import torch
+from pathlib import Path
+from PIL import Image
+from torchvision import transforms
+from ram.models import ram
+from ram import inference_ram
+from dovsg.perception.models.myclip import get_clip
+from dovsg.perception.models.cpu_backend import quantize_int8
+from dovsg.utils.utils import ram_checkpoint_path, bert_base_uncased_path
+
+
+default_classes = ["table", "cabinet", "chair", "apple", "Bottled Coke", "blue bottle", "green toy", "plate", "keys"]
+
+
+def load_images(image_dir: Path, num_images: int):
+    image_paths = sorted(image_dir.glob("*.jpg")) + sorted(image_dir.glob("*.png"))
+    # fixed, evenly spaced subset so reruns compare the same images
+    step = max(1, len(image_paths) // num_images)
+    image_paths = image_paths[::step][:num_images]
+    return [(p.name, Image.open(p).convert("RGB")) for p in image_paths]
+
+
+def eval_clip(images, classes, device):
+    eager_clip = get_clip(device=device, backend="eager")
+    int8_clip = get_clip(backend="cpu_int8")
+    with torch.no_grad():
+        image_sims = []
+        for name, image in images:
+            eager_feat = eager_clip.get_image_feature(image).float().cpu()
+            int8_feat = int8_clip.get_image_feature(image).float().cpu()
+            image_sims.append(torch.nn.functional.cosine_similarity(eager_feat, int8_feat).item())
+        eager_text = eager_clip.get_text_feature(classes).float().cpu()
+        int8_text = int8_clip.get_text_feature(classes).float().cpu()
+        text_sims = torch.nn.functional.cosine_similarity(eager_text, int8_text).numpy()
+        # does the int8 image feature still pick the same class as the eager one
+        top1_agree = []
+        for name, image in images:
+            eager_top1 = (eager_clip.get_image_feature(image).float().cpu() @ eager_text.T).argmax().item()
+            int8_top1 = (int8_clip.get_image_feature(image).float().cpu() @ int8_text.T).argmax().item()
+            top1_agree.append(eager_top1 == int8_top1)
+    return {
+        "image_cos_mean": float(np.mean(image_sims)),
+        "image_cos_min": float(np.min(image_sims)),
+        "text_cos_mean": float(np.mean(text_sims)),
+        "text_cos_min": float(np.min(text_sims)),
+        "class_top1_agreement": float(np.mean(top1_agree))
+    }
+
+
+def eval_ram(images, device):
+    tagging_model = ram(
+        pretrained=ram_checkpoint_path,
+        image_size=384, vit="swin_l",
+        text_encoder_type=bert_base_uncased_path
+    ).eval()
+    tagging_transform = transforms.Compose([
+        transforms.Resize((384, 384)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=[0.485, 0.456, 0.406],
+                        std=[0.229, 0.224, 0.225]),
+    ])
+    int8_model = quantize_int8(tagging_model)
+    eager_model = tagging_model.to(device)
+
+    jaccards = []
+    with torch.no_grad():
+        for name, image in images:
+            raw_image = tagging_transform(image.resize((384, 384))).unsqueeze(0)
+            eager_tags = set(inference_ram(raw_image.to(device), eager_model)[0].split(" | "))
+            int8_tags = set(inference_ram(raw_image, int8_model)[0].split(" | "))
+            jaccards.append(len(eager_tags & int8_tags) / max(1, len(eager_tags | int8_tags)))
+    return {
+        "tag_jaccard_mean": float(np.mean(jaccards)),
+        "tag_jaccard_min": float(np.min(jaccards))
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="accuracy of cpu_int8 backend against eager models.")
+    parser.add_argument("--image_dir", type=str, default="data_example/room1/rgb", help="fixed image set.")
+    parser.add_argument("--num_images", type=int, default=20)
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu",
+                        help="device of the eager reference models.")
+    parser.add_argument("--output", type=str, default=None, help="save the report as json.")
+    args = parser.parse_args()
+
+    images = load_images(Path(args.image_dir), args.num_images)
+    report = {
+        "num_images": len(images),
+        "clip": eval_clip(images, default_classes, args.device),
+        "ram": eval_ram(images, args.device)
+    }
+    print(json.dumps(report, indent=4))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
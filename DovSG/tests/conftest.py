@@ -0,0 +1,143 @@
+import numpy as np
+import pytest
+from dovsg.memory.view_dataset import ViewDataset, Bounds
+from dovsg.memory.semantic_memory_store import SemanticMemoryWriter
+
+
+def make_view_dataset(voxel_num=(40, 30, 20), resolution: float=0.02) -> ViewDataset:
+    '''ViewDataset with only the voxel grid set up, no recording is loaded'''
+    view_dataset = ViewDataset.__new__(ViewDataset)
+    view_dataset.resolution = resolution
+    lower_bound = np.array([-0.4, -0.3, 0.0])
+    view_dataset.bounds = Bounds.from_arr(np.stack([lower_bound, lower_bound + np.array(voxel_num) * resolution], axis=1))
+    view_dataset.voxel_num = np.rint((view_dataset.bounds.higher_bound - view_dataset.bounds.lower_bound)
+                                     / resolution).astype(np.int32)
+    return view_dataset
+
+
+def random_blob(view_dataset: ViewDataset, rng: np.random.Generator, num: int=200, max_size: int=5) -> np.ndarray:
+    '''unique voxel indexes scattered around a random center'''
+    voxel_num = np.asarray(view_dataset.voxel_num)
+    center = rng.integers(3, voxel_num - 3)
+    size = rng.integers(1, max_size + 1, size=3)
+    voxels = np.clip(center + rng.integers(-size, size + 1, size=(num, 3)), 0, voxel_num - 1)
+    return np.unique(view_dataset.voxel_to_index(voxels))
+
+
+# class, x and y voxel ranges, height in voxels of the objects of the synthetic recording
+SCENE_OBJECTS = [
+    ("table", (4, 18), (4, 14), 6),
+    ("cube", (22, 28), (6, 12), 10),
+    ("bottle", (8, 14), (19, 25), 12),
+    ("box", (27, 35), (18, 25), 5),
+]
+
+
+def scene_owners(voxel_num) -> np.ndarray:
+    '''(x, y) voxel column -> SCENE_OBJECTS position, -1 for the floor'''
+    owners = np.full(tuple(voxel_num[:2]), -1)
+    for k, (_, (x_min, x_max), (y_min, y_max), _) in enumerate(SCENE_OBJECTS):
+        owners[x_min:x_max, y_min:y_max] = k
+    return owners
+
+
+def make_frames(num_frames: int=16, width: int=20):
+    '''
+    Top-down orthographic frames sliding along x over SCENE_OBJECTS on a floor, every pixel sees the top voxel
+    of its column. Returns the ViewDataset holding names, poses and the pixel to voxel mappings,
+    and per frame the SCENE_OBJECTS position seen by every pixel (-1 for the floor).
+    '''
+    view_dataset = make_view_dataset()
+    voxel_num = view_dataset.voxel_num
+    xs, ys = np.meshgrid(np.arange(voxel_num[0]), np.arange(voxel_num[1]), indexing="ij")
+    owners = scene_owners(voxel_num)
+    tops = np.zeros(xs.shape, dtype=np.int64)
+    for k, (_, _, _, height) in enumerate(SCENE_OBJECTS):
+        tops[owners == k] = height
+    # rough tops, so no object is flat
+    tops = np.where(owners >= 0, tops - (xs * 7 + ys * 3) % 3, 0)
+    index_map = view_dataset.voxel_to_index(np.stack([xs, ys, tops], axis=-1))
+
+    view_dataset.names, view_dataset.poses = [], []
+    view_dataset.pixel_index_mappings, view_dataset.pixel_index_masks = [], []
+    frame_owners = []
+    for frame in range(num_frames):
+        shift = frame * (voxel_num[0] - width) // (num_frames - 1)
+        view_dataset.names.append(f"{frame:06}")
+        pose = np.eye(4)
+        pose[0, 3] = shift * view_dataset.resolution
+        view_dataset.poses.append(pose)
+        # images are (y, x)
+        view_dataset.pixel_index_mappings.append(index_map[shift:shift + width].T.copy())
+        view_dataset.pixel_index_masks.append(np.ones((voxel_num[1], width), dtype=bool))
+        frame_owners.append(owners[shift:shift + width].T.copy())
+    view_dataset.append_length_log = [num_frames]
+    return view_dataset, frame_owners
+
+
+def make_pinhole_frames(shifts: list, width: int=24, height: int=30):
+    '''
+    Pinhole cameras looking straight down at a flat floor carrying the SCENE_OBJECTS footprints, one camera
+    per x shift in voxels. A pixel covers one voxel column of the floor, pixel (v, u) of a frame with shift s
+    sees column (u + s, height - 1 - v). Returns the ViewDataset holding intrinsic_matrix, poses,
+    global_points and masks, and per frame the SCENE_OBJECTS position seen by every pixel (-1 for the floor).
+    '''
+    view_dataset = make_view_dataset()
+    resolution = view_dataset.resolution
+    lower_bound = view_dataset.bounds.lower_bound
+    camera_height = 1.0
+    focal = camera_height / resolution
+    view_dataset.intrinsic_matrix = np.array([
+        [focal, 0, (width - 1) / 2],
+        [0, focal, (height - 1) / 2],
+        [0, 0, 1]
+    ])
+    owners = scene_owners(view_dataset.voxel_num)
+    us, vs = np.meshgrid(np.arange(width), np.arange(height))
+    view_dataset.poses, view_dataset.global_points, view_dataset.masks = [], [], []
+    frame_owners = []
+    for shift in shifts:
+        # camera to world, camera z looks down, camera y runs against world y
+        pose = np.diag([1.0, -1.0, -1.0, 1.0])
+        pose[:3, 3] = lower_bound + resolution * np.array([shift + width / 2, height / 2, 0]) + [0, 0, camera_height]
+        columns = np.stack([us + shift, height - 1 - vs], axis=-1)
+        view_dataset.poses.append(pose)
+        view_dataset.global_points.append(np.concatenate([
+            lower_bound[:2] + resolution * (columns + 0.5), np.zeros((height, width, 1))], axis=-1))
+        view_dataset.masks.append(np.ones((height, width), dtype=bool))
+        inside = columns[..., 0] < owners.shape[0]
+        frame_owners.append(np.where(inside, owners[np.minimum(columns[..., 0], owners.shape[0] - 1), columns[..., 1]], -1))
+    return view_dataset, frame_owners
+
+
+def make_recording(memory_dir, num_frames: int=16, width: int=20, seed: int=0) -> ViewDataset:
+    '''
+    make_frames with the semantic memory of all frames (one detection per visible object, noisy features)
+    written to memory_dir / "semantic_memory"
+    '''
+    rng = np.random.default_rng(seed)
+    view_dataset, frame_owners = make_frames(num_frames=num_frames, width=width)
+    classes = [name for name, _, _, _ in SCENE_OBJECTS]
+    image_bases = rng.normal(size=(len(SCENE_OBJECTS), 16))
+    text_bases = rng.normal(size=(len(SCENE_OBJECTS), 16))
+    with SemanticMemoryWriter(memory_dir / "semantic_memory") as writer:
+        for name, owners in zip(view_dataset.names, frame_owners):
+            visible = [k for k in range(len(SCENE_OBJECTS)) if np.sum(owners == k) >= 30]
+            masks = np.array([owners == k for k in visible], dtype=bool).reshape(-1, *owners.shape)
+            xyxy = [[np.flatnonzero(mask.any(axis=0))[[0, -1]], np.flatnonzero(mask.any(axis=1))[[0, -1]]] for mask in masks]
+            image_feats = image_bases[visible] + rng.normal(0, 0.05, size=(len(visible), 16))
+            writer.add(name, {
+                "xyxy": np.array([[x[0], y[0], x[1], y[1]] for x, y in xyxy], dtype=np.float32).reshape(-1, 4),
+                "confidence": np.full(len(visible), 0.8, dtype=np.float32),
+                "class_id": np.array(visible, dtype=np.int64),
+                "mask": masks,
+                "classes": classes,
+                "image_feats": image_feats / np.linalg.norm(image_feats, axis=1, keepdims=True),
+                "text_feats": text_bases[visible] / np.linalg.norm(text_bases[visible], axis=1, keepdims=True),
+            })
+    return view_dataset
+
+
+@pytest.fixture
+def view_dataset():
+    return make_view_dataset()
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+sv = pytest.importorskip("supervision")
+pytest.importorskip("groundingdino")
+from dovsg.perception.models.mygroundingdinosam2 import MyGroundingDINOSAM2
+
+
+class FullResolutionModel:
+    '''stands in for GroundingDINO at full resolution, records the calls'''
+    def __init__(self):
+        self.calls = 0
+
+    def predict_with_classes(self, image, classes, box_threshold, text_threshold):
+        self.calls += 1
+        return sv.Detections(xyxy=np.array([[1, 1, 5, 5]], dtype=np.float32),
+                             confidence=np.array([0.9], dtype=np.float32), class_id=np.array([0]))
+
+
+def adaptive_model(coarse_xyxy, coarse_confidence, input_hw):
+    '''MyGroundingDINOSAM2 whose coarse pass returns the given boxes, seen at input_hw'''
+    model = MyGroundingDINOSAM2.__new__(MyGroundingDINOSAM2)
+    model.box_threshold, model.text_threshold = 0.3, 0.3
+    model.min_box_size, model.low_confidence_margin = 24, 0.05
+    model.coarse_short_side = 400
+    model.coarse_resolution_frames, model.full_resolution_frames = 0, 0
+    model.grounding_dino_model = FullResolutionModel()
+    coarse = sv.Detections(xyxy=np.array(coarse_xyxy, dtype=np.float32).reshape(-1, 4),
+                           confidence=np.array(coarse_confidence, dtype=np.float32),
+                           class_id=np.zeros(len(coarse_confidence), dtype=np.int64))
+    model.predict_with_classes = lambda **kwargs: (coarse, input_hw)
+    return model
+
+
+def run(model, image_hw=(480, 640)):
+    return model.predict_adaptive_resolution(np.zeros((*image_hw, 3), dtype=np.uint8), ["cup"])
+
+
+def test_confident_large_boxes_stay_coarse():
+    model = adaptive_model([[0, 0, 200, 200], [300, 100, 500, 400]], [0.8, 0.2], (400, 533))
+    detections = run(model)
+    # only boxes above the real threshold are kept
+    assert np.array_equal(detections.xyxy, [[0, 0, 200, 200]])
+    assert (model.coarse_resolution_frames, model.full_resolution_frames) == (1, 0)
+    assert model.grounding_dino_model.calls == 0
+
+
+@pytest.mark.parametrize("xyxy, confidence", [
+    # 24 px in the source frame are 20 px at the coarse scale of a 480 x 640 frame
+    ([[0, 0, 24, 200]], [0.8]),
+    # near the threshold
+    ([[0, 0, 200, 200]], [0.32]),
+    # nothing found at the coarse scale
+    ([], []),
+])
+def test_full_resolution_fallback(xyxy, confidence):
+    model = adaptive_model(xyxy, confidence, (400, 533))
+    detections = run(model)
+    assert model.grounding_dino_model.calls == 1 and model.full_resolution_frames == 1
+    assert np.array_equal(detections.xyxy, [[1, 1, 5, 5]])
+
+
+def test_wide_frames_use_the_clamped_input_size():
+    # 40 px are 33 px at the coarse scale of a 480 x 640 frame
+    model = adaptive_model([[0, 0, 40, 200]], [0.8], (400, 533))
+    run(model)
+    assert model.full_resolution_frames == 0
+    # a 480 x 1600 frame hits max_size: the model saw 277 x 666, so the same box is 16 px there
+    model = adaptive_model([[0, 0, 40, 200]], [0.8], (277, 666))
+    run(model, image_hw=(480, 1600))
+    assert model.full_resolution_frames == 1
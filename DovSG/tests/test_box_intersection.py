@@ -0,0 +1,89 @@
+import numpy as np
+import open3d as o3d
+from scipy.optimize import linprog
+from scipy.spatial.transform import Rotation
+from dovsg.memory.instances.instance_process import InstanceProcess
+from dovsg.memory.instances.instance_utils import boxes_intersect
+
+
+def random_boxes(rng: np.random.Generator, num: int, scene_size: float=1.0):
+    centers = rng.uniform(0, scene_size, size=(num, 3))
+    rotations = Rotation.random(num, random_state=rng.integers(1 << 31)).as_matrix()
+    half_extents = rng.uniform(0.01, 0.25, size=(num, 3))
+    return centers, rotations, half_extents
+
+
+def lp_intersects(center_a, rotation_a, half_a, center_b, rotation_b, half_b) -> bool:
+    '''exact: is there a point x with |R^T (x - c)| <= half extent for both boxes'''
+    a_ub, b_ub = [], []
+    for center, rotation, half in [(center_a, rotation_a, half_a), (center_b, rotation_b, half_b)]:
+        a_ub += [rotation.T, -rotation.T]
+        b_ub += [half + rotation.T @ center, half - rotation.T @ center]
+    result = linprog(np.zeros(3), A_ub=np.concatenate(a_ub), b_ub=np.concatenate(b_ub), bounds=[(None, None)] * 3)
+    return result.status == 0
+
+
+def test_boxes_intersect_matches_linear_program():
+    rng = np.random.default_rng(0)
+    boxes_a, boxes_b = random_boxes(rng, 400), random_boxes(rng, 400)
+    intersect = boxes_intersect(*boxes_a, *boxes_b)
+    expected = np.array([lp_intersects(*[box[i] for box in boxes_a], *[box[i] for box in boxes_b]) for i in range(400)])
+    assert 0 < expected.sum() < len(expected)
+    assert np.array_equal(intersect, expected)
+
+
+def face_axes_overlap(center_a, rotation_a, half_a, center_b, rotation_b, half_b) -> bool:
+    '''projections on the 6 face normals overlap, not enough on its own for oriented boxes'''
+    corners = np.array(np.meshgrid([-1, 1], [-1, 1], [-1, 1], indexing="ij")).reshape(3, -1).T
+    points_a = center_a + (corners * half_a) @ rotation_a.T
+    points_b = center_b + (corners * half_b) @ rotation_b.T
+    for axis in np.concatenate([rotation_a.T, rotation_b.T]):
+        if (points_a @ axis).max() < (points_b @ axis).min() or (points_b @ axis).max() < (points_a @ axis).min():
+            return False
+    return True
+
+
+def test_boxes_intersect_separated_by_edge_axis():
+    # close pairs that no face normal separates, only an edge cross product axis
+    rng = np.random.default_rng(2)
+    center_a, rotation_a, half_a = random_boxes(rng, 1000, scene_size=0.3)
+    center_b, rotation_b, half_b = random_boxes(rng, 1000, scene_size=0.3)
+    edge_separated = [i for i in range(1000)
+                      if face_axes_overlap(center_a[i], rotation_a[i], half_a[i], center_b[i], rotation_b[i], half_b[i])
+                      and not lp_intersects(center_a[i], rotation_a[i], half_a[i], center_b[i], rotation_b[i], half_b[i])]
+    assert len(edge_separated) > 0
+    assert not np.any(boxes_intersect(center_a[edge_separated], rotation_a[edge_separated], half_a[edge_separated],
+                                      center_b[edge_separated], rotation_b[edge_separated], half_b[edge_separated]))
+
+
+def test_touching_boxes_intersect():
+    half = np.full(3, 0.5)
+    assert boxes_intersect(np.zeros(3), np.eye(3), half, np.array([1.0, 0.0, 0.0]), np.eye(3), half)
+    assert not boxes_intersect(np.zeros(3), np.eye(3), half, np.array([1.001, 0.0, 0.0]), np.eye(3), half)
+
+
+def test_compute_box_intersections():
+    rng = np.random.default_rng(1)
+    instance_process = InstanceProcess(downsample_voxel_size=0.02)
+    bboxes_a = [o3d.geometry.OrientedBoundingBox(c, r, 2 * h) for c, r, h in zip(*random_boxes(rng, 20))]
+    bboxes_b = [o3d.geometry.OrientedBoundingBox(c, r, 2 * h) for c, r, h in zip(*random_boxes(rng, 20))]
+    # axis aligned and flat boxes, flat sides are expanded to expend_eps
+    bboxes_b += [o3d.geometry.AxisAlignedBoundingBox(c - h, c + h) for c, _, h in zip(*random_boxes(rng, 10))]
+    bboxes_b.append(o3d.geometry.OrientedBoundingBox(np.full(3, 0.5), np.eye(3), np.array([0.3, 0.3, 0.0])))
+
+    intersect = instance_process.compute_box_intersections(bboxes_a, bboxes_b, block_size=16)
+    expected = np.zeros_like(intersect)
+    for i, bbox_a in enumerate(bboxes_a):
+        for j, bbox_b in enumerate(bboxes_b):
+            boxes = []
+            for bbox in [bbox_a, bbox_b]:
+                if isinstance(bbox, o3d.geometry.AxisAlignedBoundingBox):
+                    boxes += [bbox.get_center(), np.eye(3), np.maximum(bbox.get_extent(), instance_process.expend_eps) / 2]
+                else:
+                    boxes += [bbox.center, bbox.R, np.maximum(bbox.extent, instance_process.expend_eps) / 2]
+            expected[i, j] = lp_intersects(*boxes)
+    assert np.array_equal(intersect, expected)
+
+    pairs = np.argwhere(rng.random(intersect.shape) < 0.3)
+    assert np.array_equal(instance_process.compute_box_intersections(bboxes_a, bboxes_b, pairs=pairs),
+                          intersect[pairs[:, 0], pairs[:, 1]])
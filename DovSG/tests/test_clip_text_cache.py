@@ -0,0 +1,43 @@
+import numpy as np
+from dovsg.perception.models.myclip import ClipTextFeatureCache
+
+
+def features(num: int, seed: int=0) -> np.ndarray:
+    feats = np.random.default_rng(seed).normal(size=(num, 8)).astype(np.float32)
+    return feats / np.linalg.norm(feats, axis=1, keepdims=True)
+
+
+def test_hits_and_misses(tmp_path):
+    cache = ClipTextFeatureCache("model", cache_path=tmp_path / "cache.pkl")
+    assert cache.get_missing(["Red  Cup", "plate", "red cup"]) == ["red cup", "plate"]
+    assert (cache.hits, cache.misses) == (0, 3)
+    cache.update(["red cup", "plate"], features(2))
+    # normalized texts share an entry
+    assert cache.get_missing([" red cup", "PLATE", "bowl"]) == ["bowl"]
+    assert (cache.hits, cache.misses) == (2, 4)
+    assert cache.get(["Red Cup", "plate"]).dtype == np.float16
+    assert np.array_equal(cache.get(["Red Cup"]), cache.get(["red cup"]))
+    assert np.allclose(cache.get(["red cup", "plate"]), features(2), atol=1e-3)
+
+
+def test_writes_are_batched_and_persisted(tmp_path):
+    cache_path = tmp_path / "cache.pkl"
+    cache = ClipTextFeatureCache("model", cache_path=cache_path, save_interval=3)
+    feats = features(3)
+    cache.update(["a"], feats[:1])
+    cache.update(["b"], feats[1:2])
+    # nothing written before save_interval features are pending
+    assert not cache_path.exists()
+    cache.update(["c"], feats[2:])
+    assert cache_path.exists() and cache.pending == 0
+    modified = cache_path.stat().st_mtime_ns
+    cache.save()
+    assert cache_path.stat().st_mtime_ns == modified
+
+    cache.update(["d"], features(1, seed=1))
+    cache.save()
+    reloaded = ClipTextFeatureCache("model", cache_path=cache_path)
+    assert reloaded.get_missing(["a", "b", "c", "d"]) == []
+    assert np.array_equal(reloaded.get(["a", "b", "c", "d"]), cache.get(["a", "b", "c", "d"]))
+    # entries of another model are not hits
+    assert ClipTextFeatureCache("other", cache_path=cache_path).get_missing(["a"]) == ["a"]
@@ -0,0 +1,42 @@
+import pytest
+import torch
+import torch.nn.functional as F
+from dovsg.perception.models.cpu_backend import quantize_int8, export_clip_towers, check_backend
+
+open_clip = pytest.importorskip("open_clip")
+
+
+def tiny_clip() -> torch.nn.Module:
+    '''randomly initialized CLIP small enough for a unit test'''
+    torch.manual_seed(0)
+    return open_clip.CLIP(
+        embed_dim=32,
+        vision_cfg=dict(layers=2, width=64, patch_size=8, image_size=32, head_width=32),
+        text_cfg=dict(context_length=16, vocab_size=100, width=64, heads=2, layers=2)
+    ).eval()
+
+
+def test_int8_towers_close_to_eager(tmp_path):
+    clip_model = tiny_clip()
+    images = torch.rand(4, 3, 32, 32)
+    texts = torch.randint(1, 100, (4, 16))
+    with torch.no_grad():
+        eager_image = F.normalize(clip_model.encode_image(images), dim=-1)
+        eager_text = F.normalize(clip_model.encode_text(texts), dim=-1)
+
+        image_tower, text_tower = export_clip_towers(clip_model, "tiny", export_dir=tmp_path)
+        assert F.cosine_similarity(image_tower(images), eager_image).min() > 0.99
+        assert F.cosine_similarity(text_tower(texts), eager_text).min() > 0.99
+
+        # later runs load the traced towers from disk
+        assert (tmp_path / "tiny_image_int8.pt").exists() and (tmp_path / "tiny_text_int8.pt").exists()
+        loaded_image_tower, _ = export_clip_towers(tiny_clip(), "tiny", export_dir=tmp_path)
+        assert torch.allclose(loaded_image_tower(images), image_tower(images))
+
+
+def test_quantize_int8_replaces_linear_layers():
+    quantized_model = quantize_int8(tiny_clip())
+    linear_layers = [m for m in quantized_model.modules() if type(m) is torch.nn.Linear]
+    assert linear_layers == []
+    with pytest.raises(AssertionError):
+        check_backend("tensorrt")
@@ -0,0 +1,65 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+from dovsg.memory.instances.instance_process import InstanceProcess
+from dovsg.memory.instances.instance_utils import MapObjectList, DetectionList
+from test_point_moments import instance_process_on, make_object
+from conftest import random_blob
+
+
+def assert_fresh(objects: MapObjectList):
+    '''the kept matrices equal normalizing the current features from scratch'''
+    for key in ["clip_ft", "text_ft"]:
+        expected = F.normalize(torch.stack([torch.as_tensor(obj[key]).float() for obj in objects]), dim=-1)
+        assert torch.equal(objects.get_feature_matrix(key), expected), key
+
+
+def random_object(instance_process: InstanceProcess, rng: np.random.Generator) -> dict:
+    obj = make_object(instance_process, random_blob(instance_process.view_dataset, rng))
+    obj["clip_ft"] = torch.from_numpy(rng.normal(size=8).astype(np.float32))
+    obj["text_ft"] = torch.from_numpy(rng.normal(size=8).astype(np.float32))
+    return obj
+
+
+def test_feature_matrix_follows_the_objects(view_dataset):
+    instance_process = instance_process_on(view_dataset)
+    rng = np.random.default_rng(0)
+    objects = MapObjectList([random_object(instance_process, rng) for _ in range(3)])
+    assert_fresh(objects)
+
+    # appends past the allocated rows
+    for _ in range(6):
+        objects.append(random_object(instance_process, rng))
+        assert_fresh(objects)
+
+    # in-place merge: merge_obj_to_obj assigns new feature tensors to the kept object
+    objects[2] = instance_process.merge_obj_to_obj(objects[2], random_object(instance_process, rng), run_dbscan=False)
+    assert_fresh(objects)
+    instance_process.merge_obj_to_obj(objects[4], objects[5], run_dbscan=False)
+    assert_fresh(objects)
+
+    # removals shift the rows behind them
+    del objects[0]
+    assert_fresh(objects)
+    objects.pop(3)
+    assert_fresh(objects)
+    objects.pop()
+    assert_fresh(objects)
+
+    # a replaced object and a reordered list
+    objects[1] = random_object(instance_process, rng)
+    objects.reverse()
+    assert_fresh(objects)
+
+
+def test_visual_and_text_similarities(view_dataset):
+    instance_process = instance_process_on(view_dataset)
+    rng = np.random.default_rng(1)
+    objects = MapObjectList([random_object(instance_process, rng) for _ in range(5)])
+    detections = DetectionList([random_object(instance_process, rng) for _ in range(3)])
+    for key, compute in [("clip_ft", instance_process.compute_visual_similarities),
+                         ("text_ft", instance_process.compute_text_similarities)]:
+        det_fts = detections.get_stacked_values_torch(key)
+        obj_fts = objects.get_stacked_values_torch(key)
+        expected = F.cosine_similarity(det_fts.unsqueeze(-1), obj_fts.T.unsqueeze(0), dim=1)
+        assert torch.allclose(compute(detections, objects), expected, atol=1e-6)
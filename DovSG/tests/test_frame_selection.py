@@ -0,0 +1,75 @@
+import numpy as np
+from conftest import make_view_dataset, make_frames
+
+
+def frames_view_dataset(voxel_sets: list, poses: list=None):
+    '''one 1 x n image per frame, seeing the voxel indexes of its set'''
+    view_dataset = make_view_dataset()
+    view_dataset.names = [f"{k:06}" for k in range(len(voxel_sets))]
+    view_dataset.pixel_index_mappings = [np.asarray(voxels).reshape(1, -1) for voxels in voxel_sets]
+    view_dataset.pixel_index_masks = [np.ones((1, len(voxels)), dtype=bool) for voxels in voxel_sets]
+    view_dataset.poses = poses if poses is not None else [np.eye(4) for _ in voxel_sets]
+    return view_dataset
+
+
+def test_coverage_threshold():
+    view_dataset = frames_view_dataset([np.arange(100), np.arange(100), np.arange(50, 150), np.arange(100)])
+    keep, report = view_dataset.select_covisible_frames([0, 1, 2, 3], min_new_coverage=0.4, min_views=1)
+    assert keep == [0, 2]
+    assert [info["new_coverage"] for info in report] == [1.0, 0.0, 0.5, 0.0]
+    # half of frame 2 is new, not enough for a threshold above 0.5
+    keep, _ = view_dataset.select_covisible_frames([0, 1, 2, 3], min_new_coverage=0.6, min_views=1)
+    assert keep == [0]
+    keep, _ = view_dataset.select_covisible_frames([0, 1, 2, 3], min_new_coverage=0.0, min_views=1)
+    assert keep == [0, 1, 2, 3]
+
+
+def test_min_views():
+    # the same view over and over, kept until every voxel has been seen min_views times
+    view_dataset = frames_view_dataset([np.arange(100)] * 6)
+    keep, _ = view_dataset.select_covisible_frames(list(range(6)), min_new_coverage=0.5, min_views=3)
+    assert keep == [0, 1, 2]
+
+    # with any uncovered voxel keeping a frame, every voxel gets min_views kept views or all of its views
+    view_dataset, _ = make_frames(num_frames=60)
+    frames = list(range(60))
+    keep, _ = view_dataset.select_covisible_frames(frames, min_new_coverage=1e-6, min_views=2, max_translation=10)
+    assert 2 <= len(keep) < len(frames)
+
+    def view_counts(frame_indexes):
+        voxels = np.concatenate([np.unique(view_dataset.pixel_index_mappings[k]) for k in frame_indexes])
+        return dict(zip(*np.unique(voxels, return_counts=True)))
+    all_views, kept_views = view_counts(frames), view_counts(keep)
+    assert all(kept_views.get(voxel, 0) >= min(count, 2) for voxel, count in all_views.items())
+
+
+def test_skip_report():
+    view_dataset = frames_view_dataset([np.arange(100), np.arange(100), np.arange(90, 190), np.arange(5, 95)])
+    keep, report = view_dataset.select_covisible_frames([1, 2, 3], min_new_coverage=0.2, min_views=1)
+    # only the given frames are walked
+    assert keep == [1, 2]
+    assert [info["name"] for info in report] == ["000001", "000002", "000003"]
+    assert [info["kept"] for info in report] == [True, True, False]
+    assert [info["moved"] for info in report] == [False, False, False]
+    assert report[1]["new_coverage"] == 0.9 and report[2]["new_coverage"] == 0.0
+
+    # frames without any valid pixel are skipped
+    view_dataset.pixel_index_masks[3][:] = False
+    _, report = view_dataset.select_covisible_frames([0, 3], min_new_coverage=0.0, min_views=1)
+    assert [info["kept"] for info in report] == [True, False]
+
+
+def test_camera_motion_keeps_frames():
+    poses = [np.eye(4) for _ in range(4)]
+    poses[2][:3, 3] = [1.0, 0.0, 0.0]
+    view_dataset = frames_view_dataset([np.arange(100)] * 4, poses=poses)
+    keep, report = view_dataset.select_covisible_frames(list(range(4)), min_new_coverage=0.5, min_views=1,
+                                                        max_translation=0.5)
+    # frame 2 moved away from frame 0, frame 3 moved back from frame 2
+    assert keep == [0, 2, 3]
+    assert [info["moved"] for info in report] == [False, False, True, True]
+
+    # view datasets cached before poses were stored only use the coverage
+    del view_dataset.poses
+    keep, _ = view_dataset.select_covisible_frames(list(range(4)), min_new_coverage=0.5, min_views=1)
+    assert keep == [0]
@@ -0,0 +1,115 @@
+import copy
+import pickle
+import numpy as np
+import pytest
+from dovsg.memory.instances.instance_process import InstanceProcess
+from dovsg.memory.instances.object_store import ObjectStore
+from conftest import make_recording
+
+
+def checkpointed_process(denoise_frames: list=None) -> InstanceProcess:
+    '''denoise_frames: filled with the last frame associated before each denoise pass'''
+    instance_process = InstanceProcess()
+    instance_process.checkpoint_interval = 4
+    # periodic denoise passes (every 3 frames of 16, 2 of 8) out of phase with the checkpoints
+    instance_process.denoise_interval = 2
+    if denoise_frames is not None:
+        finalize, denoise = instance_process.finalize_detections, instance_process.denoise_objects
+        last_frame = []
+
+        def recorded_finalize(detections, original_indexes):
+            detection_list = finalize(detections, original_indexes)
+            last_frame[:] = [detection["image_name"][0] for detection in detection_list[:1]]
+            return detection_list
+
+        def recorded_denoise(objects):
+            denoise_frames.append(last_frame[0])
+            return denoise(objects)
+        instance_process.finalize_detections = recorded_finalize
+        instance_process.denoise_objects = recorded_denoise
+    return instance_process
+
+
+def run(memory_dir, view_dataset, crash_at: int=None, update: tuple=None, denoise_frames: list=None):
+    '''get_instances, or update_instances with update = (objects, deleted_indexes)'''
+    np.random.seed(0)
+    instance_process = checkpointed_process(denoise_frames)
+    if crash_at is not None:
+        merge = instance_process.merge_detections_to_objects
+        calls = []
+
+        def crashing_merge(*args, **kwargs):
+            calls.append(None)
+            if len(calls) == crash_at:
+                raise RuntimeError("crash")
+            return merge(*args, **kwargs)
+        instance_process.merge_detections_to_objects = crashing_merge
+    if update is not None:
+        objects, deleted_indexes = update
+        return instance_process.update_instances(memory_dir, view_dataset, copy.deepcopy(objects), deleted_indexes)
+    return instance_process.get_instances(memory_dir, view_dataset)
+
+
+def store_arrays(objects) -> dict:
+    store = ObjectStore.from_objects(objects)
+    return {k: v for k, v in vars(store).items() if isinstance(v, np.ndarray)}
+
+
+@pytest.mark.parametrize("crash_at", [4, 8, 12])
+def test_resume_equals_full_run(tmp_path, crash_at):
+    view_dataset = make_recording(tmp_path, num_frames=16)
+    checkpoint_path = tmp_path / "instance_checkpoint.pkl"
+    denoise_frames = []
+    objects, filter_indexes = run(tmp_path, view_dataset, denoise_frames=denoise_frames)
+    assert not checkpoint_path.exists()
+
+    with pytest.raises(RuntimeError):
+        run(tmp_path, view_dataset, crash_at=crash_at)
+    with open(checkpoint_path, "rb") as f:
+        assert 0 < pickle.load(f)["cursor"] <= crash_at
+    # the resumed run restores the random state of the instance colors itself
+    np.random.seed(123)
+    resumed_denoise_frames = []
+    resumed, resumed_filter_indexes = checkpointed_process(resumed_denoise_frames).get_instances(tmp_path, view_dataset)
+    assert not checkpoint_path.exists()
+    # denoise passes stay scheduled on the frames, not on the frames since the resume
+    assert len(resumed_denoise_frames) > 1
+    assert resumed_denoise_frames == denoise_frames[-len(resumed_denoise_frames):]
+    assert_same_results((objects, filter_indexes), (resumed, resumed_filter_indexes))
+
+
+def assert_same_results(expected_results, actual_results):
+    expected, actual = store_arrays(expected_results[0]), store_arrays(actual_results[0])
+    assert len(actual_results[0]) == len(expected_results[0])
+    for k in expected:
+        assert expected[k].dtype == actual[k].dtype and np.array_equal(expected[k], actual[k]), k
+    assert np.array_equal(expected_results[1], actual_results[1])
+
+
+@pytest.mark.parametrize("crash_at", [5, 8])
+def test_resumed_update_equals_full_update(tmp_path, crash_at):
+    view_dataset = make_recording(tmp_path, num_frames=16)
+    view_dataset.append_length_log = [8]
+    np.random.seed(0)
+    objects, _ = InstanceProcess().get_instances(tmp_path, view_dataset, obj_min_detections=2)
+    # the second half of the recording is appended, the unchanged objects are skipped by the last passes
+    view_dataset.append_length_log = [8, 8]
+    update = (objects, np.sort(objects[0]["indexes"])[:5])
+    expected = run(tmp_path, view_dataset, update=update)
+
+    with pytest.raises(RuntimeError):
+        run(tmp_path, view_dataset, crash_at=crash_at, update=update)
+    assert (tmp_path / "instance_checkpoint.pkl").exists()
+    np.random.seed(123)
+    resumed = checkpointed_process().update_instances(tmp_path, view_dataset, copy.deepcopy(objects), update[1])
+    assert_same_results(expected, resumed)
+
+
+def test_checkpoint_of_other_frames_is_ignored(tmp_path):
+    view_dataset = make_recording(tmp_path, num_frames=16)
+    with pytest.raises(RuntimeError):
+        run(tmp_path, view_dataset, crash_at=8)
+    # the same memory with other frames must start from scratch
+    view_dataset.names = [f"{name}_other" for name in view_dataset.names]
+    instance_process = InstanceProcess()
+    assert instance_process.load_checkpoint(tmp_path / "instance_checkpoint.pkl", view_dataset.names) is None
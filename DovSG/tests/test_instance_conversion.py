@@ -0,0 +1,73 @@
+import numpy as np
+import torch
+from dovsg.memory.instances.instance_process import InstanceProcess
+from dovsg.memory.semantic_memory_store import SemanticMemoryStore
+from dovsg.utils.pipeline import ordered_map
+from conftest import make_recording
+
+
+def assert_same_detection(a: dict, b: dict):
+    assert list(a) == list(b)
+    for k in a:
+        if k == "bbox":
+            assert np.array_equal(np.asarray(a[k].get_box_points()), np.asarray(b[k].get_box_points()))
+        elif k in ["mask", "xyxy"]:
+            assert all(np.array_equal(np.asarray(x), np.asarray(y)) for x, y in zip(a[k], b[k])), k
+        elif isinstance(a[k], (np.ndarray, torch.Tensor)):
+            assert np.array_equal(np.asarray(a[k]), np.asarray(b[k])), k
+        else:
+            assert a[k] == b[k], k
+
+
+def detection_lists(memory_dir, view_dataset, num_workers: int):
+    '''convert and finalize every frame like get_instances'''
+    instance_process = InstanceProcess(downsample_voxel_size=view_dataset.resolution, num_workers=num_workers)
+    instance_process.view_dataset = view_dataset
+    instance_process.class_id_counts = {}
+    instance_process.objects_original_indexes = []
+    semantic_memory_store = SemanticMemoryStore(memory_dir / "semantic_memory")
+
+    def convert(idx):
+        return instance_process.convert_gsam2_obs(
+            gsam2_obs=semantic_memory_store.load(view_dataset.names[idx]),
+            pixel_indexes=view_dataset.pixel_index_mappings[idx],
+            pixel_indexes_mask=view_dataset.pixel_index_masks[idx],
+            image_name=view_dataset.names[idx],
+        )
+
+    np.random.seed(0)
+    detection_lists = [instance_process.finalize_detections(*conversion) for conversion in
+                       ordered_map(convert, range(len(view_dataset.names)), instance_process.num_workers)]
+    return detection_lists, instance_process
+
+
+def test_parallel_conversion_matches_serial(tmp_path):
+    view_dataset = make_recording(tmp_path, num_frames=16)
+    serial, serial_process = detection_lists(tmp_path, view_dataset, num_workers=0)
+    parallel, parallel_process = detection_lists(tmp_path, view_dataset, num_workers=4)
+    assert sum(len(detections) for detections in serial) > 16
+    assert len(serial) == len(parallel)
+    for a, b in zip(serial, parallel):
+        assert len(a) == len(b)
+        for detection_a, detection_b in zip(a, b):
+            assert_same_detection(detection_a, detection_b)
+    # class ids, colors and the original indexes follow the frame order
+    assert serial_process.class_id_counts == parallel_process.class_id_counts
+    assert serial_process.objects_original_indexes == parallel_process.objects_original_indexes
+
+
+def test_gsam2_obs_to_detection_list_is_convert_and_finalize(tmp_path):
+    view_dataset = make_recording(tmp_path, num_frames=4)
+    expected, _ = detection_lists(tmp_path, view_dataset, num_workers=0)
+    instance_process = InstanceProcess(downsample_voxel_size=view_dataset.resolution)
+    instance_process.view_dataset = view_dataset
+    instance_process.class_id_counts = {}
+    instance_process.objects_original_indexes = []
+    semantic_memory_store = SemanticMemoryStore(tmp_path / "semantic_memory")
+    np.random.seed(0)
+    for idx, name in enumerate(view_dataset.names):
+        detections = instance_process.gsam2_obs_to_detection_list(
+            semantic_memory_store.load(name), view_dataset.pixel_index_mappings[idx],
+            view_dataset.pixel_index_masks[idx], name)
+        for a, b in zip(detections, expected[idx]):
+            assert_same_detection(a, b)
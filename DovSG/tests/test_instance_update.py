@@ -0,0 +1,148 @@
+import copy
+import numpy as np
+import pytest
+from dovsg.memory.instances.instance_process import InstanceProcess
+from conftest import make_recording
+
+
+def box_points(bbox) -> np.ndarray:
+    return np.asarray(bbox.get_box_points())
+
+
+@pytest.fixture
+def update_recording(tmp_path):
+    '''objects of the first 12 frames, and the recording with 4 more frames appended'''
+    view_dataset = make_recording(tmp_path, num_frames=16)
+    first = copy.copy(view_dataset)
+    first.names = view_dataset.names[:12]
+    first.pixel_index_mappings = view_dataset.pixel_index_mappings[:12]
+    first.pixel_index_masks = view_dataset.pixel_index_masks[:12]
+    first.append_length_log = [12]
+    np.random.seed(0)
+    objects, _ = InstanceProcess().get_instances(tmp_path, first, obj_min_detections=2)
+    view_dataset.append_length_log = [12, 4]
+    return tmp_path, view_dataset, objects
+
+
+def get_object(objects, class_name: str) -> dict:
+    found = [obj for obj in objects if obj["class_name"] == class_name]
+    assert len(found) == 1, class_name
+    return found[0]
+
+
+def test_remove_indexes(update_recording):
+    _, view_dataset, objects = update_recording
+    instance_process = InstanceProcess()
+    instance_process.view_dataset = view_dataset
+    rng = np.random.default_rng(0)
+    table, box = get_object(objects, "table"), get_object(objects, "box")
+    deleted = np.concatenate([rng.choice(table["indexes"], int(0.3 * len(table["indexes"])), replace=False),
+                              rng.choice(box["indexes"], int(0.8 * len(box["indexes"])), replace=False)])
+    before = copy.deepcopy(objects)
+
+    kept, changed = instance_process.remove_indexes(objects, deleted, delete_rate=0.5)
+    assert [obj["class_name"] for obj in kept] == [obj["class_name"] for obj in before if obj["class_name"] != "box"]
+    for obj, flag in zip(kept, changed):
+        original = get_object(before, obj["class_name"])
+        remaining = np.setdiff1d(original["indexes"], deleted)
+        assert np.array_equal(np.sort(obj["indexes"]), remaining)
+        assert flag == (obj["class_name"] == "table")
+        # moments and box match the remaining voxels exactly, not only approximately
+        assert np.array_equal(obj["point_moments"], instance_process.get_point_moments(obj["indexes"]))
+        assert np.allclose(box_points(obj["bbox"]), box_points(instance_process.get_bounding_box(obj["indexes"])))
+
+    # nothing deleted, nothing changed
+    kept, changed = instance_process.remove_indexes(kept, np.zeros(0, dtype=np.int64), delete_rate=0.5)
+    assert len(kept) == len(objects) - 1 and not changed.any()
+
+
+def test_update_instances(update_recording):
+    memory_dir, view_dataset, objects = update_recording
+    rng = np.random.default_rng(1)
+    table, box = get_object(objects, "table"), get_object(objects, "box")
+    deleted = np.concatenate([rng.choice(table["indexes"], int(0.3 * len(table["indexes"])), replace=False),
+                              rng.choice(box["indexes"], int(0.8 * len(box["indexes"])), replace=False)])
+    before = copy.deepcopy(objects)
+
+    np.random.seed(0)
+    instance_process = InstanceProcess()
+    updated, _ = instance_process.update_instances(memory_dir, view_dataset, objects, deleted, delete_rate=0.5,
+                                                   obj_min_detections=2)
+    new_frames = set(view_dataset.names[12:])
+
+    # the bottle lost no voxels and is not seen by the new frames, it is kept as it was
+    bottle, old_bottle = get_object(updated, "bottle"), get_object(before, "bottle")
+    assert np.array_equal(bottle["indexes"], old_bottle["indexes"])
+    assert bottle["num_detections"] == old_bottle["num_detections"]
+    # the table only shrinks, denoising may drop a few more voxels
+    assert np.all(np.isin(get_object(updated, "table")["indexes"], np.setdiff1d(table["indexes"], deleted)))
+    # the cube takes the detections of the new frames
+    cube, old_cube = get_object(updated, "cube"), get_object(before, "cube")
+    assert cube["num_detections"] == old_cube["num_detections"] + len(new_frames)
+    # the box lost most of its voxels and was deleted, the new frames see it again as a new object
+    assert set(get_object(updated, "box")["image_name"]) <= new_frames
+
+    for obj in updated:
+        assert np.array_equal(obj["point_moments"], instance_process.get_point_moments(obj["indexes"]))
+
+
+def assert_same_objects(objects_a, objects_b):
+    assert [obj["class_id"] for obj in objects_a] == [obj["class_id"] for obj in objects_b]
+    for obj_a, obj_b in zip(objects_a, objects_b):
+        assert np.array_equal(obj_a["indexes"], obj_b["indexes"])
+        assert np.array_equal(obj_a["point_moments"], obj_b["point_moments"])
+        assert np.array_equal(box_points(obj_a["bbox"]), box_points(obj_b["bbox"]))
+        assert obj_a["num_detections"] == obj_b["num_detections"]
+        assert np.array_equal(obj_a["clip_ft"], obj_b["clip_ft"])
+
+
+def run_tracked_and_full(run, monkeypatch):
+    '''results of run(instance_process) with and without track_changes, and the tracked denoise and align work'''
+    results, work = [], {}
+    for track_changes in [False, True]:
+        instance_process = InstanceProcess()
+        instance_process.track_changes = track_changes
+        work[track_changes] = {"denoised": 0, "aligned": None}
+        process_indexes, align = instance_process.process_indexes, instance_process.indexes_align_objects
+
+        def counted_process_indexes(indexes, run_dbscan=True, work=work[track_changes]):
+            work["denoised"] += run_dbscan
+            return process_indexes(indexes, run_dbscan=run_dbscan)
+
+        def recorded_align(objects, changed=None, work=work[track_changes]):
+            work["aligned"] = changed
+            return align(objects, changed)
+        monkeypatch.setattr(instance_process, "process_indexes", counted_process_indexes)
+        monkeypatch.setattr(instance_process, "indexes_align_objects", recorded_align)
+        np.random.seed(0)
+        results.append(run(instance_process))
+    return results, work
+
+
+def test_change_tracking_is_exact(update_recording, monkeypatch):
+    memory_dir, view_dataset, objects = update_recording
+    rng = np.random.default_rng(1)
+    table, box = get_object(objects, "table"), get_object(objects, "box")
+    deleted = np.concatenate([rng.choice(table["indexes"], int(0.3 * len(table["indexes"])), replace=False),
+                              rng.choice(box["indexes"], int(0.8 * len(box["indexes"])), replace=False)])
+
+    # an incremental update gives the objects of full passes over all of them
+    (full, tracked), work = run_tracked_and_full(lambda instance_process: instance_process.update_instances(
+        memory_dir, view_dataset, copy.deepcopy(objects), deleted, delete_rate=0.5, obj_min_detections=2), monkeypatch)
+    assert_same_objects(full[0], tracked[0])
+    assert np.array_equal(full[1], tracked[1])
+    # while untouched objects are not denoised again, and align starts from the changed objects only
+    assert work[True]["denoised"] < work[False]["denoised"]
+    assert work[False]["aligned"] is None
+    assert work[True]["aligned"] is not None and not work[True]["aligned"].all()
+
+    # a build from scratch only skips the objects a periodic denoise pass left unchanged
+    def build(instance_process):
+        instance_process.denoise_interval = 2
+        return instance_process.get_instances(memory_dir, view_dataset, obj_min_detections=2)
+    view_dataset.append_length_log = [16]
+    (full, tracked), work = run_tracked_and_full(build, monkeypatch)
+    assert_same_objects(full[0], tracked[0])
+    assert np.array_equal(full[1], tracked[1])
+    assert work[True]["denoised"] < work[False]["denoised"]
+    assert work[True]["aligned"] is None
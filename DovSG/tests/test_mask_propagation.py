@@ -0,0 +1,80 @@
+import numpy as np
+from dovsg.memory.mask_propagation import MaskPropagator
+from conftest import make_pinhole_frames, SCENE_OBJECTS
+
+
+def frame_det_res(owners: np.ndarray, seed: int=0) -> dict:
+    '''one detection per object visible in the frame'''
+    rng = np.random.default_rng(seed)
+    visible = [k for k in range(len(SCENE_OBJECTS)) if np.any(owners == k)]
+    return {
+        "xyxy": np.zeros((len(visible), 4), dtype=np.float32),
+        "confidence": rng.uniform(0.3, 1, size=len(visible)).astype(np.float32),
+        "class_id": np.array(visible),
+        "mask": np.array([owners == k for k in visible]),
+        "classes": [name for name, _, _, _ in SCENE_OBJECTS],
+        "image_feats": rng.normal(size=(len(visible), 8)).astype(np.float32),
+        "text_feats": rng.normal(size=(len(visible), 8)).astype(np.float32),
+    }
+
+
+def test_propagation_to_the_same_frame():
+    view_dataset, frame_owners = make_pinhole_frames([4])
+    det_res = frame_det_res(frame_owners[0])
+    propagated = MaskPropagator(view_dataset, min_mask_pixels=1).propagate(0, det_res, 0)
+    assert np.array_equal(propagated["mask"], det_res["mask"])
+    assert np.array_equal(propagated["class_id"], det_res["class_id"])
+
+
+def test_reprojection_matches_ground_truth():
+    shifts = [0, 6]
+    view_dataset, frame_owners = make_pinhole_frames(shifts)
+    det_res = frame_det_res(frame_owners[0])
+    propagated = MaskPropagator(view_dataset, min_mask_pixels=1).propagate(0, det_res, 1)
+
+    # pixels of frame 1 that frame 0 also sees, the columns not seen by frame 0 stay unlabeled
+    width = frame_owners[0].shape[1]
+    overlap = np.zeros_like(frame_owners[1], dtype=bool)
+    overlap[:, :width - (shifts[1] - shifts[0])] = True
+    assert len(propagated["mask"]) >= 2
+    for mask, class_id in zip(propagated["mask"], propagated["class_id"]):
+        assert np.array_equal(mask, (frame_owners[1] == class_id) & overlap)
+    # boxes follow the warped masks
+    last = propagated["mask"][-1]
+    rows, cols = np.flatnonzero(last.any(axis=1)), np.flatnonzero(last.any(axis=0))
+    assert np.array_equal(propagated["xyxy"][-1], [cols[0], rows[0], cols[-1], rows[-1]])
+
+    # confidence, class and CLIP features are the keyframe ones
+    keep = np.isin(det_res["class_id"], propagated["class_id"])
+    assert np.array_equal(propagated["image_feats"], det_res["image_feats"][keep])
+    assert np.array_equal(propagated["text_feats"], det_res["text_feats"][keep])
+    assert np.array_equal(propagated["confidence"], det_res["confidence"][keep])
+
+
+def test_occluded_and_small_masks_are_dropped():
+    view_dataset, frame_owners = make_pinhole_frames([0, 2])
+    det_res = frame_det_res(frame_owners[0])
+    # the keyframe saw something 10 cm above the floor in its top rows
+    view_dataset.global_points[0][:5, :, 2] = 0.1
+    propagated = MaskPropagator(view_dataset, min_mask_pixels=1).propagate(0, det_res, 1)
+    assert not propagated["mask"][:, :5].any()
+    assert propagated["mask"][:, 5:].any()
+
+    # masks under min_mask_pixels after warping are removed with their detection
+    sizes = np.array([mask.sum() for mask in MaskPropagator(view_dataset, min_mask_pixels=1).propagate(0, det_res, 1)["mask"]])
+    min_mask_pixels = int(np.sort(sizes)[0]) + 1
+    propagated = MaskPropagator(view_dataset, min_mask_pixels=min_mask_pixels).propagate(0, det_res, 1)
+    assert len(propagated["mask"]) == len(sizes) - 1
+    assert len(propagated["xyxy"]) == len(propagated["image_feats"]) == len(sizes) - 1
+
+
+def test_has_poses():
+    view_dataset, _ = make_pinhole_frames([0, 2, 4])
+    mask_propagator = MaskPropagator(view_dataset)
+    assert mask_propagator.has_poses([0, 1, 2])
+    # fewer poses than frames, or a view dataset cached before poses were stored
+    view_dataset.poses = view_dataset.poses[:2]
+    assert not mask_propagator.has_poses([0, 1, 2])
+    assert mask_propagator.has_poses([0, 1])
+    del view_dataset.poses
+    assert not mask_propagator.has_poses([0, 1])
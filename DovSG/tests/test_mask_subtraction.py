@@ -0,0 +1,62 @@
+import numpy as np
+from dovsg.memory.instances.instance_process import InstanceProcess
+
+
+def baseline_mask_subtract_contained(xyxy: np.ndarray, mask: np.ndarray, th1=0.8, th2=0.7) -> np.ndarray:
+    '''full frame subtraction of every contained mask, pair by pair, as before the crops'''
+    areas = (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])
+    lt = np.maximum(xyxy[:, None, :2], xyxy[None, :, :2])
+    rb = np.minimum(xyxy[:, None, 2:], xyxy[None, :, 2:])
+    inter = (rb - lt).clip(min=0)
+    inter_areas = inter[:, :, 0] * inter[:, :, 1]
+    inter_over_box1 = inter_areas / areas[:, None]
+    inter_over_box2 = inter_over_box1.T
+    contained_idx = ((inter_over_box1 < th2) & (inter_over_box2 > th1)).nonzero()
+    mask_sub = mask.copy()
+    for i in range(len(contained_idx[0])):
+        mask_sub[contained_idx[0][i]] = mask_sub[contained_idx[0][i]] & (~mask_sub[contained_idx[1][i]])
+    return mask_sub
+
+
+def nested_detections(rng: np.random.Generator, num: int, height: int=60, width: int=80):
+    '''boxes nested in chains, masks filling most of their box and spilling a little out of it'''
+    xyxy, masks = [], []
+    ys, xs = np.mgrid[:height, :width]
+    for k in range(num):
+        if k > 0 and rng.random() < 0.7:
+            # inside a previous box, so chains of containment are formed
+            x1, y1, x2, y2 = xyxy[rng.integers(k)]
+            w, h = max((x2 - x1) // 2, 2), max((y2 - y1) // 2, 2)
+            x1, y1 = x1 + rng.integers(0, max(x2 - x1 - w, 1)), y1 + rng.integers(0, max(y2 - y1 - h, 1))
+            box = [x1, y1, x1 + w, y1 + h]
+        else:
+            x1, y1 = rng.integers(0, width - 10), rng.integers(0, height - 10)
+            box = [x1, y1, rng.integers(x1 + 5, width), rng.integers(y1 + 5, height)]
+        xyxy.append(np.array(box))
+        inside = (xs >= box[0] - 2) & (xs <= box[2] + 2) & (ys >= box[1] - 2) & (ys <= box[3] + 2)
+        masks.append(inside & (rng.random((height, width)) < 0.8))
+    # an empty mask does not crop anything
+    masks[-1][:] = False
+    return np.array(xyxy, dtype=np.float32), np.array(masks)
+
+
+def test_cropped_subtraction_matches_full_frame():
+    instance_process = InstanceProcess()
+    rng = np.random.default_rng(0)
+    num_contained = 0
+    for num in [1, 2, 5, 12, 30]:
+        for _ in range(10):
+            xyxy, mask = nested_detections(rng, num)
+            expected = baseline_mask_subtract_contained(xyxy, mask)
+            num_contained += int(np.sum(expected != mask) > 0)
+            mask_sub = instance_process.mask_subtract_contained(xyxy, mask)
+            assert mask_sub.dtype == mask.dtype and np.array_equal(mask_sub, expected)
+    # the detection sets do subtract masks
+    assert num_contained > 10
+
+
+def test_input_is_not_modified():
+    xyxy, mask = nested_detections(np.random.default_rng(1), 8)
+    original = mask.copy()
+    InstanceProcess().mask_subtract_contained(xyxy, mask)
+    assert np.array_equal(mask, original)
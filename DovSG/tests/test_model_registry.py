@@ -0,0 +1,89 @@
+import pytest
+import torch.nn as nn
+from dovsg.utils.model_registry import ModelRegistry, model_registry, estimate_model_bytes
+import dovsg.perception.models.myclip as myclip
+
+
+def linear(num_floats: int) -> nn.Module:
+    '''Linear layer holding num_floats float32 values, weight plus bias'''
+    return nn.Linear(num_floats - 1, 1)
+
+
+def test_lazy_loading_and_hits():
+    registry = ModelRegistry()
+    calls = []
+
+    def factory():
+        calls.append(1)
+        return linear(10)
+
+    assert calls == []
+    model = registry.get("a", factory)
+    assert registry.get("a", factory) is model
+    assert registry.get("a", factory) is model
+    # the factory only runs on the first request
+    assert len(calls) == 1
+    assert registry.stats()["a"]["loads"] == 1 and registry.stats()["a"]["hits"] == 2
+    assert estimate_model_bytes(model) == 40
+
+
+def test_keys_are_isolated():
+    registry = ModelRegistry()
+    model_a = registry.get("sam2:cuda", lambda: linear(10))
+    model_b = registry.get("sam2:cpu", lambda: linear(10))
+    assert model_a is not model_b
+    assert registry.get("sam2:cuda", lambda: linear(10)) is model_a
+    assert registry.get("sam2:cpu", lambda: linear(10)) is model_b
+    assert set(registry.stats()) == {"sam2:cuda", "sam2:cpu"}
+
+
+def test_lru_eviction():
+    # room for two models of 1000 floats
+    registry = ModelRegistry(memory_budget_gb=8500 / 1024 ** 3)
+    model_a = registry.get("a", lambda: linear(1000))
+    registry.get("b", lambda: linear(1000))
+    # a is used again, so b is the least recently used one when c arrives
+    registry.get("a", lambda: linear(1000))
+    registry.get("c", lambda: linear(1000))
+    assert list(registry.models) == ["a", "c"]
+    assert registry.stats()["b"]["evictions"] == 1 and not registry.stats()["b"]["resident"]
+    assert registry.get("a", lambda: linear(1000)) is model_a
+    # an evicted model is loaded again on its next request
+    registry.get("b", lambda: linear(1000))
+    assert registry.stats()["b"]["loads"] == 2
+    assert list(registry.models) == ["a", "b"]
+
+    # a model larger than the whole budget is still returned and kept alone
+    registry.get("big", lambda: linear(10000))
+    assert list(registry.models) == ["big"]
+    registry.set_memory_budget(None)
+    registry.get("a", lambda: linear(1000))
+    assert list(registry.models) == ["big", "a"]
+
+
+@pytest.fixture
+def clip_registry(monkeypatch):
+    created = []
+
+    def fake_clip(device, backend):
+        created.append((device, backend))
+        return linear(10)
+
+    monkeypatch.setattr(myclip, "MyClip", fake_clip)
+    yield created
+    for key in list(model_registry.models):
+        if key.startswith("clip:"):
+            model_registry.evict(key)
+
+
+def test_get_clip_keys(clip_registry):
+    clip_cuda = myclip.get_clip(device="cuda", backend="eager")
+    clip_cpu = myclip.get_clip(device="cpu", backend="eager")
+    # eager CLIP is shared per device
+    assert clip_cuda is not clip_cpu
+    assert myclip.get_clip(device="cuda", backend="eager") is clip_cuda
+    # non-eager backends run on cpu whatever device is asked for
+    clip_int8 = myclip.get_clip(device="cuda", backend="cpu_int8")
+    assert myclip.get_clip(device="cpu", backend="cpu_int8") is clip_int8
+    assert clip_registry == [("cuda", "eager"), ("cpu", "eager"), ("cpu", "cpu_int8")]
+    assert "clip:cpu_int8:cpu" in model_registry.models
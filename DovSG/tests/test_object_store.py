@@ -0,0 +1,83 @@
+import copy
+import pickle
+import numpy as np
+import open3d as o3d
+import torch
+from dovsg.memory.instances.instance_utils import MapObjectList
+from dovsg.memory.instances.object_store import ObjectStore
+
+
+def random_objects(rng: np.random.Generator, num: int, height: int=24, width: int=32) -> MapObjectList:
+    objects = MapObjectList()
+    for k in range(num):
+        n = int(rng.integers(1, 4))
+        obj = {
+            "mask_idx": list(range(n)),
+            "image_name": [f"{i:06}" for i in rng.integers(0, 100, size=n)],
+            "class_name": "cup",
+            "class_id": f"cup_{k}",
+            "conf": np.float32(rng.random()),
+            "num_detections": n,
+            "mask": [rng.random((height, width)) < 0.2 for _ in range(n)],
+            "xyxy": [rng.random(4).astype(np.float32) for _ in range(n)],
+            "inst_color": rng.random(3),
+            "indexes": np.unique(rng.integers(0, 10 ** 6, size=rng.integers(0, 50))),
+            "clip_ft": torch.from_numpy(rng.random(16).astype(np.float32)),
+            "text_ft": torch.from_numpy(rng.random(16).astype(np.float32)),
+            "caption": {0: f"cup {k}"},
+        }
+        if k % 3 == 0:
+            obj["point_moments"] = rng.random(13)
+        if k % 3 == 1:
+            obj["bbox"] = o3d.geometry.OrientedBoundingBox(rng.random(3), np.eye(3), rng.random(3))
+        elif k % 3 == 2:
+            obj["bbox"] = o3d.geometry.AxisAlignedBoundingBox(-rng.random(3), rng.random(3))
+        objects.append(obj)
+    return objects
+
+
+def assert_same_object(a: dict, b: dict):
+    assert set(a) == set(b)
+    for k in a:
+        if k in ["mask", "xyxy"]:
+            assert all(np.array_equal(np.asarray(x), np.asarray(y)) for x, y in zip(a[k], b[k])), k
+        elif k == "bbox":
+            assert type(a[k]) is type(b[k])
+            assert np.array_equal(np.asarray(a[k].get_box_points()), np.asarray(b[k].get_box_points()))
+        elif isinstance(a[k], (np.ndarray, torch.Tensor)):
+            assert np.array_equal(np.asarray(a[k]), np.asarray(b[k])), k
+        else:
+            assert a[k] == b[k], k
+
+
+def test_object_store_round_trip():
+    objects = random_objects(np.random.default_rng(0), 30)
+    restored = ObjectStore.from_objects(objects).to_objects()
+    assert len(restored) == len(objects)
+    for a, b in zip(objects, restored):
+        assert_same_object(a, b)
+
+    # MapObjectList pickles through the store
+    restored = pickle.loads(pickle.dumps(objects))
+    assert isinstance(restored, MapObjectList)
+    for a, b in zip(objects, restored):
+        assert_same_object(a, b)
+
+
+def test_object_store_empty():
+    restored = pickle.loads(pickle.dumps(MapObjectList()))
+    assert isinstance(restored, MapObjectList) and len(restored) == 0
+
+
+def test_map_object_list_copies():
+    objects = random_objects(np.random.default_rng(1), 10)
+    # a shallow copy shares the dicts, without a round trip through ObjectStore
+    shallow = copy.copy(objects)
+    assert isinstance(shallow, MapObjectList) and shallow is not objects
+    assert all(a is b for a, b in zip(shallow, objects))
+
+    deep = copy.deepcopy(objects)
+    assert isinstance(deep, MapObjectList)
+    for a, b in zip(objects, deep):
+        assert a is not b and a["indexes"] is not b["indexes"]
+        assert_same_object(a, b)
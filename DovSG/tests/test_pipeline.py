@@ -0,0 +1,104 @@
+import queue
+import threading
+import time
+import pytest
+from dovsg.utils.pipeline import Stage, STOP, ordered_map
+
+
+def run_stages(items, funcs, queue_size: int=2):
+    '''chain of stages over bounded queues, returns the stages and what came out of the last one'''
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(funcs) + 1)]
+    stages = [Stage(func=func, in_queue=queues[k], out_queue=queues[k + 1], name=f"stage{k}")
+              for k, func in enumerate(funcs)]
+    for stage in stages:
+        stage.start()
+    outputs = []
+    # the last queue is drained by a stage too, so the producer below never blocks on it
+    collector = Stage(func=outputs.append, in_queue=queues[-1], name="collect")
+    collector.start()
+    for item in items:
+        queues[0].put(item)
+    queues[0].put(STOP)
+    for stage in stages + [collector]:
+        stage.join(timeout=10)
+        assert not stage.is_alive(), stage.name
+    return stages, outputs
+
+
+def test_stages_keep_order():
+    stages, outputs = run_stages(range(50), [lambda x: x + 1, lambda x: x * 2])
+    assert outputs == [(x + 1) * 2 for x in range(50)]
+    for stage in stages:
+        stage.check()
+
+
+def test_error_is_raised_in_caller():
+    def fail_on_3(x):
+        if x == 3:
+            raise ValueError("bad item")
+        return x
+
+    stages, outputs = run_stages(range(10), [fail_on_3])
+    # items before the failing one went through, nothing after it
+    assert outputs == [0, 1, 2]
+    with pytest.raises(RuntimeError, match="stage0") as info:
+        stages[0].join_and_check()
+    assert isinstance(info.value.__cause__, ValueError)
+
+
+def test_shutdown_after_failure():
+    def fail(x):
+        raise ValueError("bad item")
+
+    # the failed first stage keeps draining its bounded queue, so putting many more items than the
+    # queue holds does not block, and STOP still reaches the downstream stages which end cleanly
+    stages, outputs = run_stages(range(100), [fail, lambda x: x], queue_size=1)
+    assert outputs == []
+    with pytest.raises(RuntimeError):
+        stages[0].check()
+    stages[1].check()
+
+
+@pytest.mark.parametrize("num_workers", [0, 1, 4])
+def test_ordered_map_keeps_order(num_workers):
+    def slow_square(x):
+        # later items finish first
+        time.sleep(0.001 * (20 - x % 20))
+        return x * x
+    assert list(ordered_map(slow_square, range(60), num_workers)) == [x * x for x in range(60)]
+
+
+def test_ordered_map_bounds_the_look_ahead():
+    lock = threading.Lock()
+    started = []
+
+    def record(x):
+        with lock:
+            started.append(x)
+        return x
+
+    results = ordered_map(record, range(100), num_workers=2, max_pending=3)
+    for x in results:
+        time.sleep(0.001)
+        with lock:
+            # the item being consumed and at most max_pending submitted after it
+            assert max(started) <= x + 3
+    assert sorted(started) == list(range(100))
+
+
+def test_ordered_map_raises_and_stops():
+    started = []
+
+    def fail_at_5(x):
+        started.append(x)
+        if x == 5:
+            raise ValueError("bad item")
+        return x
+
+    outputs = []
+    with pytest.raises(ValueError):
+        for x in ordered_map(fail_at_5, range(1000), num_workers=2, max_pending=4):
+            outputs.append(x)
+    assert outputs == list(range(5))
+    # items after the failure were not all submitted
+    assert len(started) < 20
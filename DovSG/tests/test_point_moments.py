@@ -0,0 +1,83 @@
+import numpy as np
+import torch
+from dovsg.memory.instances.instance_process import InstanceProcess
+from dovsg.memory.instances.instance_utils import MapObjectList
+from conftest import random_blob
+
+
+def instance_process_on(view_dataset) -> InstanceProcess:
+    instance_process = InstanceProcess()
+    instance_process.view_dataset = view_dataset
+    return instance_process
+
+
+def make_object(instance_process: InstanceProcess, indexes: np.ndarray, conf: float=0.5) -> dict:
+    return {
+        "mask_idx": [0],
+        "image_name": ["000000"],
+        "class_name": "cup",
+        "class_id": "cup_0",
+        "conf": conf,
+        "num_detections": 1,
+        "mask": [np.ones((2, 2), dtype=bool)],
+        "xyxy": [np.zeros(4, dtype=np.float32)],
+        "inst_color": np.zeros(3),
+        "indexes": indexes,
+        "point_moments": instance_process.get_point_moments(indexes),
+        "bbox": instance_process.get_bounding_box(indexes),
+        "clip_ft": torch.ones(4),
+        "text_ft": torch.ones(4),
+        "caption": {0: "cup"},
+    }
+
+
+def assert_box_is_tight(view_dataset, bbox, indexes):
+    '''every voxel point inside the box, and the box touches the points on each side'''
+    points = view_dataset.index_to_point(indexes)
+    projections = (points - np.asarray(bbox.center)) @ np.asarray(bbox.R)
+    half_extent = np.asarray(bbox.extent) / 2
+    assert np.all(np.abs(projections) <= half_extent + 1e-9)
+    assert np.allclose(projections.max(axis=0), half_extent)
+    assert np.allclose(projections.min(axis=0), -half_extent)
+
+
+def test_moments_of_disjoint_sets_add_up(view_dataset):
+    instance_process = instance_process_on(view_dataset)
+    rng = np.random.default_rng(0)
+    a, b = random_blob(view_dataset, rng), random_blob(view_dataset, rng)
+    union = np.union1d(a, b)
+    added = np.setdiff1d(b, a)
+    assert np.array_equal(instance_process.get_point_moments(a) + instance_process.get_point_moments(added),
+                          instance_process.get_point_moments(union))
+
+
+def test_merged_moments_and_box_match_a_recompute(view_dataset):
+    instance_process = instance_process_on(view_dataset)
+    rng = np.random.default_rng(1)
+    for _ in range(10):
+        a, b = random_blob(view_dataset, rng), random_blob(view_dataset, rng, max_size=3)
+        # overlapping sets, so the voxels obj1 already has are not counted twice
+        b = np.union1d(b, a[::3])
+        merged = instance_process.merge_obj_to_obj(make_object(instance_process, a), make_object(instance_process, b),
+                                                   run_dbscan=False)
+        assert np.array_equal(merged["indexes"], np.union1d(a, b))
+        point_moments = instance_process.get_point_moments(merged["indexes"])
+        assert np.array_equal(merged["point_moments"], point_moments)
+        expected = instance_process.get_moments_bounding_box(merged["indexes"], point_moments)
+        assert np.allclose(merged["bbox"].get_box_points(), expected.get_box_points())
+        assert_box_is_tight(view_dataset, merged["bbox"], merged["indexes"])
+
+
+def test_load_objects_keeps_or_recomputes_boxes(view_dataset):
+    instance_process = instance_process_on(view_dataset)
+    rng = np.random.default_rng(2)
+    kept, shrunk = [make_object(instance_process, random_blob(view_dataset, rng)) for _ in range(2)]
+    shrunk["class_id"] = "cup_1"
+    kept_box = kept["bbox"]
+    # voxels removed after the box was computed
+    shrunk["indexes"] = shrunk["indexes"][: len(shrunk["indexes"]) // 2]
+    objects, _ = instance_process.load_objects(MapObjectList([kept, shrunk]), {})
+    assert objects[0]["bbox"] is kept_box
+    assert np.array_equal(objects[1]["point_moments"], instance_process.get_point_moments(objects[1]["indexes"]))
+    assert np.allclose(objects[1]["bbox"].get_box_points(),
+                       instance_process.get_bounding_box(objects[1]["indexes"]).get_box_points())
@@ -0,0 +1,41 @@
+import numpy as np
+from dovsg.memory.ram_tags import RamTagCache, merge_tags
+from dovsg.utils.utils import get_image_hash
+
+
+def test_merge_tags():
+    assert merge_tags("cup | table", "table | chair", "") == "cup | table | chair"
+    assert merge_tags("", "") == ""
+
+
+def test_hits_and_misses(tmp_path):
+    cache = RamTagCache(cache_path=tmp_path / "ram_tags.json")
+    image = np.zeros((4, 6, 3), dtype=np.uint8)
+    key = f"eager:{get_image_hash(image)}"
+    assert cache.get(key) is None
+    cache.update(key, "cup | table")
+    assert cache.get(key) == "cup | table"
+    # the key follows the image content, not the array object
+    assert cache.get(f"eager:{get_image_hash(image.copy())}") == "cup | table"
+    assert cache.get(f"eager:{get_image_hash(np.ones_like(image))}") is None
+    assert cache.get(f"cpu_int8:{get_image_hash(image)}") is None
+    assert (cache.hits, cache.misses) == (2, 3)
+
+
+def test_writes_are_batched_and_persisted(tmp_path):
+    cache_path = tmp_path / "ram_tags.json"
+    cache = RamTagCache(cache_path=cache_path, save_interval=2)
+    cache.update("a", "cup")
+    # nothing written before save_interval tags are pending
+    assert not cache_path.exists()
+    cache.update("b", "table")
+    assert cache_path.exists() and cache.pending == 0
+    modified = cache_path.stat().st_mtime_ns
+    cache.save()
+    assert cache_path.stat().st_mtime_ns == modified
+
+    cache.update("c", "chair")
+    cache.save()
+    reloaded = RamTagCache(cache_path=cache_path)
+    assert [reloaded.get(key) for key in "abc"] == ["cup", "table", "chair"]
+    assert reloaded.misses == 0
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+import torch
+
+pytest.importorskip("sam2")
+pytest.importorskip("groundingdino")
+from dovsg.perception.models.mygroundingdinosam2 import MyGroundingDINOSAM2, Sam2EmbeddingCache
+
+
+def fake_features(seed: int) -> dict:
+    generator = torch.Generator().manual_seed(seed)
+    return {
+        "image_embed": torch.randn(1, 4, 2, 2, generator=generator),
+        "high_res_feats": [torch.randn(1, 2, 4, 4, generator=generator), torch.randn(1, 2, 3, 3, generator=generator)]
+    }
+
+
+def test_lru_keeps_16_frames():
+    cache = Sam2EmbeddingCache()
+    assert cache.max_items == 16
+    for k in range(16):
+        cache.put(f"frame{k}", fake_features(k))
+    # frame0 is used again, so frame1 is the least recently used one
+    assert cache.get("frame0") is not None
+    cache.put("frame16", fake_features(16))
+    assert len(cache.features) == 16
+    assert cache.get("frame1") is None
+    assert all(cache.get(f"frame{k}") is not None for k in [0] + list(range(2, 17)))
+    assert (cache.hits, cache.misses) == (17, 1)
+
+
+def test_disk_round_trip(tmp_path):
+    features = fake_features(0)
+    Sam2EmbeddingCache().put("frame", features, cache_dir=tmp_path)
+    # a new process only finds the fp16 copy on disk
+    cache = Sam2EmbeddingCache()
+    loaded = cache.get("frame", cache_dir=tmp_path, device="cpu")
+    assert (cache.disk_hits, cache.misses) == (1, 0)
+    assert loaded["image_embed"].dtype == torch.float32
+    assert torch.equal(loaded["image_embed"], features["image_embed"].half().float())
+    for loaded_feat, feat in zip(loaded["high_res_feats"], features["high_res_feats"]):
+        assert torch.equal(loaded_feat, feat.half().float())
+    # afterwards it is kept in memory
+    assert cache.get("frame", cache_dir=tmp_path, device="cpu") is loaded
+    assert cache.hits == 1
+    assert cache.get("other", cache_dir=tmp_path, device="cpu") is None
+
+
+@pytest.fixture(scope="module")
+def tiny_sam2():
+    '''MyGroundingDINOSAM2 with only a randomly initialized tiny SAM2 predictor, no checkpoint is loaded'''
+    from sam2.build_sam import build_sam2
+    from sam2.sam2_image_predictor import SAM2ImagePredictor
+    torch.manual_seed(0)
+    mygroundingdino_sam2 = MyGroundingDINOSAM2.__new__(MyGroundingDINOSAM2)
+    mygroundingdino_sam2.device = "cpu"
+    mygroundingdino_sam2.embedding_cache_dir = None
+    mygroundingdino_sam2.sam2_predictor = SAM2ImagePredictor(build_sam2("sam2_hiera_t.yaml", None, device="cpu"))
+    return mygroundingdino_sam2
+
+
+def test_hit_restores_predictor_state(tiny_sam2):
+    tiny_sam2.embedding_cache = Sam2EmbeddingCache()
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 255, size=(48, 64, 3), dtype=np.uint8)
+    other_image = rng.integers(0, 255, size=(40, 72, 3), dtype=np.uint8)
+    xyxy = np.array([[4, 6, 30, 40], [20, 10, 60, 44]], dtype=np.float32)
+
+    masks = tiny_sam2.get_sam2_segmentation_from_xyxy(image, xyxy)
+    tiny_sam2.get_sam2_segmentation_from_xyxy(other_image, xyxy)
+    assert tiny_sam2.sam2_predictor._orig_hw == [(40, 72)]
+    assert tiny_sam2.embedding_cache.misses == 2
+
+    # the first image is a hit, its size comes back with its features and the masks are the same
+    cached_masks = tiny_sam2.get_sam2_segmentation_from_xyxy(image.copy(), xyxy)
+    assert tiny_sam2.embedding_cache.hits == 1
+    assert tiny_sam2.sam2_predictor._orig_hw == [(48, 64)]
+    assert cached_masks.shape == (2, 48, 64)
+    assert np.array_equal(cached_masks, masks)
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+import torch
+from dovsg.memory.instances.instance_process import InstanceProcess
+
+
+def thresholded(instance_process: InstanceProcess, spatial_sim, visual_sim, text_sim):
+    '''agg_sim as get_instances hands it to merge_detections_to_objects'''
+    agg_sim = instance_process.aggregate_similarities(spatial_sim, visual_sim, text_sim)
+    agg_sim[agg_sim < instance_process.sim_threshold] = float('-inf')
+    return agg_sim
+
+
+def random_similarities(rng: np.random.Generator, num_detections: int, num_objects: int):
+    '''(M, N) similarities like compute_*_similarities, with many pairs right at the bound'''
+    shape = (num_detections, num_objects)
+    spatial_sim = np.where(rng.random(shape) < 0.5, 0.0, rng.random(shape))
+    visual_sim = rng.uniform(-0.2, 1.0, size=shape).astype(np.float32)
+    text_sim = rng.uniform(-0.2, 1.0, size=shape).astype(np.float32)
+    # 0.5 + 0.4 * 0.625 + 0.1 * 0 is exactly sim_threshold, and spatial 1 reaches it
+    at_bound = rng.random(shape) < 0.2
+    visual_sim[at_bound], text_sim[at_bound] = 0.625, 0.0
+    spatial_sim[at_bound & (rng.random(shape) < 0.5)] = 1.0
+    return torch.from_numpy(spatial_sim), torch.from_numpy(visual_sim), torch.from_numpy(text_sim)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("with_candidates", [False, True])
+def test_cascade_keeps_the_match_decisions(seed, with_candidates):
+    instance_process = InstanceProcess()
+    rng = np.random.default_rng(seed)
+    spatial_sim, visual_sim, text_sim = random_similarities(rng, 12, 40)
+    pairs = None
+    if with_candidates:
+        # spatial hash candidates: the other pairs have no spatial overlap and zero feature similarities
+        pairs = np.argwhere(rng.random((40, 12)) < 0.6)
+        candidate = torch.zeros(spatial_sim.shape, dtype=torch.bool)
+        candidate[pairs[:, 1], pairs[:, 0]] = True
+        spatial_sim[~candidate], visual_sim[~candidate], text_sim[~candidate] = 0, 0, 0
+    expected = thresholded(instance_process, spatial_sim, visual_sim, text_sim)
+    assert torch.isfinite(expected).any()
+
+    bound_pairs = instance_process.score_bound_pairs(visual_sim, text_sim, pairs)
+    assert len(bound_pairs) < 12 * 40
+    # spatial similarities are only computed for the kept (object, detection) pairs
+    cascade_spatial_sim = torch.zeros(spatial_sim.shape, dtype=spatial_sim.dtype)
+    cascade_spatial_sim[bound_pairs[:, 1], bound_pairs[:, 0]] = spatial_sim[bound_pairs[:, 1], bound_pairs[:, 0]]
+    assert torch.equal(thresholded(instance_process, cascade_spatial_sim, visual_sim, text_sim), expected)
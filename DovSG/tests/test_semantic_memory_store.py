@@ -0,0 +1,139 @@
+import numpy as np
+import pytest
+from dovsg.memory.semantic_memory_store import SemanticMemoryWriter, SemanticMemoryStore, RLEMask, encode_mask, decode_mask
+from conftest import make_recording
+
+
+def random_det_res(rng: np.random.Generator, n: int, height: int=24, width: int=32, feature_dim: int=8) -> dict:
+    return {
+        "xyxy": rng.uniform(0, width, size=(n, 4)).astype(np.float32),
+        "confidence": rng.uniform(0.3, 1.0, size=n).astype(np.float32),
+        "class_id": rng.integers(0, 3, size=n),
+        "mask": rng.random((n, height, width)) < 0.3,
+        "classes": ["cup", "table", "chair"],
+        # fp16 values, so the container stores them exactly
+        "image_feats": rng.normal(size=(n, feature_dim)).astype(np.float16).astype(np.float32),
+        "text_feats": rng.normal(size=(n, feature_dim)).astype(np.float16).astype(np.float32),
+    }
+
+
+def assert_same_det_res(loaded: dict, det_res: dict):
+    for k in ["xyxy", "confidence", "class_id", "image_feats", "text_feats"]:
+        assert np.array_equal(loaded[k], det_res[k]), k
+    assert loaded["classes"] == det_res["classes"]
+    if len(det_res["xyxy"]) > 0:
+        assert np.array_equal(loaded["mask"], det_res["mask"])
+
+
+def edge_case_masks(height: int=12, width: int=16) -> list:
+    masks = [np.zeros((height, width), dtype=bool), np.ones((height, width), dtype=bool)]
+    for y, x in [(0, 0), (height - 1, width - 1), (5, 7)]:
+        mask = np.zeros((height, width), dtype=bool)
+        mask[y, x] = True
+        masks.append(mask)
+    # a crop with a cleared corner, its transpose (crop starting with False), a diagonal, a sparse row and column
+    mask = np.zeros((height, width), dtype=bool)
+    mask[2:6, 3:9] = True
+    mask[5, 3] = False
+    masks += [mask, mask.T[:height, :width].copy(), np.eye(height, width, dtype=bool)]
+    row = np.zeros((height, width), dtype=bool)
+    row[4, 2:11:2] = True
+    masks += [row, row.T[:height, :width].copy()]
+    return masks
+
+
+@pytest.mark.parametrize("density", [0.05, 0.5, 0.95])
+def test_rle_round_trip(density):
+    rng = np.random.default_rng(0)
+    masks = edge_case_masks() + list(rng.random((20, 12, 16)) < density)
+    for mask in masks:
+        box, runs = encode_mask(mask)
+        assert np.array_equal(decode_mask(box, runs, *mask.shape), mask)
+        rle_mask = RLEMask(mask)
+        assert rle_mask.shape == mask.shape
+        assert rle_mask.area() == mask.sum()
+        assert np.array_equal(np.asarray(rle_mask), mask)
+        assert np.asarray(rle_mask, dtype=np.uint8).dtype == np.uint8
+
+
+def test_rle_crop_and_runs():
+    mask = np.zeros((6, 8), dtype=bool)
+    mask[1:3, 2:5] = True
+    mask[1, 2] = False
+    box, runs = encode_mask(mask)
+    # x_min, y_min, x_max, y_max (exclusive) of the content
+    assert np.array_equal(box, [2, 1, 5, 3])
+    # row-major crop FTT TTT, runs alternate starting with False
+    assert np.array_equal(runs, [1, 5])
+    mask[1, 2] = True
+    assert np.array_equal(encode_mask(mask)[1], [0, 6])
+
+
+def test_writer_store_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    frames = {f"{i:06}": random_det_res(rng, n) for i, n in enumerate([3, 0, 1, 5, 2])}
+    with SemanticMemoryWriter(tmp_path / "semantic_memory", chunk_size=2) as writer:
+        for name, det_res in frames.items():
+            writer.add(name, det_res)
+    assert sorted(p.name for p in (tmp_path / "semantic_memory").iterdir()) == ["shard_00000", "shard_00001", "shard_00002"]
+
+    store = SemanticMemoryStore(tmp_path / "semantic_memory")
+    assert store.names == list(frames)
+    for name, det_res in frames.items():
+        loaded = store.load(name)
+        assert len(loaded["xyxy"]) == len(det_res["xyxy"])
+        assert_same_det_res(loaded, det_res)
+        assert store.get_classes(name) == det_res["classes"]
+
+
+def test_recording_round_trip(tmp_path):
+    view_dataset = make_recording(tmp_path, num_frames=8)
+    store = SemanticMemoryStore(tmp_path / "semantic_memory")
+    assert store.names == view_dataset.names
+    for name, mapping in zip(view_dataset.names, view_dataset.pixel_index_mappings):
+        det_res = store.load(name)
+        assert det_res["mask"].shape[1:] == mapping.shape
+        assert len(det_res["mask"]) == len(det_res["class_id"]) > 0
+
+
+def test_writer_keeps_completed_frames_on_error(tmp_path):
+    rng = np.random.default_rng(1)
+    frames = {f"{i:06}": random_det_res(rng, 2) for i in range(3)}
+    with pytest.raises(ValueError):
+        with SemanticMemoryWriter(tmp_path / "semantic_memory") as writer:
+            for name, det_res in frames.items():
+                writer.add(name, det_res)
+            # a broken frame fails in add() and must not leave partial rows behind
+            writer.add("broken", dict(random_det_res(rng, 2), xyxy=np.zeros(3)))
+
+    store = SemanticMemoryStore(tmp_path / "semantic_memory")
+    assert store.names == list(frames)
+    for name, det_res in frames.items():
+        assert_same_det_res(store.load(name), det_res)
+
+
+def test_killed_writer_keeps_complete_shards(tmp_path):
+    rng = np.random.default_rng(2)
+    frames = {f"{i:06}": random_det_res(rng, 1) for i in range(5)}
+    # the process dies without close(): full shards are on disk, the partial one is lost
+    writer = SemanticMemoryWriter(tmp_path / "semantic_memory", chunk_size=2)
+    for name, det_res in frames.items():
+        writer.add(name, det_res)
+    # and a shard that was being written when it died
+    (tmp_path / "semantic_memory" / "shard_00002.tmp").mkdir()
+    store = SemanticMemoryStore(tmp_path / "semantic_memory")
+    assert store.names == list(frames)[:4]
+
+    # a resumed writer drops the unfinished shard and appends after the complete ones
+    with SemanticMemoryWriter(tmp_path / "semantic_memory", chunk_size=2, resume=True) as writer:
+        writer.add("000004", frames["000004"])
+    assert not (tmp_path / "semantic_memory" / "shard_00002.tmp").exists()
+    store = SemanticMemoryStore(tmp_path / "semantic_memory")
+    assert store.names == list(frames)
+    for name, det_res in frames.items():
+        assert_same_det_res(store.load(name), det_res)
+
+    # a fresh writer starts over
+    with SemanticMemoryWriter(tmp_path / "semantic_memory", chunk_size=2) as writer:
+        writer.add("000000", frames["000000"])
+    assert SemanticMemoryStore(tmp_path / "semantic_memory").names == ["000000"]
@@ -0,0 +1,52 @@
+import numpy as np
+from dovsg.memory.instances.instance_process import InstanceProcess
+from dovsg.memory.instances.instance_utils import SpatialHash
+from conftest import random_blob
+
+
+def overlapping_pairs(view_dataset, objects, detections, radius):
+    instance_process = InstanceProcess(downsample_voxel_size=radius)
+    instance_process.view_dataset = view_dataset
+    pairs = np.argwhere(np.ones((len(objects), len(detections)), dtype=bool))
+    ratios = instance_process.compute_voxel_overlap([obj["indexes"] for obj in objects],
+                                                    [det["indexes"] for det in detections], pairs)
+    return pairs[ratios > 0]
+
+
+def test_candidate_pairs_cover_all_overlapping_pairs(view_dataset):
+    rng = np.random.default_rng(0)
+    objects = [{"indexes": random_blob(view_dataset, rng, num=50, max_size=3)} for _ in range(60)]
+    detections = [{"indexes": random_blob(view_dataset, rng, num=50, max_size=3)} for _ in range(15)]
+    cell_size = 4
+    spatial_hash = SpatialHash(view_dataset, cell_size=cell_size)
+    for _ in range(3):
+        spatial_hash.update(objects)
+        candidates = spatial_hash.candidate_pairs(detections)
+        assert np.array_equal(candidates, candidates[np.lexsort((candidates[:, 1], candidates[:, 0]))])
+        assert len(np.unique(candidates, axis=0)) == len(candidates)
+        # every pair within the tolerance the cells cover is a candidate, and the hash does prune
+        overlapping = overlapping_pairs(view_dataset, objects, detections, cell_size * view_dataset.resolution)
+        assert len(overlapping) > 0
+        assert set(map(tuple, overlapping)) <= set(map(tuple, candidates))
+        assert len(candidates) < len(objects) * len(detections)
+
+        # changed, added and removed objects are re-hashed on the next update
+        objects[5] = {"indexes": random_blob(view_dataset, rng, num=50, max_size=3)}
+        objects.append({"indexes": random_blob(view_dataset, rng, num=50, max_size=3)})
+        del objects[7]
+
+
+def test_candidates_match_occupied_cells(view_dataset):
+    rng = np.random.default_rng(1)
+    objects = [{"indexes": random_blob(view_dataset, rng, num=30, max_size=2)} for _ in range(20)]
+    spatial_hash = SpatialHash(view_dataset, cell_size=4)
+    spatial_hash.update(objects)
+    query = objects[3]["indexes"]
+    expected = []
+    query_cells = view_dataset.index_to_voxel(query) // 4
+    for i, obj in enumerate(objects):
+        cells = view_dataset.index_to_voxel(obj["indexes"]) // 4
+        # cells at most one apart on every axis
+        if np.any(np.abs(query_cells[:, None, :] - cells[None, :, :]).max(axis=-1) <= 1):
+            expected.append(i)
+    assert np.array_equal(spatial_hash.candidates(query), expected)
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from scipy.spatial import cKDTree
+from sklearn.cluster import DBSCAN
+from sklearn.neighbors import NearestNeighbors
+from dovsg.memory.instances.instance_utils import voxel_dbscan
+from conftest import make_view_dataset
+
+
+def squared_distances(voxels: np.ndarray) -> np.ndarray:
+    return ((voxels[:, None] - voxels[None]) ** 2).sum(axis=-1)
+
+
+def exact_labels(voxels: np.ndarray, min_samples: int, sample_rate: float) -> np.ndarray:
+    '''sklearn DBSCAN on exact integer squared voxel distances, pairs at eps included'''
+    distances, _ = cKDTree(voxels).query(voxels, k=min_samples)
+    eps_squared = np.sort(np.rint(distances[:, -1] ** 2))[int(len(voxels) * sample_rate)]
+    return DBSCAN(eps=eps_squared, min_samples=min_samples, metric="precomputed").fit(
+        squared_distances(voxels).astype(np.float64)).labels_
+
+
+def baseline_labels(points: np.ndarray, min_samples: int, sample_rate: float):
+    '''the clustering of InstanceProcess.indexes_denoise_dbscan before the voxel grid version, and its eps'''
+    distances, _ = NearestNeighbors(n_neighbors=min_samples).fit(points).kneighbors(points)
+    eps = np.sort(distances[:, -1])[int(len(points) * sample_rate)]
+    return DBSCAN(eps=eps, min_samples=min_samples).fit(points).labels_, eps
+
+
+def clusters(rng: np.random.Generator, num_clusters: int, spread: int, num: int=300) -> np.ndarray:
+    voxels = [rng.integers(20, 80, size=3) + rng.integers(-spread, spread + 1, size=(num, 3)) for _ in range(num_clusters)]
+    # scattered noise voxels
+    voxels.append(rng.integers(0, 100, size=(num // 10, 3)))
+    return np.unique(np.concatenate(voxels), axis=0)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("spread", [3, 6, 12])
+def test_voxel_dbscan_matches_exact_dbscan(seed, spread):
+    rng = np.random.default_rng(seed)
+    voxels = rng.permutation(clusters(rng, num_clusters=3, spread=spread))
+    labels = voxel_dbscan(voxels, min_samples=10, sample_rate=0.95)
+    assert np.array_equal(labels, exact_labels(voxels, 10, 0.95))
+
+
+def test_voxel_dbscan_sparse_voxels():
+    # eps beyond max_radius voxels takes the pair query path
+    rng = np.random.default_rng(0)
+    voxels = np.unique(rng.integers(0, 200, size=(300, 3)), axis=0)
+    labels = voxel_dbscan(voxels, min_samples=10, sample_rate=0.95, max_radius=3)
+    assert np.array_equal(labels, exact_labels(voxels, 10, 0.95))
+
+
+def test_pairs_at_eps_are_neighbors():
+    # every voxel's nearest other voxel is exactly 2 voxels away, so eps is 2 voxels
+    voxels = np.array([[0, 0, 0], [2, 0, 0], [10, 0, 0], [12, 0, 0]])
+    assert np.array_equal(voxel_dbscan(voxels, min_samples=2, sample_rate=0.5), [0, 0, 1, 1])
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("spread", [3, 6, 12])
+def test_voxel_dbscan_differs_from_baseline_only_at_eps(seed, spread):
+    # sklearn on float voxel points with the same eps: distances exactly at eps may round either way,
+    # so labels can only differ on voxels with another voxel exactly eps away
+    view_dataset = make_view_dataset(voxel_num=(100, 100, 100))
+    rng = np.random.default_rng(seed)
+    voxels = rng.permutation(clusters(rng, num_clusters=3, spread=spread))
+    labels, eps = baseline_labels(view_dataset.voxel_to_point(voxels), 10, 0.95)
+    differ = voxel_dbscan(voxels, min_samples=10, sample_rate=0.95) != labels
+    eps_squared = np.rint((eps / view_dataset.resolution) ** 2)
+    at_eps = (squared_distances(voxels) == eps_squared).any(axis=1)
+    assert not np.any(differ & ~at_eps)
+    assert differ.mean() < 0.01
@@ -0,0 +1,151 @@
+import faiss
+import numpy as np
+import pytest
+from scipy.spatial import cKDTree
+from dovsg.memory.instances.instance_process import InstanceProcess
+from dovsg.memory.instances.instance_utils import voxel_overlap_ratios
+from conftest import random_blob
+
+
+def brute_force_overlap(view_dataset, indexes_a, indexes_b, pairs, radius_voxels):
+    '''ratio of voxels of b strictly closer than radius_voxels to a voxel of a, on integer voxel coordinates'''
+    ratios = []
+    for i, j in pairs:
+        distances, _ = cKDTree(view_dataset.index_to_voxel(indexes_a[i])).query(view_dataset.index_to_voxel(indexes_b[j]))
+        ratios.append(np.mean(distances < radius_voxels - 1e-9))
+    return np.array(ratios)
+
+
+def faiss_overlap(view_dataset, indexes_a, indexes_b, pairs, radius):
+    '''the per-pair FAISS search compute_overlap_matrix_2set used before'''
+    ratios = []
+    for i, j in pairs:
+        index = faiss.IndexFlatL2(3)
+        index.add(view_dataset.index_to_point(indexes_a[i]).astype(np.float32))
+        D, _ = index.search(view_dataset.index_to_point(indexes_b[j]).astype(np.float32), 1)
+        ratios.append((D < radius ** 2).sum() / len(indexes_b[j]))
+    return np.array(ratios)
+
+
+@pytest.mark.parametrize("radius_voxels, num_offsets", [
+    # only the voxel itself at tolerance == resolution, offsets exactly at the radius are excluded
+    (1, 1), (1.2, 7), (np.sqrt(2), 7), (1.5, 19), (np.sqrt(3), 19), (2, 27), (0.5, 1)
+])
+def test_neighbor_offsets_are_strictly_inside_the_radius(view_dataset, radius_voxels, num_offsets):
+    offsets = view_dataset.neighbor_offsets(view_dataset.resolution * radius_voxels)
+    assert len(offsets) == num_offsets
+    assert np.array_equal(offsets[0], [0, 0, 0])
+    assert np.all(np.linalg.norm(offsets, axis=1) < radius_voxels)
+
+
+def test_index_neighbors_outside_the_grid(view_dataset):
+    corner = view_dataset.voxel_to_index(np.array([[0, 0, 0]]))
+    neighbors = view_dataset.index_neighbors(corner, view_dataset.resolution * 1.2)
+    assert neighbors.shape == (1, 7)
+    # three of the face neighbors of the corner voxel are outside the bounds
+    assert np.sum(neighbors == -1) == 3
+
+
+@pytest.mark.parametrize("radius_voxels", [1, 1.5, 2.5])
+def test_voxel_overlap_matches_brute_force(view_dataset, radius_voxels):
+    rng = np.random.default_rng(0)
+    indexes_a = [random_blob(view_dataset, rng) for _ in range(6)]
+    indexes_b = [random_blob(view_dataset, rng, num=100) for _ in range(5)]
+    pairs = np.argwhere(np.ones((len(indexes_a), len(indexes_b)), dtype=bool))
+    expected = brute_force_overlap(view_dataset, indexes_a, indexes_b, pairs, radius_voxels)
+    assert np.any(expected > 0)
+
+    instance_process = InstanceProcess(downsample_voxel_size=radius_voxels * view_dataset.resolution)
+    instance_process.view_dataset = view_dataset
+    assert np.allclose(instance_process.compute_voxel_overlap(indexes_a, indexes_b, pairs), expected)
+
+
+@pytest.mark.parametrize("radius_voxels", [1.5, 2.5])
+def test_voxel_overlap_matches_faiss(view_dataset, radius_voxels):
+    # away from ties float32 rounding does not matter and the FAISS pass gives the same ratios
+    rng = np.random.default_rng(2)
+    indexes_a = [random_blob(view_dataset, rng) for _ in range(5)]
+    indexes_b = [random_blob(view_dataset, rng, num=100) for _ in range(5)]
+    pairs = np.argwhere(np.ones((len(indexes_a), len(indexes_b)), dtype=bool))
+    radius = radius_voxels * view_dataset.resolution
+    instance_process = InstanceProcess(downsample_voxel_size=radius)
+    instance_process.view_dataset = view_dataset
+    expected = faiss_overlap(view_dataset, indexes_a, indexes_b, pairs, radius)
+    assert np.any(expected > 0)
+    assert np.array_equal(instance_process.compute_voxel_overlap(indexes_a, indexes_b, pairs), expected)
+
+
+def test_voxel_overlap_ratios_of_a_subset_of_pairs(view_dataset):
+    rng = np.random.default_rng(1)
+    indexes_a = [random_blob(view_dataset, rng) for _ in range(4)]
+    indexes_b = [random_blob(view_dataset, rng) for _ in range(4)] + [np.zeros(0, dtype=np.int64)]
+    pairs = np.array([[0, 0], [3, 1], [1, 4], [3, 3]])
+    # plain indexes as neighborhoods of size 1: the ratio of shared voxels
+    ratios = voxel_overlap_ratios(indexes_a, [indexes[:, None] for indexes in indexes_b], pairs)
+    expected = [np.isin(indexes_b[j], indexes_a[i]).mean() for i, j in pairs[[0, 1, 3]]]
+    assert np.allclose(ratios[[0, 1, 3]], expected)
+    # an empty set has nothing to cover
+    assert ratios[2] == 0
+
+
+def blob_objects(view_dataset, rng, num_objects: int):
+    '''objects holding a random blob of voxel indexes and its axis aligned bounds'''
+    import open3d as o3d
+    from dovsg.memory.instances.instance_utils import MapObjectList
+    objects = MapObjectList()
+    for _ in range(num_objects):
+        indexes = random_blob(view_dataset, rng, num=150, max_size=4)
+        pcd = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(view_dataset.index_to_point(indexes)))
+        objects.append({"indexes": indexes, "bbox": pcd.get_axis_aligned_bounding_box()})
+    return objects
+
+
+def baseline_overlap_matrix(instance_process, objects):
+    '''compute_overlap_matrix before the voxel version: a FAISS search per pair of overlapping bounds'''
+    view_dataset = instance_process.view_dataset
+    n = len(objects)
+    overlap_matrix = np.zeros((n, n))
+    for i in range(n):
+        for j in range(n):
+            if i == j or instance_process.compute_3d_iou(objects[i]["bbox"], objects[j]["bbox"]) == 0:
+                continue
+            overlap_matrix[i, j] = faiss_overlap(view_dataset, [objects[j]["indexes"]], [objects[i]["indexes"]],
+                                                 [(0, 0)], instance_process.downsample_voxel_size)[0]
+    return overlap_matrix
+
+
+def overlap_pairs_matrix(instance_process, objects):
+    x, y, ratio = instance_process.compute_overlap_pairs(objects)
+    overlap_matrix = np.zeros((len(objects), len(objects)))
+    overlap_matrix[x, y] = ratio
+    # row major order like np.nonzero of the dense matrix
+    assert np.array_equal(np.stack([x, y]), np.stack(np.nonzero(overlap_matrix)))
+    return overlap_matrix
+
+
+def test_overlap_pairs_match_the_faiss_matrix_away_from_ties(view_dataset):
+    rng = np.random.default_rng(3)
+    instance_process = InstanceProcess(downsample_voxel_size=1.5 * view_dataset.resolution)
+    instance_process.view_dataset = view_dataset
+    objects = blob_objects(view_dataset, rng, 12)
+    expected = baseline_overlap_matrix(instance_process, objects)
+    assert np.count_nonzero(expected) > 0
+    assert np.array_equal(overlap_pairs_matrix(instance_process, objects), expected)
+
+
+def test_overlap_pairs_at_the_voxel_size(view_dataset):
+    # downsample_voxel_size == resolution: a voxel only covers itself, while the float32 FAISS pass
+    # counted face neighbors whose squared distance rounded below the threshold
+    rng = np.random.default_rng(4)
+    instance_process = InstanceProcess(downsample_voxel_size=view_dataset.resolution)
+    instance_process.view_dataset = view_dataset
+    objects = blob_objects(view_dataset, rng, 12)
+    overlap_matrix = overlap_pairs_matrix(instance_process, objects)
+    pairs = np.argwhere(~np.eye(len(objects), dtype=bool))
+    indexes = objects.get_values("indexes")
+    expected = brute_force_overlap(view_dataset, indexes, indexes, pairs[:, ::-1], 1)
+    # like before, objects whose bounds only touch are not compared
+    expected[[instance_process.compute_3d_iou(objects[i]["bbox"], objects[j]["bbox"]) == 0 for i, j in pairs]] = 0
+    assert np.count_nonzero(expected) > 0
+    assert np.array_equal(overlap_matrix[pairs[:, 0], pairs[:, 1]], expected)
+    assert np.all(overlap_matrix <= baseline_overlap_matrix(instance_process, objects))